@@ -0,0 +1,266 @@
+"""
+Micro-benchmarks dos handlers do bot.
+
+Roda cada handler com objetos falsos (ver fakes.py), sem rede, e mede a
+latência por chamada e o pico de memória alocada por chamada. Os resultados
+são comparados com bench/baselines.json; se algum caso piorar além da
+tolerância, o script termina com código 1.
+
+Uso:
+    python bench/bench_handlers.py                     # compara com o baseline
+    python bench/bench_handlers.py --update-baseline   # grava um novo baseline
+    python bench/bench_handlers.py --only listar       # só casos com 'listar' no nome
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+
+import main  # noqa: E402
+from database import Database, init_database, save_study_schedules, save_sleep_schedules  # noqa: E402
+from periods import period_minutes  # noqa: E402
+from fakes import FakeUpdate, FakeContext, FakeUser  # noqa: E402
+
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baselines.json')
+
+# Usuário com histórico longo, para as listagens
+HEAVY_USER = FakeUser(2000, "Heavy")
+HEAVY_ROWS = 5000
+
+
+def study_user_data(user):
+    return {
+        'user_id': user.id,
+        'user_name': user.first_name,
+        'discipline': 'Cálculo',
+        'start_time': '14:00',
+        'end_time': '15:30',
+        'selected_date': '2024-05-01',
+    }
+
+
+def build_cases(bot_data):
+    """
+    Retorna os casos de benchmark: nome -> função que cria (corrotina ou None).
+
+    Cada chamada da fábrica monta um update e um contexto novos, de forma que
+    as chamadas sejam independentes entre si.
+    """
+    cache = bot_data['cache']
+
+    def handler(fn, make_update, make_user_data=dict, clear_cache=False):
+        def factory():
+            if clear_cache:
+                cache.invalidate_pages(HEAVY_USER.id, 'estudo')
+                cache.invalidate_pages(HEAVY_USER.id, 'sono')
+                # Versão que nunca coincide com a do banco: força o recálculo
+                cache.set_insights(HEAVY_USER.id, None, None)
+            update = make_update()
+            context = FakeContext(bot_data, make_user_data())
+            return fn(update, context)
+        return factory
+
+    async def timer_session(update, context):
+        # Estudo de 50 minutos: inicia, antecipa o início e encerra com a performance
+        await main.iniciar_estudo(update, context)
+        bot_data['timers'].get(update.effective_user.id, 'estudo').started_at -= 3000
+        await main.parar(FakeUpdate.text('/parar 80%'), context)
+
+    def sync(fn):
+        def factory():
+            fn()
+            return None
+        return factory
+
+    return {
+        'get_start_time_valid': handler(main.get_start_time, lambda: FakeUpdate.text('14:00')),
+        'get_start_time_invalid': handler(main.get_start_time, lambda: FakeUpdate.text('25:99')),
+        'get_end_time_valid': handler(main.get_end_time, lambda: FakeUpdate.text('15:30')),
+        'get_end_time_invalid': handler(main.get_end_time, lambda: FakeUpdate.text('abc')),
+        'generate_date_keyboard': sync(main.generate_date_keyboard),
+        'generate_performance_keyboard': sync(main.generate_performance_keyboard),
+        'select_study_performance': handler(
+            main.select_study_performance,
+            lambda: FakeUpdate.callback('performance_80'),
+            lambda: study_user_data(FakeUser())
+        ),
+        'estudo_quick_entry': handler(
+            main.estudo, lambda: FakeUpdate.text('/estudo Cálculo 14:00-15:30 2024-05-01 80%')
+        ),
+        'sono_quick_entry': handler(
+            main.sono, lambda: FakeUpdate.text('/sono 23:30-07:00 2024-05-01 muito bom')
+        ),
+        'timer_start_stop': handler(
+            timer_session, lambda: FakeUpdate.text('/iniciar_estudo Cálculo 25min')
+        ),
+        'listar_horas_estudo_cold': handler(
+            main.listar_horas_estudo, lambda: FakeUpdate.text('/listar_horas_estudo', HEAVY_USER),
+            clear_cache=True
+        ),
+        'listar_horas_estudo_cached': handler(
+            main.listar_horas_estudo, lambda: FakeUpdate.text('/listar_horas_estudo', HEAVY_USER)
+        ),
+        'listar_horas_sono_cold': handler(
+            main.listar_horas_sono, lambda: FakeUpdate.text('/listar_horas_sono', HEAVY_USER),
+            clear_cache=True
+        ),
+        'listar_horas_sono_cached': handler(
+            main.listar_horas_sono, lambda: FakeUpdate.text('/listar_horas_sono', HEAVY_USER)
+        ),
+        'insights_cold': handler(
+            main.insights, lambda: FakeUpdate.text('/insights', HEAVY_USER), clear_cache=True
+        ),
+        'insights_cached': handler(main.insights, lambda: FakeUpdate.text('/insights', HEAVY_USER)),
+    }
+
+
+async def seed(db):
+    """Grava o histórico do usuário pesado usado pelas listagens."""
+    study = []
+    sleep = []
+    for i in range(HEAVY_ROWS):
+        date = f"20{10 + i // 365 % 15:02d}-{i // 28 % 12 + 1:02d}-{i % 28 + 1:02d}"
+        study_period = period_minutes(date, '14:00', '15:30')
+        sleep_period = period_minutes(date, '23:00', '07:00')
+        study.append((HEAVY_USER.id, HEAVY_USER.first_name, *study_period, f"Disciplina {i % 7}", 70))
+        sleep.append((HEAVY_USER.id, HEAVY_USER.first_name, *sleep_period, 'Bom'))
+    await db.write(save_study_schedules, study)
+    await db.write(save_sleep_schedules, sleep)
+
+
+async def measure(factory, iterations, warmup, rounds=3):
+    """
+    Mede a mediana e o p95 da latência (µs) e o pico de memória por chamada (KiB).
+
+    A latência é medida em `rounds` rodadas e fica a rodada de menor mediana,
+    o que filtra boa parte do ruído de outros processos na máquina.
+    """
+    for _ in range(warmup):
+        coroutine = factory()
+        if coroutine is not None:
+            await coroutine
+
+    latencies = None
+    for _ in range(rounds):
+        round_latencies = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            coroutine = factory()
+            if coroutine is not None:
+                await coroutine
+            round_latencies.append((time.perf_counter() - started) * 1e6)
+        if latencies is None or statistics.median(round_latencies) < statistics.median(latencies):
+            latencies = round_latencies
+
+    # Alocações medidas à parte, pois o tracemalloc distorce a latência
+    peaks = []
+    tracemalloc.start()
+    for _ in range(min(iterations, 50)):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        coroutine = factory()
+        if coroutine is not None:
+            await coroutine
+        peaks.append((tracemalloc.get_traced_memory()[1] - before) / 1024)
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'median_us': round(statistics.median(latencies), 1),
+        'p95_us': round(latencies[int(len(latencies) * 0.95) - 1], 1),
+        'peak_kib': round(statistics.median(peaks), 2),
+    }
+
+
+def compare(results, baselines, latency_tolerance, memory_tolerance):
+    """Retorna a lista de regressões em relação ao baseline."""
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            continue
+        # 20µs de folga absoluta para casos muito rápidos, dominados por ruído
+        if result['median_us'] > baseline['median_us'] * (1 + latency_tolerance) + 20:
+            regressions.append(
+                f"{name}: latência mediana {result['median_us']}µs > baseline {baseline['median_us']}µs"
+            )
+        # 1 KiB de folga absoluta para casos que quase não alocam
+        if result['peak_kib'] > baseline['peak_kib'] * (1 + memory_tolerance) + 1:
+            regressions.append(
+                f"{name}: pico de memória {result['peak_kib']}KiB > baseline {baseline['peak_kib']}KiB"
+            )
+    return regressions
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        main.CHARTS_DIR = tmp
+        db = Database(os.path.join(tmp, 'bench.db'))
+        db.write_sync(init_database)
+        # Sem espera de agrupamento: mede o custo do handler, não o atraso da fila
+        bot_data = main.create_services(db, write_batch_delay=0)
+        await main.start_services(bot_data)
+        try:
+            await seed(db)
+            results = {}
+            for name, factory in build_cases(bot_data).items():
+                if args.only and args.only not in name:
+                    continue
+                results[name] = await measure(factory, args.iterations, args.warmup)
+                print(
+                    f"{name:32} mediana {results[name]['median_us']:>10.1f}µs  "
+                    f"p95 {results[name]['p95_us']:>10.1f}µs  "
+                    f"pico {results[name]['peak_kib']:>8.2f}KiB"
+                )
+        finally:
+            await main.stop_services(bot_data)
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks dos handlers do LUX")
+    parser.add_argument('--iterations', type=int, default=300)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--only', help="Roda só os casos que contêm este texto no nome")
+    parser.add_argument('--update-baseline', action='store_true', help="Grava os resultados como novo baseline")
+    parser.add_argument('--latency-tolerance', type=float, default=0.5,
+                        help="Piora relativa aceita na latência mediana (padrão: 0.5 = 50%%)")
+    parser.add_argument('--memory-tolerance', type=float, default=0.2,
+                        help="Piora relativa aceita no pico de memória (padrão: 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baselines = json.load(f)
+
+    if args.update_baseline:
+        baselines.update(results)
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline gravado em {BASELINE_PATH}")
+        return 0
+
+    regressions = compare(results, baselines, args.latency_tolerance, args.memory_tolerance)
+    if regressions:
+        print("\nRegressões encontradas:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        return 1
+    print("\nNenhuma regressão em relação ao baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
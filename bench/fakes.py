@@ -0,0 +1,84 @@
+"""
+Objetos falsos de Update, CallbackQuery e Context para rodar os handlers do
+bot em memória, sem rede. Implementam apenas o que os handlers usam.
+"""
+from types import SimpleNamespace
+
+
+class FakeUser:
+    def __init__(self, user_id=1000, first_name="Bench"):
+        self.id = user_id
+        self.first_name = first_name
+        self.is_bot = False
+
+
+class FakeChat:
+    def __init__(self, chat_id=1000, chat_type='private'):
+        self.id = chat_id
+        self.type = chat_type
+
+
+class FakeMessage:
+    """Mensagem recebida; as respostas ficam guardadas em `replies`."""
+
+    def __init__(self, text='', chat=None, message_id=1):
+        self.text = text
+        self.chat = chat or FakeChat()
+        self.chat_id = self.chat.id
+        self.message_id = message_id
+        self.document = None
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append((text, kwargs))
+        return FakeMessage(text, self.chat, self.message_id + 1)
+
+    async def reply_photo(self, photo, **kwargs):
+        self.replies.append((photo, kwargs))
+        return SimpleNamespace(photo=[SimpleNamespace(file_id='fake-file-id')])
+
+    async def reply_document(self, document, **kwargs):
+        self.replies.append((document, kwargs))
+        return FakeMessage('', self.chat, self.message_id + 1)
+
+
+class FakeCallbackQuery:
+    """Clique em botão inline; as edições ficam guardadas em `edits`."""
+
+    def __init__(self, data, message=None):
+        self.data = data
+        self.message = message or FakeMessage()
+        self.edits = []
+
+    async def answer(self, *args, **kwargs):
+        return True
+
+    async def edit_message_text(self, text, **kwargs):
+        self.edits.append((text, kwargs))
+        return True
+
+
+class FakeUpdate:
+    def __init__(self, message=None, callback_query=None, user=None, chat=None):
+        self.message = message
+        self.callback_query = callback_query
+        self.effective_user = user or FakeUser()
+        self.effective_chat = chat or FakeChat(self.effective_user.id)
+        self.effective_message = message or (callback_query.message if callback_query else None)
+
+    @classmethod
+    def text(cls, text, user=None):
+        return cls(message=FakeMessage(text), user=user)
+
+    @classmethod
+    def callback(cls, data, user=None):
+        return cls(callback_query=FakeCallbackQuery(data), user=user)
+
+
+class FakeContext:
+    def __init__(self, bot_data, user_data=None, args=None):
+        self.bot_data = bot_data
+        self.user_data = {} if user_data is None else user_data
+        self.args = args or []
+        # Sem JobQueue: os lembretes dos cronômetros não são agendados
+        self.job_queue = None
@@ -0,0 +1,222 @@
+"""
+Servidor local que imita a Bot API do Telegram, para testes de carga.
+
+Implementa o suficiente para o bot rodar contra ele (getMe, getUpdates,
+setWebhook/deleteWebhook, setMyCommands, sendMessage, editMessageText,
+answerCallbackQuery) e para usuários simulados conversarem com o bot:
+`push_text`/`push_callback` entregam updates ao bot, por long polling ou
+por webhook, e `next_event` aguarda a próxima mensagem que o bot enviou ou
+editou em um chat.
+"""
+import json
+import time
+import asyncio
+from collections import Counter, defaultdict
+
+import tornado.web
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'LUX', 'username': 'lux_loadtest_bot'}
+
+
+class _MethodHandler(tornado.web.RequestHandler):
+    def initialize(self, api):
+        self.api = api
+
+    def _params(self):
+        content_type = self.request.headers.get('Content-Type', '')
+        if content_type.startswith('application/json') and self.request.body:
+            return json.loads(self.request.body)
+        params = {}
+        for name in self.request.body_arguments:
+            value = self.get_body_argument(name)
+            # Parâmetros compostos (reply_markup, allowed_updates) vêm em JSON
+            if value[:1] in ('{', '['):
+                value = json.loads(value)
+            params[name] = value
+        return params
+
+    async def post(self, token, method):
+        self.api.calls[method] += 1
+        handler = getattr(self.api, f'api_{method}', None)
+        result = await handler(self._params()) if handler else True
+        self.set_header('Content-Type', 'application/json')
+        self.write(json.dumps({'ok': True, 'result': result}))
+
+    get = post
+
+
+class FakeBotAPI:
+    """Estado da Bot API falsa: fila de updates, webhook e caixas de entrada por chat."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.bot_ready = asyncio.Event()
+        self._updates = []
+        self._new_update = asyncio.Event()
+        self._next_update_id = 1
+        self._closed = False
+        self._next_message_id = 1
+        self._inboxes = defaultdict(asyncio.Queue)
+        self._http = AsyncHTTPClient(max_clients=1000)
+
+    def make_app(self):
+        return tornado.web.Application([
+            (r'/bot([^/]+)/(\w+)', _MethodHandler, {'api': self}),
+        ])
+
+    def listen(self, port, address='127.0.0.1'):
+        return self.make_app().listen(port, address=address)
+
+    def close(self):
+        """Encerra os long pollings pendentes, antes de parar o servidor."""
+        self._closed = True
+        self._new_update.set()
+
+    # ---- Lado dos usuários simulados ----
+
+    def _message_id(self):
+        self._next_message_id += 1
+        return self._next_message_id
+
+    def push_text(self, user_id, first_name, text):
+        """Entrega ao bot uma mensagem de texto enviada pelo usuário."""
+        message = {
+            'message_id': self._message_id(),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': first_name},
+            'text': text,
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        self._push({'message': message})
+
+    def push_callback(self, user_id, first_name, message_id, data):
+        """Entrega ao bot o clique do usuário em um botão inline."""
+        self._push({'callback_query': {
+            'id': str(self._message_id()),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': first_name},
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': '',
+            },
+        }})
+
+    async def next_event(self, chat_id, timeout=30):
+        """
+        Aguarda a próxima mensagem enviada ou editada pelo bot no chat.
+
+        Returns:
+            dict: {'kind': 'send'|'edit', 'message_id', 'text', 'buttons'}
+        """
+        return await asyncio.wait_for(self._inboxes[chat_id].get(), timeout)
+
+    def _push(self, update):
+        update['update_id'] = self._next_update_id
+        self._next_update_id += 1
+        if self.webhook_url:
+            asyncio.ensure_future(self._deliver_webhook(update))
+        else:
+            self._updates.append(update)
+            self._new_update.set()
+
+    async def _deliver_webhook(self, update):
+        headers = {'Content-Type': 'application/json'}
+        if self.webhook_secret:
+            headers['X-Telegram-Bot-Api-Secret-Token'] = self.webhook_secret
+        await self._http.fetch(HTTPRequest(
+            self.webhook_url, method='POST', headers=headers, body=json.dumps(update)
+        ), raise_error=False)
+
+    # ---- Métodos da Bot API ----
+
+    async def api_getMe(self, params):
+        return BOT_USER
+
+    async def api_getUpdates(self, params):
+        self.bot_ready.set()
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        # Updates com id menor que o offset já foram confirmados pelo bot
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates and timeout > 0 and not self._closed:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def api_setWebhook(self, params):
+        self.webhook_url = params.get('url') or None
+        self.webhook_secret = params.get('secret_token')
+        if self.webhook_url:
+            self.bot_ready.set()
+        return True
+
+    async def api_deleteWebhook(self, params):
+        self.webhook_url = None
+        if params.get('drop_pending_updates') in (True, 'true', 'True'):
+            self._updates.clear()
+        return True
+
+    async def api_getWebhookInfo(self, params):
+        return {'url': self.webhook_url or '', 'has_custom_certificate': False, 'pending_update_count': 0}
+
+    async def api_sendMessage(self, params):
+        chat_id = int(params['chat_id'])
+        message_id = self._message_id()
+        self._inboxes[chat_id].put_nowait({
+            'kind': 'send',
+            'message_id': message_id,
+            'text': params.get('text', ''),
+            'buttons': _buttons(params.get('reply_markup')),
+        })
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    async def api_editMessageText(self, params):
+        chat_id = int(params['chat_id'])
+        message_id = int(params['message_id'])
+        self._inboxes[chat_id].put_nowait({
+            'kind': 'edit',
+            'message_id': message_id,
+            'text': params.get('text', ''),
+            'buttons': _buttons(params.get('reply_markup')),
+        })
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+
+def _buttons(reply_markup):
+    """Extrai os callback_data dos botões inline, na ordem em que aparecem."""
+    if not reply_markup:
+        return []
+    if isinstance(reply_markup, str):
+        reply_markup = json.loads(reply_markup)
+    return [
+        button['callback_data']
+        for row in reply_markup.get('inline_keyboard', [])
+        for button in row
+        if 'callback_data' in button
+    ]
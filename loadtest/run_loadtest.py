@@ -0,0 +1,290 @@
+"""
+Teste de carga de ponta a ponta do bot.
+
+O bot roda neste processo, montado por `main.build_application` com todos
+os handlers e ConversationHandlers reais, apontando para a Bot API falsa
+(fake_bot_api.py). A Bot API falsa e os usuários simulados rodam em um
+processo separado, para não disputar o event loop com o bot. Cada usuário
+chega segundo um processo de Poisson com a taxa pedida e percorre o fluxo
+completo de /adicionar_estudo ou /adicionar_sono, esperando a resposta do
+bot a cada passo; com --quick-ratio, parte deles registra tudo em uma
+mensagem com /estudo ou /sono.
+
+Ao final são exibidos a vazão, os percentis de latência por passo e os de
+gravação no banco (flush da fila de escrita).
+
+Uso:
+    python loadtest/run_loadtest.py --users 2000 --rate 200
+    python loadtest/run_loadtest.py --users 5000 --rate 500 --mode webhook
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+from collections import defaultdict
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(LOADTEST_DIR, '..', 'src'))
+
+TOKEN = '123456:loadtest'
+FIRST_USER_ID = 10_000_000
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+# ---- Processo gerador de carga: Bot API falsa + usuários simulados ----
+
+class SimulatedUser:
+    def __init__(self, api, user_id, samples, timeout):
+        self.api = api
+        self.user_id = user_id
+        self.name = f"User{user_id}"
+        self.samples = samples
+        self.timeout = timeout
+
+    async def _step(self, name, push):
+        started = time.perf_counter()
+        push()
+        event = await self.api.next_event(self.user_id, self.timeout)
+        self.samples[name].append(time.perf_counter() - started)
+        return event
+
+    def say(self, name, text):
+        return self._step(name, lambda: self.api.push_text(self.user_id, self.name, text))
+
+    def press(self, name, event, data):
+        return self._step(
+            name, lambda: self.api.push_callback(self.user_id, self.name, event['message_id'], data)
+        )
+
+    async def study_flow(self):
+        event = await self.say('estudo: /adicionar_estudo', '/adicionar_estudo')
+        if 'discipline_custom' in event['buttons']:
+            event = await self.press('estudo: digitar outra', event, 'discipline_custom')
+        await self.say('estudo: disciplina', random.choice(['Cálculo', 'Física', 'História']))
+        await self.say('estudo: início', '14:00')
+        event = await self.say('estudo: término', '15:30')
+        event = await self.press('estudo: data', event, event['buttons'][0])
+        event = await self.press('estudo: performance', event, 'performance_80')
+        if not event['text'].startswith('Horário de estudo registrado'):
+            raise RuntimeError(f"resposta inesperada: {event['text']!r}")
+
+    async def sleep_flow(self):
+        await self.say('sono: /adicionar_sono', '/adicionar_sono')
+        await self.say('sono: início', '23:30')
+        event = await self.say('sono: término', '07:00')
+        event = await self.press('sono: data', event, event['buttons'][0])
+        event = await self.press('sono: qualidade', event, 'quality_GOOD')
+        if not event['text'].startswith('Sono registrado'):
+            raise RuntimeError(f"resposta inesperada: {event['text']!r}")
+
+    async def quick_study_flow(self):
+        discipline = random.choice(['Cálculo', 'Física', 'História'])
+        event = await self.say('estudo rápido: /estudo', f'/estudo {discipline} 14:00-15:30 ontem 80%')
+        if not event['text'].startswith('Horário de estudo registrado'):
+            raise RuntimeError(f"resposta inesperada: {event['text']!r}")
+
+    async def quick_sleep_flow(self):
+        event = await self.say('sono rápido: /sono', '/sono 23:30-07:00 ontem bom')
+        if not event['text'].startswith('Sono registrado'):
+            raise RuntimeError(f"resposta inesperada: {event['text']!r}")
+
+
+async def generate_load(args, port, ready, stopped, results):
+    from fake_bot_api import FakeBotAPI
+
+    api = FakeBotAPI()
+    server = api.listen(port)
+    ready.set()
+    # Só libera os usuários quando o bot começou a buscar updates
+    await api.bot_ready.wait()
+
+    samples = defaultdict(list)
+    failures = []
+
+    async def run_user(index, delay):
+        await asyncio.sleep(delay)
+        user = SimulatedUser(api, FIRST_USER_ID + index, samples, args.step_timeout)
+        quick = random.random() < args.quick_ratio
+        try:
+            if random.random() < args.sleep_ratio:
+                await (user.quick_sleep_flow() if quick else user.sleep_flow())
+            else:
+                await (user.quick_study_flow() if quick else user.study_flow())
+        except Exception as error:
+            failures.append(f"{user.user_id}: {error!r}")
+
+    delays = []
+    arrival = 0.0
+    for _ in range(args.users):
+        arrival += random.expovariate(args.rate)
+        delays.append(arrival)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(index, delay) for index, delay in enumerate(delays)))
+    elapsed = time.perf_counter() - started
+
+    results.put({
+        'elapsed': elapsed,
+        'samples': dict(samples),
+        'failures': failures,
+        'calls': dict(api.calls),
+    })
+
+    # Continua respondendo até o bot terminar de desligar
+    await asyncio.get_running_loop().run_in_executor(None, stopped.wait)
+    api.close()
+    await asyncio.sleep(0.1)
+    server.stop()
+
+
+def load_process(args, port, ready, stopped, results):
+    sys.path.insert(0, LOADTEST_DIR)
+    asyncio.run(generate_load(args, port, ready, stopped, results))
+
+
+# ---- Processo do bot ----
+
+async def run_bot(args, api_url, generator, stopped, results):
+    import main
+    from telegram import Update
+
+    application = main.build_application(TOKEN, args.db, api_url)
+    await application.initialize()
+    await main.post_init(application)
+    await application.start()
+    if args.mode == 'webhook':
+        await application.updater.start_webhook(
+            listen='127.0.0.1',
+            port=args.webhook_port,
+            url_path='telegram',
+            webhook_url=f"http://127.0.0.1:{args.webhook_port}/telegram",
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        await application.updater.start_polling(
+            poll_interval=0, timeout=10, allowed_updates=Update.ALL_TYPES
+        )
+
+    # Aguarda o gerador terminar sem bloquear o event loop do bot
+    loop = asyncio.get_running_loop()
+    report = await loop.run_in_executor(None, results.get)
+
+    writer = application.bot_data['writer']
+    flush_latencies = list(writer.recent_flush_latencies)
+    writer_stats = writer.stats()
+    rate_limiter_stats = application.bot.rate_limiter.stats()
+
+    # Mesma ordem de desligamento de Application.run_polling
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    await main.post_shutdown(application)
+    stopped.set()
+    await loop.run_in_executor(None, generator.join)
+
+    report['flush_latencies'] = flush_latencies
+    report['writer'] = writer_stats
+    report['rate_limiter'] = rate_limiter_stats
+    return report
+
+
+def print_report(args, report):
+    samples = report['samples']
+    all_steps = [value for values in samples.values() for value in values]
+    completed = args.users - len(report['failures'])
+    elapsed = report['elapsed']
+
+    print(f"\nModo: {args.mode} | usuários: {args.users} | taxa de chegada: {args.rate}/s")
+    print(f"Duração: {elapsed:.1f}s")
+    print(f"Fluxos concluídos: {completed} ({completed / elapsed:.1f}/s), falhas: {len(report['failures'])}")
+    print(f"Passos: {len(all_steps)} ({len(all_steps) / elapsed:.1f}/s)")
+
+    def line(name, values, unit=1000):
+        print(
+            f"  {name:30} n={len(values):>7}  "
+            f"p50 {percentile(values, 0.50) * unit:8.1f}ms  "
+            f"p95 {percentile(values, 0.95) * unit:8.1f}ms  "
+            f"p99 {percentile(values, 0.99) * unit:8.1f}ms  "
+            f"máx {max(values, default=0) * unit:8.1f}ms"
+        )
+
+    print("\nLatência por passo (update entregue -> resposta do bot):")
+    line("todos os passos", all_steps)
+    for name in sorted(samples):
+        line(name, samples[name])
+
+    writer = report['writer']
+    print("\nGravação no banco (flush da fila de escrita):")
+    line("flush", report['flush_latencies'])
+    if writer['flushes']:
+        print(f"  {writer['rows_written']} linhas em {writer['flushes']} flushes "
+              f"({writer['rows_written'] / writer['flushes']:.1f} linhas/flush), "
+              f"erros: {writer['flush_errors']}")
+
+    limiter = report['rate_limiter']
+    print("\nFila de envio:")
+    print(f"  {limiter['requests']} envios, {limiter['throttled']} atrasados "
+          f"(médio {limiter['avg_throttle_delay'] * 1000:.1f}ms, máx {limiter['max_throttle_delay'] * 1000:.1f}ms), "
+          f"{limiter['coalesced_edits']} edições agrupadas, {limiter['retry_after']} RetryAfter")
+
+    print("\nChamadas à Bot API:")
+    for method, count in sorted(report['calls'].items()):
+        print(f"  {method:22} {count}")
+
+    for failure in report['failures'][:10]:
+        print(f"  falha: {failure}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Teste de carga de ponta a ponta do LUX")
+    parser.add_argument('--users', type=int, default=1000, help="Usuários simulados")
+    parser.add_argument('--rate', type=float, default=100.0, help="Chegadas de usuários por segundo")
+    parser.add_argument('--sleep-ratio', type=float, default=0.3,
+                        help="Fração de usuários que registra sono em vez de estudo")
+    parser.add_argument('--quick-ratio', type=float, default=0.0,
+                        help="Fração de usuários que registra em uma mensagem (/estudo, /sono)")
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default='polling')
+    parser.add_argument('--api-port', type=int, default=18081, help="Porta da Bot API falsa")
+    parser.add_argument('--webhook-port', type=int, default=18443, help="Porta do webhook do bot")
+    parser.add_argument('--step-timeout', type=float, default=30.0)
+    parser.add_argument('--db', help="Banco SQLite (padrão: arquivo temporário)")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    if args.db is None:
+        args.db = os.path.join(tmp.name, 'loadtest.db')
+    os.environ.setdefault('CHARTS_DIR', os.path.join(tmp.name, 'charts'))
+    # Usuários simulados respondem sem tempo de digitação; o limite por chat
+    # do Telegram (1 msg/s) mediria só a espera imposta, não o bot
+    os.environ.setdefault('RATE_LIMIT_PER_CHAT', '1000')
+    os.environ.setdefault('RATE_LIMIT_BURST', '1000')
+    os.environ.setdefault('RATE_LIMIT_GLOBAL', '100000')
+
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    stopped = context.Event()
+    results = context.Queue()
+    generator = context.Process(target=load_process, args=(args, args.api_port, ready, stopped, results))
+    generator.start()
+    ready.wait()
+
+    report = asyncio.run(
+        run_bot(args, f"http://127.0.0.1:{args.api_port}", generator, stopped, results)
+    )
+    print_report(args, report)
+    tmp.cleanup()
+    return 1 if report['failures'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
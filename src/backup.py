@@ -0,0 +1,183 @@
+"""
+Cópias de segurança do banco com a API de backup online do SQLite.
+
+`create_snapshot` copia o banco com o bot rodando, em passos de poucas
+páginas separados por pausas, para que a thread de escrita nunca espere
+muito. A cópia é feita a partir de uma transação de leitura aberta na sua
+própria conexão: no modo WAL isso fixa um retrato consistente do banco e
+as gravações do bot continuam normalmente (sem a transação, cada gravação
+de outra conexão faria o backup recomeçar do zero). Cada cópia ganha um
+arquivo `.sha256` no formato do `sha256sum`, e as mais antigas que
+BACKUP_KEEP são apagadas. `restore_snapshot` confere o checksum e o
+`integrity_check` antes de trocar o arquivo do banco.
+"""
+import os
+import glob
+import time
+import shutil
+import sqlite3
+import hashlib
+from datetime import datetime
+
+# Formato do horário no nome das cópias: database-20240131-033000.db
+TIMESTAMP_FORMAT = '%Y%m%d-%H%M%S'
+CHECKSUM_SUFFIX = '.sha256'
+
+
+def _base_name(db_path):
+    return os.path.splitext(os.path.basename(db_path))[0]
+
+
+def _fsync_dir(path):
+    """Garante que renomeações dentro de `path` sobrevivam a uma queda."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_file(path):
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    """SHA-256 do arquivo, lido em blocos."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_snapshots(directory, db_path):
+    """Cópias do banco `db_path` em `directory`, da mais antiga à mais recente."""
+    pattern = os.path.join(directory, f"{glob.escape(_base_name(db_path))}-????????-??????.db")
+    # O horário no nome ordena as cópias
+    return sorted(glob.glob(pattern))
+
+
+def create_snapshot(db_path, directory, step_pages=256, step_pause=0.01):
+    """
+    Copia o banco para `directory` sem parar as gravações.
+
+    Args:
+        step_pages: Páginas copiadas por passo do backup
+        step_pause: Pausa entre os passos, em segundos
+
+    Returns:
+        str: Caminho da cópia
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = f"{_base_name(db_path)}-{datetime.now().strftime(TIMESTAMP_FORMAT)}.db"
+    path = os.path.join(directory, name)
+    partial = path + '.partial'
+
+    source = sqlite3.connect(db_path, isolation_level=None)
+    target = sqlite3.connect(partial)
+    try:
+        source.execute('PRAGMA busy_timeout=5000')
+        # Fixa o retrato do banco: a transação de leitura só começa na
+        # primeira leitura, por isso o SELECT logo após o BEGIN
+        source.execute('BEGIN')
+        source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        source.backup(
+            target, pages=step_pages, progress=lambda status, remaining, total: time.sleep(step_pause)
+        )
+        source.execute('COMMIT')
+        # A cópia herda o modo WAL do cabeçalho; um arquivo único é mais
+        # fácil de mover e de conferir
+        target.execute('PRAGMA journal_mode=DELETE')
+    except BaseException:
+        target.close()
+        os.remove(partial)
+        raise
+    finally:
+        source.close()
+    target.close()
+
+    _fsync_file(partial)
+    os.replace(partial, path)
+    checksum = file_checksum(path)
+    with open(path + CHECKSUM_SUFFIX, 'w') as f:
+        f.write(f"{checksum}  {name}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    _fsync_dir(directory)
+    return path
+
+
+def rotate_snapshots(directory, db_path, keep):
+    """
+    Apaga as cópias de `db_path` além das `keep` mais recentes.
+
+    Returns:
+        list: Caminhos das cópias apagadas
+    """
+    removed = list_snapshots(directory, db_path)[:-keep] if keep > 0 else []
+    for path in removed:
+        for leftover in (path, path + CHECKSUM_SUFFIX):
+            try:
+                os.remove(leftover)
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def verify_snapshot(path):
+    """
+    Confere o checksum da cópia e roda o `integrity_check` do SQLite.
+
+    Raises:
+        ValueError: Se o checksum falta ou não confere, ou se o banco está
+        corrompido
+    """
+    try:
+        with open(path + CHECKSUM_SUFFIX) as f:
+            expected = f.read().split()[0]
+    except (FileNotFoundError, IndexError):
+        raise ValueError(f"Checksum ausente para {path}")
+    if file_checksum(path) != expected:
+        raise ValueError(f"Checksum não confere: {path}")
+
+    # Somente leitura, para não criar journal nem alterar o arquivo
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"Cópia corrompida: {path}: {e}")
+    finally:
+        conn.close()
+    if result != ['ok']:
+        raise ValueError(f"Cópia corrompida: {path}: {'; '.join(result[:5])}")
+
+
+def restore_snapshot(snapshot, db_path):
+    """
+    Substitui o banco `db_path` pela cópia `snapshot`, depois de conferi-la.
+    Deve rodar com o bot parado.
+
+    O banco atual (com os seus arquivos -wal e -shm) é mantido ao lado, com
+    o sufixo `.replaced-<horário>`.
+
+    Returns:
+        str | None: Caminho do banco substituído, ou None se não havia banco
+    """
+    verify_snapshot(snapshot)
+    directory = os.path.dirname(os.path.abspath(db_path))
+    staging = db_path + '.restore'
+    shutil.copyfile(snapshot, staging)
+    _fsync_file(staging)
+
+    replaced = None
+    if os.path.exists(db_path):
+        replaced = f"{db_path}.replaced-{datetime.now().strftime(TIMESTAMP_FORMAT)}"
+        # O WAL pertence ao banco antigo: deixá-lo ao lado do novo arquivo
+        # faria o SQLite aplicá-lo à cópia restaurada
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.replace(db_path + suffix, replaced + suffix)
+    os.replace(staging, db_path)
+    _fsync_dir(directory)
+    return replaced
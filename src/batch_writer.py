@@ -0,0 +1,160 @@
+import time
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Sinaliza ao flusher que não há mais itens a esperar
+_STOP = object()
+
+
+class BatchWriter:
+    """
+    Fila de escrita com commit em grupo.
+
+    Os handlers enfileiram linhas com `submit` e aguardam até que elas
+    estejam gravadas. Um único flusher agrupa as linhas pendentes e as grava
+    com `executemany` em uma só transação, sempre que `max_batch` linhas se
+    acumulam ou `max_delay` segundos se passam desde a primeira linha do lote.
+    Assim, uma rajada de registros custa um fsync por lote e não por linha.
+    """
+
+    def __init__(self, db, max_batch=500, max_delay=0.005, max_queue=10000):
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._task = None
+        self._closed = False
+        self._listeners = []
+
+        # Métricas
+        self.rows_written = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+        # Janela das latências mais recentes, para cálculo de percentis
+        self.recent_flush_latencies = deque(maxlen=10000)
+
+    @property
+    def queue_depth(self):
+        """Quantidade de linhas aguardando gravação."""
+        return self._queue.qsize()
+
+    def stats(self):
+        """Retorna os contadores de profundidade da fila e latência de flush."""
+        return {
+            'queue_depth': self.queue_depth,
+            'rows_written': self.rows_written,
+            'flushes': self.flushes,
+            'flush_errors': self.flush_errors,
+            'last_flush_latency': self.last_flush_latency,
+            'max_flush_latency': self.max_flush_latency,
+            'avg_flush_latency': self.total_flush_latency / self.flushes if self.flushes else 0.0,
+        }
+
+    def add_listener(self, listener):
+        """
+        Registra `listener(fn, rows)`, chamado após cada lote confirmado,
+        antes de liberar os handlers que aguardam as linhas gravadas.
+        """
+        self._listeners.append(listener)
+
+    def start(self):
+        """Inicia o flusher no event loop atual."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Grava tudo que ainda estiver na fila e encerra o flusher."""
+        if self._task is None or self._closed:
+            return
+        self._closed = True
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def submit(self, fn, row):
+        """
+        Enfileira uma linha para ser gravada por `fn(conn, rows)`.
+
+        Retorna somente depois que o lote contendo a linha foi confirmado no
+        banco, propagando a exceção caso a gravação falhe.
+        """
+        if self._closed:
+            raise RuntimeError('BatchWriter já foi encerrado')
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((fn, row, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        # Agrupa as linhas por função de gravação, preservando a ordem
+        groups = {}
+        for fn, row, _ in batch:
+            groups.setdefault(fn, []).append(row)
+
+        started = time.perf_counter()
+        try:
+            await self.db.write(_write_groups, groups)
+        except Exception as error:
+            self.flush_errors += 1
+            logger.exception('Falha ao gravar lote com %d linhas', len(batch))
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        latency = time.perf_counter() - started
+        self.flushes += 1
+        self.rows_written += len(batch)
+        self.last_flush_latency = latency
+        self.total_flush_latency += latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self.recent_flush_latencies.append(latency)
+
+        for listener in self._listeners:
+            for fn, rows in groups.items():
+                try:
+                    listener(fn, rows)
+                except Exception:
+                    logger.exception('Falha ao notificar gravação de lote')
+
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+
+def _write_groups(conn, groups):
+    for fn, rows in groups.items():
+        fn(conn, rows)
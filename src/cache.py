@@ -0,0 +1,120 @@
+from collections import OrderedDict
+
+
+class ReadModelCache:
+    """
+    Cache LRU em memória, por usuário, dos modelos de leitura do bot.
+
+    Para cada usuário guarda as disciplinas mais estudadas (com a frequência
+    de cada uma), as últimas páginas de listagem renderizadas e o texto de
+    /insights com a versão dos dados usada no cálculo. O número de
+    usuários é limitado por `max_users` e o de páginas por usuário por
+    `max_pages`; ao exceder, as entradas usadas há mais tempo são descartadas.
+
+    O cache é usado somente a partir do event loop, então não precisa de
+    travas.
+    """
+
+    def __init__(self, max_users=10000, max_pages=8):
+        self.max_users = max_users
+        self.max_pages = max_pages
+        self._entries = OrderedDict()
+
+        # Estatísticas
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """Retorna acertos, faltas, descartes e ocupação do cache."""
+        lookups = self.hits + self.misses
+        return {
+            'users': len(self._entries),
+            'max_users': self.max_users,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+    def _entry(self, user_id, create=False):
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            self._entries.move_to_end(user_id)
+        elif create:
+            entry = self._entries[user_id] = {'disciplines': None, 'pages': OrderedDict(), 'insights': None}
+            if len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def _lookup(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def get_disciplines(self, user_id):
+        """Retorna a lista [(id da disciplina, nome, frequência)] em cache ou None."""
+        entry = self._entry(user_id)
+        return self._lookup(entry['disciplines'] if entry else None)
+
+    def set_disciplines(self, user_id, disciplines):
+        self._entry(user_id, create=True)['disciplines'] = list(disciplines)
+
+    def get_page(self, user_id, key):
+        """Retorna uma página de listagem renderizada em cache ou None."""
+        entry = self._entry(user_id)
+        page = None
+        if entry is not None:
+            page = entry['pages'].get(key)
+            if page is not None:
+                entry['pages'].move_to_end(key)
+        return self._lookup(page)
+
+    def set_page(self, user_id, key, page):
+        pages = self._entry(user_id, create=True)['pages']
+        pages[key] = page
+        pages.move_to_end(key)
+        if len(pages) > self.max_pages:
+            pages.popitem(last=False)
+
+    def get_insights(self, user_id, version):
+        """Retorna os insights em cache se calculados na versão `version` dos dados, senão None."""
+        entry = self._entry(user_id)
+        cached = entry['insights'] if entry else None
+        return self._lookup(cached[1] if cached and cached[0] == version else None)
+
+    def set_insights(self, user_id, version, insights):
+        self._entry(user_id, create=True)['insights'] = (version, insights)
+
+    def invalidate_pages(self, user_id, kind):
+        """Descarta as páginas em cache de uma listagem (chaves iniciadas por `kind`)."""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            for key in [key for key in entry['pages'] if key[0] == kind]:
+                del entry['pages'][key]
+
+    def record_discipline(self, user_id, discipline):
+        """
+        Atualiza as disciplinas em cache após um novo registro de estudo.
+
+        Se a disciplina já está entre as mais estudadas, basta incrementar a
+        sua frequência e reordenar, pois nenhuma outra contagem mudou. Caso
+        contrário, não se sabe se ela passou a fazer parte da lista (nem o
+        seu id, atribuído na gravação), então a entrada é descartada para ser
+        recalculada na próxima leitura.
+        """
+        entry = self._entries.get(user_id)
+        if entry is None or entry['disciplines'] is None:
+            return
+
+        disciplines = entry['disciplines']
+        for index, (discipline_id, name, frequency) in enumerate(disciplines):
+            if name == discipline:
+                disciplines[index] = (discipline_id, name, frequency + 1)
+                disciplines.sort(key=lambda item: item[2], reverse=True)
+                return
+
+        entry['disciplines'] = None
@@ -0,0 +1,96 @@
+import os
+from collections import defaultdict
+
+from matplotlib.figure import Figure
+
+from periods import day_to_date
+
+# Cores das barras de sono, da pior para a melhor qualidade
+QUALITY_COLORS = {
+    "Muito Ruim": "#d73027",
+    "Ruim": "#fc8d59",
+    "Normal": "#fee08b",
+    "Bom": "#91cf60",
+    "Muito Bom": "#1a9850",
+}
+
+
+def _stack_bars(ax, dates, series, colors=None):
+    """
+    Desenha barras empilhadas por data, uma camada por série. As barras
+    ficam no número do dia, de forma que os dias sem registro aparecem
+    como lacunas no eixo.
+    """
+    bottom = [0.0] * len(dates)
+    for name, values in series.items():
+        heights = [values.get(date, 0) / 60 for date in dates]
+        ax.bar(
+            dates, heights, width=0.8, bottom=bottom, label=name,
+            color=colors.get(name) if colors else None
+        )
+        bottom = [b + h for b, h in zip(bottom, heights)]
+
+
+def _label_dates(ax, dates):
+    first, last = dates[0], dates[-1]
+    # Evita eixos ilegíveis em períodos longos
+    step = max(1, (last - first + 1) // 10)
+    ticks = list(range(first, last + 1, step))
+    ax.set_xticks(ticks)
+    ax.set_xlim(first - 0.5, last + 0.5)
+    # Rótulos MM-DD, ou YYYY-MM-DD quando o período passa de um ano para outro
+    same_year = day_to_date(first)[:4] == day_to_date(last)[:4]
+    labels = [day_to_date(day)[5:] if same_year else day_to_date(day) for day in ticks]
+    ax.set_xticklabels(labels, rotation=45, ha='right')
+
+
+def render_progress_chart(path, title, study, sleep):
+    """
+    Renderiza o gráfico de progresso do usuário em um PNG.
+
+    Roda em um processo separado (ver `main.grafico`), por isso recebe
+    apenas dados simples e não toca no banco.
+
+    Args:
+        path (str): Arquivo PNG de destino
+        title (str): Título do gráfico
+        study (list): Tuplas (dia, disciplina, minutos) do rollup diário
+        sleep (list): Tuplas (dia, qualidade, minutos) do rollup diário
+    """
+    study_series = defaultdict(dict)
+    for day, discipline, minutes in study:
+        study_series[discipline][day] = minutes
+    sleep_series = defaultdict(dict)
+    for day, quality, minutes in sleep:
+        sleep_series[quality][day] = minutes
+    sleep_series = {
+        quality: sleep_series[quality] for quality in QUALITY_COLORS if quality in sleep_series
+    }
+
+    fig = Figure(figsize=(10, 8))
+    fig.suptitle(title)
+    study_ax, sleep_ax = fig.subplots(2, 1)
+
+    study_dates = sorted({row[0] for row in study})
+    if study_dates:
+        _stack_bars(study_ax, study_dates, study_series)
+        _label_dates(study_ax, study_dates)
+        study_ax.legend(fontsize='small')
+    study_ax.set_title("Horas de estudo por disciplina")
+    study_ax.set_ylabel("Horas")
+
+    sleep_dates = sorted({row[0] for row in sleep})
+    if sleep_dates:
+        _stack_bars(sleep_ax, sleep_dates, sleep_series, QUALITY_COLORS)
+        _label_dates(sleep_ax, sleep_dates)
+        sleep_ax.legend(fontsize='small')
+    sleep_ax.set_title("Horas de sono por qualidade")
+    sleep_ax.set_ylabel("Horas")
+
+    fig.tight_layout()
+
+    # Grava em um arquivo temporário para nunca expor um PNG incompleto
+    tmp_path = f"{path}.tmp"
+    fig.savefig(tmp_path, format='png', dpi=100)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,936 @@
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import DB_QUERY_LATENCY
+from migrations import migrate
+from periods import week_start, month_length
+
+logger = logging.getLogger(__name__)
+
+
+class Database:
+    """
+    Camada de acesso assíncrona ao SQLite.
+
+    Todo o trabalho com o banco roda fora do event loop: as escritas passam
+    por uma única thread dedicada (o SQLite só admite um escritor por vez) e
+    as leituras por um pequeno pool de threads. Cada thread mantém a sua
+    própria conexão, aberta uma única vez e reutilizada entre chamadas. O
+    banco opera em modo WAL, de modo que leitores não bloqueiam o escritor.
+    """
+
+    def __init__(self, path='database.db', readers=4):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='lux-db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='lux-db-reader')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        # Antes do WAL, que já grava o cabeçalho: só tem efeito em arquivos
+        # novos; os existentes mudam de modo com `enable_incremental_vacuum`
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _connection(self):
+        """Retorna a conexão da thread atual, abrindo-a no primeiro uso."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _run_read(self, fn, args):
+        started = time.perf_counter()
+        try:
+            return fn(self._connection(), *args)
+        finally:
+            DB_QUERY_LATENCY.labels('read', fn.__name__).observe(time.perf_counter() - started)
+
+    def _run_write(self, fn, args):
+        started = time.perf_counter()
+        conn = self._connection()
+        try:
+            with conn:
+                return fn(conn, *args)
+        finally:
+            # Inclui o commit, onde fica o custo do fsync
+            DB_QUERY_LATENCY.labels('write', fn.__name__).observe(time.perf_counter() - started)
+
+    async def read(self, fn, *args):
+        """Executa `fn(conn, *args)` em uma thread leitora e aguarda o resultado."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._run_read, fn, args)
+
+    async def write(self, fn, *args):
+        """Executa `fn(conn, *args)` na thread escritora, dentro de uma transação."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self._run_write, fn, args)
+
+    def write_sync(self, fn, *args):
+        """Versão síncrona de `write`, para uso fora do event loop (inicialização)."""
+        return self._writer.submit(self._run_write, fn, args).result()
+
+    def close(self):
+        """Aguarda as operações pendentes e fecha todas as conexões."""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+# Configuração do banco de dados SQLite
+def init_database(conn):
+    """
+    Cria as tabelas de horários caso ainda não existam e aplica as migrações
+    pendentes, atualizando bancos existentes no lugar.
+
+    As tabelas são criadas no esquema original; as migrações levam bancos
+    novos e antigos ao esquema atual pelo mesmo caminho.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS study_periods (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            user_name TEXT,
+            date TEXT,
+            start_time TEXT,
+            end_time TEXT,
+            duration_hours INTEGER,
+            duration_minutes INTEGER,
+            discipline TEXT,
+            performance INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sleep_periods (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            user_name TEXT,
+            date TEXT,
+            start_time TEXT,
+            end_time TEXT,
+            duration_hours INTEGER,
+            duration_minutes INTEGER,
+            quality TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    migrate(conn)
+
+
+def _bump_user_versions(conn, rows):
+    """Incrementa a versão dos dados dos usuários presentes no lote."""
+    conn.executemany('''
+        INSERT INTO user_versions (user_id, version) VALUES (?, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1
+    ''', [(row[0],) for row in rows])
+
+
+def _discipline_ids(conn, rows):
+    """
+    Garante que as disciplinas das linhas (user_id na posição 0, nome na 6)
+    estejam no dicionário do usuário, com o próximo id livre para as novas.
+
+    Returns:
+        dict: {(user_id, nome): id da disciplina}
+    """
+    names = {(row[0], row[6]) for row in rows}
+    conn.executemany('''
+        INSERT INTO disciplines (user_id, id, name)
+        SELECT ?1, COALESCE(MAX(id), 0) + 1, ?2 FROM disciplines WHERE user_id = ?1
+        ON CONFLICT DO NOTHING
+    ''', names)
+    return {
+        key: conn.execute(
+            'SELECT id FROM disciplines WHERE user_id = ? AND name = ?', key
+        ).fetchone()[0]
+        for key in names
+    }
+
+
+def save_study_schedules(conn, rows):
+    """
+    Salva um lote de horários de estudo no banco de dados SQLite.
+
+    Cada linha é uma tupla (user_id, user_name, day, start_minute,
+    end_minute, duration, discipline, performance), no formato de
+    `periods.period_minutes`, com o nome da disciplina; o banco guarda o
+    id dela no dicionário do usuário.
+    """
+    ids = _discipline_ids(conn, rows)
+    conn.executemany('''
+        INSERT INTO study_periods
+        (user_id, user_name, day, start_minute, end_minute, duration, discipline_id, performance)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(*row[:6], ids[row[0], row[6]], row[7]) for row in rows])
+    # Atualiza o rollup diário na mesma transação
+    conn.executemany('''
+        INSERT INTO daily_stats (user_id, day, discipline_id, sessions, minutes, performance_sum)
+        VALUES (?, ?, ?, 1, ?, ?)
+        ON CONFLICT (user_id, day, discipline_id) DO UPDATE SET
+            sessions = sessions + 1,
+            minutes = minutes + excluded.minutes,
+            performance_sum = performance_sum + excluded.performance_sum
+    ''', [(row[0], row[2], ids[row[0], row[6]], row[5], row[7]) for row in rows])
+    _bump_user_versions(conn, rows)
+
+
+def save_sleep_schedules(conn, rows):
+    """
+    Salva um lote de horários de sono no banco de dados SQLite.
+
+    Cada linha é uma tupla (user_id, user_name, day, start_minute,
+    end_minute, duration, quality), no formato de `periods.period_minutes`.
+    """
+    conn.executemany('''
+        INSERT INTO sleep_periods
+        (user_id, user_name, day, start_minute, end_minute, duration, quality)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    # Atualiza o rollup diário na mesma transação
+    conn.executemany('''
+        INSERT INTO daily_sleep_stats (user_id, day, quality, sessions, minutes)
+        VALUES (?, ?, ?, 1, ?)
+        ON CONFLICT (user_id, day, quality) DO UPDATE SET
+            sessions = sessions + 1,
+            minutes = minutes + excluded.minutes
+    ''', [(row[0], row[2], row[6], row[5]) for row in rows])
+    _bump_user_versions(conn, rows)
+
+
+def backfill_daily_stats(conn):
+    """
+    Recalcula do zero os rollups diários a partir dos períodos registrados.
+
+    Usado pela migração que cria as tabelas e pelo comando `backfill-stats`,
+    para bancos cujos rollups precisem ser reconstruídos.
+
+    Returns:
+        tuple: (linhas em daily_stats, linhas em daily_sleep_stats)
+    """
+    conn.execute('DELETE FROM daily_stats')
+    conn.execute('''
+        INSERT INTO daily_stats (user_id, day, discipline_id, sessions, minutes, performance_sum)
+        SELECT user_id, day, discipline_id, COUNT(*), SUM(duration), SUM(performance)
+        FROM study_periods
+        GROUP BY user_id, day, discipline_id
+    ''')
+    conn.execute('DELETE FROM daily_sleep_stats')
+    conn.execute('''
+        INSERT INTO daily_sleep_stats (user_id, day, quality, sessions, minutes)
+        SELECT user_id, day, quality, COUNT(*), SUM(duration)
+        FROM sleep_periods
+        GROUP BY user_id, day, quality
+    ''')
+    return (
+        conn.execute('SELECT COUNT(*) FROM daily_stats').fetchone()[0],
+        conn.execute('SELECT COUNT(*) FROM daily_sleep_stats').fetchone()[0],
+    )
+
+
+# Quantidade de registros exibidos por página nas listagens
+PAGE_SIZE = 10
+
+
+def _get_page(conn, table, monthly_table, columns, user_id, cursor, direction, limit):
+    """
+    Busca uma página de registros do usuário por paginação keyset.
+
+    Os registros são ordenados por (day, id) decrescente. O cursor é o par
+    (day, id) da borda da página atual: com `direction='next'` são buscados
+    os registros mais antigos que ele e com `direction='prev'` os mais
+    recentes. Apenas `limit + 1` linhas são lidas, independente do tamanho
+    do histórico, sendo a linha extra usada só para saber se há mais páginas.
+
+    Os meses arquivados entram na mesma ordem como linhas (0, primeiro dia
+    do mês, None, None, minutos, sessões), lidas do resumo mensal com o
+    mesmo cursor e intercaladas às dos períodos.
+
+    Returns:
+        tuple: (linhas da página, há página anterior, há próxima página).
+        Cada linha começa por (id, day, ...).
+    """
+    select = f'SELECT id, day, {columns} FROM {table} WHERE user_id = ?'
+    archived = f'''
+        SELECT 0, month, NULL, NULL, SUM(minutes), SUM(sessions) FROM {monthly_table}
+        WHERE user_id = ? {{}} GROUP BY month ORDER BY month {{}} LIMIT ?
+    '''
+    if cursor is None:
+        params = (user_id, limit + 1)
+        rows = conn.execute(f'{select} ORDER BY day DESC, id DESC LIMIT ?', params).fetchall()
+        condition, order = '', 'DESC'
+    elif direction == 'next':
+        params = (user_id, *cursor, limit + 1)
+        rows = conn.execute(
+            f'{select} AND (day, id) < (?, ?) ORDER BY day DESC, id DESC LIMIT ?', params
+        ).fetchall()
+        condition, order = 'AND (month, 0) < (?, ?)', 'DESC'
+    else:
+        params = (user_id, *cursor, limit + 1)
+        rows = conn.execute(
+            f'{select} AND (day, id) > (?, ?) ORDER BY day ASC, id ASC LIMIT ?', params
+        ).fetchall()
+        condition, order = 'AND (month, 0) > (?, ?)', 'ASC'
+    # Os meses arquivados são mais antigos que os períodos: só entram quando
+    # os períodos não enchem a página ou quando o cursor já é um mês arquivado
+    if len(rows) <= limit or (cursor is not None and cursor[1] == 0):
+        rows += conn.execute(archived.format(condition, order), params).fetchall()
+        rows = sorted(rows, key=lambda row: (row[1], row[0]), reverse=order == 'DESC')[:limit + 1]
+
+    if cursor is None:
+        return rows[:limit], False, len(rows) > limit
+    if direction == 'next':
+        return rows[:limit], True, len(rows) > limit
+    return rows[:limit][::-1], len(rows) > limit, True
+
+
+def get_study_page(conn, user_id, cursor=None, direction='next', limit=PAGE_SIZE):
+    """Busca uma página de horários de estudo do usuário (ver `_get_page`)."""
+    return _get_page(
+        conn, 'study_periods', 'monthly_stats', 'start_minute, end_minute, duration',
+        user_id, cursor, direction, limit
+    )
+
+
+def get_sleep_page(conn, user_id, cursor=None, direction='next', limit=PAGE_SIZE):
+    """Busca uma página de horários de sono do usuário (ver `_get_page`)."""
+    return _get_page(
+        conn, 'sleep_periods', 'monthly_sleep_stats', 'start_minute, end_minute, duration, quality',
+        user_id, cursor, direction, limit
+    )
+
+
+def get_previous_disciplines(conn, user_id):
+    """
+    Recupera as disciplinas previamente estudadas pelo usuário.
+
+    Args:
+        conn (sqlite3.Connection): Conexão com o banco
+        user_id (int): ID do usuário
+
+    Returns:
+        list: Lista de tuplas (id da disciplina, nome, frequência), da mais
+        estudada para a menos estudada
+    """
+    # Busca disciplinas únicas do usuário, ordenadas por frequência, somando
+    # as sessões dos meses arquivados; só as 5 primeiras buscam o nome
+    cursor = conn.execute('''
+        SELECT f.discipline_id, d.name, f.frequency FROM (
+            SELECT discipline_id, SUM(frequency) as frequency FROM (
+                SELECT discipline_id, COUNT(*) as frequency
+                FROM study_periods
+                WHERE user_id = ?
+                GROUP BY discipline_id
+                UNION ALL
+                SELECT discipline_id, SUM(sessions)
+                FROM monthly_stats
+                WHERE user_id = ?
+                GROUP BY discipline_id
+            )
+            GROUP BY discipline_id
+            ORDER BY frequency DESC
+            LIMIT 5
+        ) f
+        JOIN disciplines d ON d.user_id = ? AND d.id = f.discipline_id
+        ORDER BY f.frequency DESC
+    ''', (user_id, user_id, user_id))
+    return cursor.fetchall()
+
+
+def get_discipline_name(conn, user_id, discipline_id):
+    """Retorna o nome da disciplina do usuário com este id, ou None."""
+    row = conn.execute(
+        'SELECT name FROM disciplines WHERE user_id = ? AND id = ?', (user_id, discipline_id)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def get_study_summary(conn, user_id, since=None):
+    """
+    Resume o estudo do usuário por disciplina a partir dos rollups diário e
+    mensal (meses arquivados).
+
+    Args:
+        since (int): Dia inicial (ver `periods.to_day`), ou None para todo o histórico
+
+    Returns:
+        list: Tuplas (disciplina, sessões, minutos, soma das performances),
+        da disciplina mais estudada para a menos estudada
+    """
+    cursor = conn.execute('''
+        SELECT d.name, s.sessions, s.minutes, s.performance_sum FROM (
+            SELECT discipline_id, SUM(sessions) AS sessions, SUM(minutes) AS minutes,
+                   SUM(performance_sum) AS performance_sum
+            FROM (
+                SELECT discipline_id, sessions, minutes, performance_sum
+                FROM daily_stats WHERE user_id = ? AND day >= ?
+                UNION ALL
+                SELECT discipline_id, sessions, minutes, performance_sum
+                FROM monthly_stats WHERE user_id = ? AND month >= ?
+            )
+            GROUP BY discipline_id
+        ) s
+        JOIN disciplines d ON d.user_id = ? AND d.id = s.discipline_id
+        ORDER BY s.minutes DESC
+    ''', (user_id, since or 0, user_id, since or 0, user_id))
+    return cursor.fetchall()
+
+
+def get_sleep_summary(conn, user_id, since=None):
+    """
+    Resume o sono do usuário por qualidade a partir dos rollups diário e mensal.
+
+    Returns:
+        list: Tuplas (qualidade, noites, minutos)
+    """
+    cursor = conn.execute('''
+        SELECT quality, SUM(sessions), SUM(minutes) FROM (
+            SELECT quality, sessions, minutes
+            FROM daily_sleep_stats WHERE user_id = ? AND day >= ?
+            UNION ALL
+            SELECT quality, sessions, minutes
+            FROM monthly_sleep_stats WHERE user_id = ? AND month >= ?
+        )
+        GROUP BY quality
+        ORDER BY SUM(minutes) DESC
+    ''', (user_id, since or 0, user_id, since or 0))
+    return cursor.fetchall()
+
+
+def get_user_version(conn, user_id):
+    """Retorna a versão atual dos dados do usuário (0 se nunca gravou nada)."""
+    row = conn.execute(
+        'SELECT version FROM user_versions WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def _spread_months(rows, since):
+    """
+    Distribui o total de cada mês arquivado, (mês, série, minutos), pelos
+    seus dias, para que o gráfico o desenhe na mesma escala das barras diárias.
+    """
+    for month, name, minutes in rows:
+        length = month_length(month)
+        for day in range(max(month, since), month + length):
+            yield day, name, minutes / length
+
+
+def get_chart_data(conn, user_id, since=None):
+    """
+    Busca nos rollups diários os dados para o gráfico de progresso. O total
+    de cada mês arquivado aparece dividido igualmente entre os dias do mês.
+
+    Returns:
+        tuple: (lista de (dia, disciplina, minutos), lista de (dia, qualidade, minutos))
+    """
+    since = since or 0
+    days = (user_id, since)
+    # Um mês que começa até 30 dias antes de `since` ainda tem dias na janela
+    months = (user_id, since - 30)
+    study = conn.execute('''
+        SELECT day, d.name, minutes FROM daily_stats s
+        JOIN disciplines d ON d.user_id = s.user_id AND d.id = s.discipline_id
+        WHERE s.user_id = ? AND day >= ?
+    ''', days).fetchall()
+    archived = conn.execute('''
+        SELECT month, d.name, minutes FROM monthly_stats s
+        JOIN disciplines d ON d.user_id = s.user_id AND d.id = s.discipline_id
+        WHERE s.user_id = ? AND month >= ?
+    ''', months).fetchall()
+    study.extend(_spread_months(archived, since))
+    sleep = conn.execute(
+        'SELECT day, quality, minutes FROM daily_sleep_stats WHERE user_id = ? AND day >= ?',
+        days
+    ).fetchall()
+    archived = conn.execute(
+        'SELECT month, quality, minutes FROM monthly_sleep_stats WHERE user_id = ? AND month >= ?',
+        months
+    ).fetchall()
+    sleep.extend(_spread_months(archived, since))
+    return study, sleep
+
+
+def get_chart_file_id(conn, user_id, period, first_day, version):
+    """
+    Retorna o file_id do gráfico já enviado para esta janela (primeiro dia
+    do período) e esta versão dos dados, se houver.
+    """
+    row = conn.execute('''
+        SELECT file_id FROM chart_files
+        WHERE user_id = ? AND period = ? AND first_day = ? AND version = ?
+    ''', (user_id, period, first_day, version)).fetchone()
+    return row[0] if row else None
+
+
+def save_chart_file_id(conn, user_id, period, first_day, version, file_id):
+    """Guarda o file_id do gráfico enviado, substituindo o de janelas e versões anteriores."""
+    conn.execute('''
+        INSERT OR REPLACE INTO chart_files (user_id, period, first_day, version, file_id)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (user_id, period, first_day, version, file_id))
+
+
+def get_conversations(conn, name):
+    """
+    Carrega os estados das conversas em andamento de um ConversationHandler.
+
+    Returns:
+        dict: Chave da conversa (tupla) -> estado
+    """
+    cursor = conn.execute(
+        'SELECT key, state FROM conversations WHERE name = ?', (name,)
+    )
+    return {tuple(json.loads(key)): json.loads(state) for key, state in cursor}
+
+
+def get_user_data(conn, user_id):
+    """Carrega o user_data persistido de um usuário ({} se não houver)."""
+    row = conn.execute(
+        'SELECT data FROM user_data WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    return json.loads(row[0]) if row else {}
+
+
+def save_persistence(conn, users, conversations):
+    """
+    Grava em lote o user_data e os estados de conversa alterados.
+
+    Args:
+        users (dict): user_id -> user_data, ou None para apagar
+        conversations (dict): (nome, chave) -> estado, ou None para apagar
+    """
+    conn.executemany(
+        'INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)',
+        [(user_id, json.dumps(data)) for user_id, data in users.items() if data is not None]
+    )
+    conn.executemany(
+        'DELETE FROM user_data WHERE user_id = ?',
+        [(user_id,) for user_id, data in users.items() if data is None]
+    )
+    conn.executemany(
+        'INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)',
+        [
+            (name, json.dumps(key), json.dumps(state))
+            for (name, key), state in conversations.items() if state is not None
+        ]
+    )
+    conn.executemany(
+        'DELETE FROM conversations WHERE name = ? AND key = ?',
+        [(name, json.dumps(key)) for (name, key), state in conversations.items() if state is None]
+    )
+
+
+def get_active_timers(conn):
+    """Carrega os cronômetros em andamento, na ordem de timers.TimerSession."""
+    return conn.execute('''
+        SELECT user_id, kind, chat_id, user_name, started_at, stopped_at, discipline, reminder_minutes
+        FROM active_timers
+    ''').fetchall()
+
+
+def save_active_timers(conn, rows):
+    """Grava um lote de cronômetros (TimerSession.row), substituindo os do mesmo usuário e tipo."""
+    conn.executemany('''
+        INSERT OR REPLACE INTO active_timers
+        (user_id, kind, chat_id, user_name, started_at, stopped_at, discipline, reminder_minutes)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+
+def delete_active_timers(conn, rows):
+    """Apaga um lote de cronômetros descartados, dados como (user_id, tipo)."""
+    conn.executemany('DELETE FROM active_timers WHERE user_id = ? AND kind = ?', rows)
+
+
+def finish_timers(conn, rows):
+    """
+    Grava os períodos dos cronômetros encerrados e os apaga de
+    active_timers na mesma transação, para que um cronômetro nunca seja
+    registrado duas vezes.
+
+    Cada linha é (tipo, período), com tipo 'estudo' ou 'sono' e o período
+    no formato de save_study_schedules ou save_sleep_schedules.
+    """
+    save_study_schedules(conn, [row for kind, row in rows if kind == 'estudo'])
+    save_sleep_schedules(conn, [row for kind, row in rows if kind == 'sono'])
+    delete_active_timers(conn, [(row[0], kind) for kind, row in rows])
+
+
+# Estudos somados ao leaderboard por transação de atualização
+LEADERBOARD_BATCH = 5000
+
+
+def refresh_leaderboards(conn, batch_size=LEADERBOARD_BATCH):
+    """
+    Soma ao leaderboard semanal os estudos gravados desde a última
+    atualização, até `batch_size` ids por chamada.
+
+    O maior id já somado fica em leaderboard_state; como todas as escritas
+    passam pela mesma thread, nenhum id abaixo dele pode aparecer depois.
+
+    Returns:
+        int: Quantidade de ids processados (0 quando já está em dia)
+    """
+    last_id = conn.execute("SELECT last_id FROM leaderboard_state WHERE name = 'weekly'").fetchone()[0]
+    max_id = conn.execute('SELECT MAX(id) FROM study_periods').fetchone()[0] or 0
+    if max_id <= last_id:
+        return 0
+    upper = min(max_id, last_id + batch_size)
+
+    # O nome vem da linha de maior id do grupo (coluna solta com MAX no SQLite)
+    conn.execute('''
+        INSERT INTO leaderboard_weekly (week, user_id, user_name, sessions, minutes, performance_sum)
+        SELECT week, user_id, user_name, sessions, minutes, performance_sum FROM (
+            SELECT (day + 3) / 7 AS week, user_id, user_name, COUNT(*) AS sessions,
+                   SUM(duration) AS minutes, SUM(performance) AS performance_sum, MAX(id)
+            FROM study_periods
+            WHERE id > ? AND id <= ?
+            GROUP BY week, user_id
+        ) WHERE true
+        ON CONFLICT (week, user_id) DO UPDATE SET
+            user_name = excluded.user_name,
+            sessions = sessions + excluded.sessions,
+            minutes = minutes + excluded.minutes,
+            performance_sum = performance_sum + excluded.performance_sum
+    ''', (last_id, upper))
+    conn.execute("UPDATE leaderboard_state SET last_id = ? WHERE name = 'weekly'", (upper,))
+    return upper - last_id
+
+
+def reset_leaderboards(conn):
+    """Apaga os leaderboards para que sejam recalculados desde o primeiro estudo."""
+    conn.execute('DELETE FROM leaderboard_weekly')
+    conn.execute("UPDATE leaderboard_state SET last_id = 0 WHERE name = 'weekly'")
+
+
+def _leaderboard_source(week, chat_id):
+    """Trecho FROM/WHERE do leaderboard da semana, global ou de um grupo."""
+    if chat_id is None:
+        return 'leaderboard_weekly l WHERE l.week = ?', (week,)
+    return '''group_members g
+        JOIN leaderboard_weekly l ON l.week = ? AND l.user_id = g.user_id
+        WHERE g.chat_id = ?''', (week, chat_id)
+
+
+def get_leaderboard(conn, week, chat_id=None, limit=10):
+    """
+    Retorna os primeiros do ranking da semana por minutos estudados, global
+    ou só com os membros do grupo `chat_id`.
+
+    Returns:
+        list: [(user_id, user_name, sessions, minutes, performance_sum)]
+    """
+    source, params = _leaderboard_source(week, chat_id)
+    return conn.execute(f'''
+        SELECT l.user_id, l.user_name, l.sessions, l.minutes, l.performance_sum
+        FROM {source}
+        ORDER BY l.minutes DESC, l.user_id
+        LIMIT ?
+    ''', (*params, limit)).fetchall()
+
+
+def get_leaderboard_entry(conn, week, user_id, chat_id=None):
+    """Retorna a linha do usuário no ranking da semana, ou None."""
+    source, params = _leaderboard_source(week, chat_id)
+    return conn.execute(f'''
+        SELECT l.user_id, l.user_name, l.sessions, l.minutes, l.performance_sum
+        FROM {source} AND l.user_id = ?
+    ''', (*params, user_id)).fetchone()
+
+
+def count_leaderboard_ahead(conn, week, minutes, user_id, chat_id=None):
+    """Conta quantos usuários estão à frente de (minutes, user_id) no ranking."""
+    source, params = _leaderboard_source(week, chat_id)
+    return conn.execute(f'''
+        SELECT COUNT(*) FROM {source}
+        AND (l.minutes > ? OR (l.minutes = ? AND l.user_id < ?))
+    ''', (*params, minutes, minutes, user_id)).fetchone()[0]
+
+
+def get_archived_until(conn, user_id):
+    """Retorna o primeiro dia do último mês arquivado do usuário, ou None."""
+    return conn.execute('''
+        SELECT MAX(month) FROM (
+            SELECT MAX(month) AS month FROM monthly_stats WHERE user_id = ?
+            UNION ALL
+            SELECT MAX(month) FROM monthly_sleep_stats WHERE user_id = ?
+        )
+    ''', (user_id, user_id)).fetchone()[0]
+
+
+def get_totals(conn):
+    """Retorna (usuários, sessões de estudo, minutos de estudo, noites, minutos de sono)."""
+    users = conn.execute('SELECT COUNT(*) FROM user_versions').fetchone()[0]
+    sessions, minutes = conn.execute('''
+        SELECT COALESCE(SUM(sessions), 0), COALESCE(SUM(minutes), 0) FROM (
+            SELECT sessions, minutes FROM daily_stats
+            UNION ALL SELECT sessions, minutes FROM monthly_stats
+        )
+    ''').fetchone()
+    nights, sleep_minutes = conn.execute('''
+        SELECT COALESCE(SUM(sessions), 0), COALESCE(SUM(minutes), 0) FROM (
+            SELECT sessions, minutes FROM daily_sleep_stats
+            UNION ALL SELECT sessions, minutes FROM monthly_sleep_stats
+        )
+    ''').fetchone()
+    return users, sessions, minutes, nights, sleep_minutes
+
+
+def save_group_members(conn, rows):
+    """Registra um lote de (chat_id, user_id) vistos em grupos."""
+    conn.executemany('INSERT OR IGNORE INTO group_members (chat_id, user_id) VALUES (?, ?)', rows)
+
+
+def remove_group_member(conn, chat_id, user_id):
+    conn.execute('DELETE FROM group_members WHERE chat_id = ? AND user_id = ?', (chat_id, user_id))
+
+
+def set_report_subscription(conn, user_id, chat_id, enabled):
+    """Ativa ou desativa o relatório semanal do usuário."""
+    if enabled:
+        conn.execute('''
+            INSERT INTO report_subscriptions (user_id, chat_id) VALUES (?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET chat_id = excluded.chat_id
+        ''', (user_id, chat_id))
+    else:
+        conn.execute('DELETE FROM report_subscriptions WHERE user_id = ?', (user_id,))
+
+
+def get_report_subscription(conn, user_id):
+    """Retorna se o usuário recebe o relatório semanal."""
+    row = conn.execute('SELECT 1 FROM report_subscriptions WHERE user_id = ?', (user_id,)).fetchone()
+    return row is not None
+
+
+def start_report_run(conn, week, deadline):
+    """
+    Abre a execução do relatório da semana `week`, com uma entrega pendente
+    para cada assinante. Chamadas repetidas para a mesma semana não fazem
+    nada, de forma que ninguém recebe o relatório duas vezes.
+
+    Returns:
+        int: Entregas criadas (0 se a execução já existia)
+    """
+    created = conn.execute(
+        'INSERT OR IGNORE INTO report_runs (week, deadline) VALUES (?, ?)', (week, deadline)
+    ).rowcount
+    if not created:
+        return 0
+    return conn.execute('''
+        INSERT INTO report_deliveries (week, user_id, status)
+        SELECT ?, user_id, 'pending' FROM report_subscriptions
+    ''', (week,)).rowcount
+
+
+def get_open_report_run(conn):
+    """Retorna (week, deadline) da execução mais antiga ainda não concluída, ou None."""
+    return conn.execute('''
+        SELECT week, deadline FROM report_runs
+        WHERE finished_at IS NULL ORDER BY week LIMIT 1
+    ''').fetchone()
+
+
+def count_pending_reports(conn, week):
+    return conn.execute(
+        "SELECT COUNT(*) FROM report_deliveries WHERE week = ? AND status = 'pending'", (week,)
+    ).fetchone()[0]
+
+
+def get_report_batch(conn, week, after_user_id, limit):
+    """
+    Retorna o próximo lote de entregas pendentes com os dados da semana.
+
+    Os resumos de todos os usuários do lote saem de uma consulta por tabela
+    de rollup, em vez de uma consulta por usuário.
+
+    Returns:
+        list: [(user_id, chat_id, [(disciplina, sessões, minutos,
+        soma da performance)], [(qualidade, noites, minutos)])], em ordem
+        de user_id
+    """
+    pending = conn.execute('''
+        SELECT d.user_id, s.chat_id
+        FROM report_deliveries d
+        LEFT JOIN report_subscriptions s ON s.user_id = d.user_id
+        WHERE d.week = ? AND d.status = 'pending' AND d.user_id > ?
+        ORDER BY d.user_id
+        LIMIT ?
+    ''', (week, after_user_id, limit)).fetchall()
+    if not pending:
+        return []
+
+    user_ids = [user_id for user_id, _ in pending]
+    placeholders = ','.join('?' * len(user_ids))
+    first_day = week_start(week)
+    params = (*user_ids, first_day, first_day + 6)
+
+    study, sleep = {}, {}
+    for user_id, *row in conn.execute(f'''
+        SELECT s.user_id, d.name, SUM(s.sessions), SUM(s.minutes), SUM(s.performance_sum)
+        FROM daily_stats s
+        JOIN disciplines d ON d.user_id = s.user_id AND d.id = s.discipline_id
+        WHERE s.user_id IN ({placeholders}) AND s.day BETWEEN ? AND ?
+        GROUP BY s.user_id, s.discipline_id
+        ORDER BY s.user_id, SUM(s.minutes) DESC
+    ''', params):
+        study.setdefault(user_id, []).append(tuple(row))
+    for user_id, *row in conn.execute(f'''
+        SELECT user_id, quality, SUM(sessions), SUM(minutes)
+        FROM daily_sleep_stats
+        WHERE user_id IN ({placeholders}) AND day BETWEEN ? AND ?
+        GROUP BY user_id, quality
+        ORDER BY user_id, SUM(sessions) DESC
+    ''', params):
+        sleep.setdefault(user_id, []).append(tuple(row))
+
+    return [
+        (user_id, chat_id, study.get(user_id, []), sleep.get(user_id, []))
+        for user_id, chat_id in pending
+    ]
+
+
+def mark_report_deliveries(conn, rows):
+    """Grava um lote de (status, week, user_id) das entregas concluídas."""
+    conn.executemany('''
+        UPDATE report_deliveries SET status = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE week = ? AND user_id = ?
+    ''', rows)
+
+
+def finish_report_run(conn, week):
+    conn.execute(
+        'UPDATE report_runs SET finished_at = CURRENT_TIMESTAMP WHERE week = ?', (week,)
+    )
+
+
+# Usuários arquivados por transação
+ARCHIVE_BATCH = 100
+
+# Número do primeiro dia do mês de `day` (periods.month_start, em SQL)
+MONTH_OF_DAY = "CAST(julianday(day * 86400, 'unixepoch', 'start of month') - 2440587.5 AS INTEGER)"
+
+
+def get_archive_batch(conn, before, after_user_id=0, limit=ARCHIVE_BATCH):
+    """Ids, em ordem, dos próximos `limit` usuários com períodos anteriores ao dia `before`."""
+    return sorted({
+        user_id
+        for table in ('daily_stats', 'daily_sleep_stats')
+        for user_id, in conn.execute(f'''
+            SELECT DISTINCT user_id FROM {table}
+            WHERE user_id > ? AND day < ?
+            ORDER BY user_id
+            LIMIT ?
+        ''', (after_user_id, before, limit))
+    })[:limit]
+
+
+def archive_periods(conn, before, user_ids, exported=None):
+    """
+    Move os períodos anteriores ao dia `before` dos usuários para os
+    resumos mensais.
+
+    Os resumos saem dos rollups diários, que têm os mesmos totais dos
+    períodos; os períodos e os rollups diários desses dias são apagados na
+    mesma transação. `before` deve ser o primeiro dia de um mês, para que
+    nenhum mês fique dividido entre os dois rollups.
+
+    Args:
+        exported (tuple): (maior id de estudo, maior id de sono) gravados no
+            arquivo frio (ver `history_csv.export_archived`), ou None sem
+            exportação. Usuários com períodos antigos gravados depois da
+            exportação ficam para a próxima execução.
+
+    Returns:
+        tuple: (ids dos usuários arquivados, períodos apagados)
+    """
+    if exported is not None:
+        placeholders = ','.join('?' * len(user_ids))
+        late = set()
+        for table, last_id in zip(('study_periods', 'sleep_periods'), exported):
+            late.update(user_id for user_id, in conn.execute(f'''
+                SELECT DISTINCT user_id FROM {table}
+                WHERE user_id IN ({placeholders}) AND day < ? AND id > ?
+            ''', (*user_ids, before, last_id)))
+        user_ids = [user_id for user_id in user_ids if user_id not in late]
+    if not user_ids:
+        return [], 0
+
+    placeholders = ','.join('?' * len(user_ids))
+    params = (*user_ids, before)
+
+    conn.execute(f'''
+        INSERT INTO monthly_stats (user_id, month, discipline_id, sessions, minutes, performance_sum)
+        SELECT user_id, {MONTH_OF_DAY} AS month, discipline_id,
+               SUM(sessions), SUM(minutes), SUM(performance_sum)
+        FROM daily_stats
+        WHERE user_id IN ({placeholders}) AND day < ?
+        GROUP BY user_id, month, discipline_id
+        ON CONFLICT (user_id, month, discipline_id) DO UPDATE SET
+            sessions = sessions + excluded.sessions,
+            minutes = minutes + excluded.minutes,
+            performance_sum = performance_sum + excluded.performance_sum
+    ''', params)
+    conn.execute(f'''
+        INSERT INTO monthly_sleep_stats (user_id, month, quality, sessions, minutes)
+        SELECT user_id, {MONTH_OF_DAY} AS month, quality, SUM(sessions), SUM(minutes)
+        FROM daily_sleep_stats
+        WHERE user_id IN ({placeholders}) AND day < ?
+        GROUP BY user_id, month, quality
+        ON CONFLICT (user_id, month, quality) DO UPDATE SET
+            sessions = sessions + excluded.sessions,
+            minutes = minutes + excluded.minutes
+    ''', params)
+
+    removed = 0
+    for table in ('daily_stats', 'daily_sleep_stats', 'study_periods', 'sleep_periods'):
+        cursor = conn.execute(f'DELETE FROM {table} WHERE user_id IN ({placeholders}) AND day < ?', params)
+        if table.endswith('_periods'):
+            removed += cursor.rowcount
+    # Listagens, gráficos e /insights em cache mudam com o arquivamento
+    _bump_user_versions(conn, [(user_id,) for user_id in user_ids])
+    return user_ids, removed
+
+
+def incremental_vacuum(conn, pages):
+    """
+    Devolve ao sistema até `pages` páginas livres do arquivo.
+
+    Returns:
+        int: Páginas livres restantes (0 se o banco não está em
+        auto_vacuum=INCREMENTAL, em que não há o que devolver aos poucos)
+    """
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        return 0
+    # Cada passo do comando libera uma página: fetchall o executa até o fim
+    conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+    return conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+
+def enable_incremental_vacuum(conn):
+    """
+    Passa um banco existente para auto_vacuum=INCREMENTAL, com um VACUUM
+    completo que reescreve o arquivo. Deve rodar com o bot parado.
+
+    Returns:
+        bool: False se o banco já estava nesse modo
+    """
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return False
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    return True
@@ -0,0 +1,244 @@
+"""
+Exportação e importação do histórico de estudo e sono em CSV.
+
+O arquivo tem uma linha por período, com as colunas de CSV_COLUMNS; a
+coluna `tipo` diz se a linha é de estudo ou de sono. Os dois sentidos
+trabalham em lotes, sem carregar o histórico inteiro na memória.
+"""
+import os
+import csv
+import gzip
+
+from periods import CLOCK_PATTERN, day_to_date, format_clock, period_minutes
+
+CSV_COLUMNS = ['tipo', 'data', 'inicio', 'termino', 'duracao_minutos', 'disciplina', 'performance', 'qualidade']
+REQUIRED_COLUMNS = {'tipo', 'data', 'inicio', 'termino'}
+# Arquivo frio do arquivamento: o mesmo formato, com o usuário de cada linha
+ARCHIVE_COLUMNS = ['user_id', 'user_name', *CSV_COLUMNS]
+
+# Linhas lidas do banco (fetchmany) ou gravadas (executemany) por vez
+CHUNK_SIZE = 1000
+
+# Quantos erros de validação são guardados para mostrar ao usuário
+MAX_REPORTED_ERRORS = 10
+
+
+def export_history(conn, user_id, path, compress=False, chunk_size=CHUNK_SIZE):
+    """
+    Grava o histórico do usuário em um arquivo CSV, opcionalmente gzip.
+
+    Roda em uma thread leitora (`Database.read`): os cursores são
+    percorridos com fetchmany, de forma que só um lote de linhas fica na
+    memória por vez.
+
+    Returns:
+        int: Quantidade de períodos exportados
+    """
+    exported = 0
+    opener = gzip.open if compress else open
+    with opener(path, 'wt', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_COLUMNS)
+
+        cursor = conn.execute('''
+            SELECT p.day, p.start_minute, p.end_minute, p.duration, d.name, p.performance
+            FROM study_periods p
+            LEFT JOIN disciplines d ON d.user_id = p.user_id AND d.id = p.discipline_id
+            WHERE p.user_id = ? ORDER BY p.day, p.id
+        ''', (user_id,))
+        while rows := cursor.fetchmany(chunk_size):
+            writer.writerows(
+                ('estudo', day_to_date(day), format_clock(start), format_clock(end),
+                 duration, discipline, performance, '')
+                for day, start, end, duration, discipline, performance in rows
+            )
+            exported += len(rows)
+
+        cursor = conn.execute('''
+            SELECT day, start_minute, end_minute, duration, quality
+            FROM sleep_periods WHERE user_id = ? ORDER BY day, id
+        ''', (user_id,))
+        while rows := cursor.fetchmany(chunk_size):
+            writer.writerows(
+                ('sono', day_to_date(day), format_clock(start), format_clock(end),
+                 duration, '', '', quality)
+                for day, start, end, duration, quality in rows
+            )
+            exported += len(rows)
+    return exported
+
+
+def export_archived(conn, path, user_ids, before, chunk_size=CHUNK_SIZE):
+    """
+    Acrescenta ao arquivo frio (CSV gzip) os períodos dos usuários
+    anteriores ao dia `before`, antes de `database.archive_periods` apagá-los.
+
+    Roda em uma thread leitora, fora da transação do arquivamento. Cada
+    chamada grava um novo membro gzip no fim do arquivo (o gzip lê os
+    membros em sequência como um único CSV) e força a gravação em disco
+    antes de retornar. Um lote que não chega a ser arquivado é exportado de
+    novo na próxima execução, podendo repetir linhas no arquivo.
+
+    Returns:
+        tuple: (maior id de estudo, maior id de sono) exportados, 0 se nenhum
+    """
+    last_ids = [0, 0]
+    placeholders = ','.join('?' * len(user_ids))
+    params = (*user_ids, before)
+    with open(path, 'ab') as raw:
+        new_file = raw.tell() == 0
+        with gzip.open(raw, 'wt', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file)
+            if new_file:
+                writer.writerow(ARCHIVE_COLUMNS)
+
+            cursor = conn.execute(f'''
+                SELECT p.id, p.user_id, p.user_name, p.day, p.start_minute, p.end_minute, p.duration,
+                       d.name, p.performance
+                FROM study_periods p
+                LEFT JOIN disciplines d ON d.user_id = p.user_id AND d.id = p.discipline_id
+                WHERE p.user_id IN ({placeholders}) AND p.day < ? ORDER BY p.user_id, p.day, p.id
+            ''', params)
+            while rows := cursor.fetchmany(chunk_size):
+                last_ids[0] = max(last_ids[0], max(row[0] for row in rows))
+                writer.writerows(
+                    (user_id, user_name, 'estudo', day_to_date(day), format_clock(start), format_clock(end),
+                     duration, discipline, performance, '')
+                    for _, user_id, user_name, day, start, end, duration, discipline, performance in rows
+                )
+
+            cursor = conn.execute(f'''
+                SELECT id, user_id, user_name, day, start_minute, end_minute, duration, quality
+                FROM sleep_periods WHERE user_id IN ({placeholders}) AND day < ? ORDER BY user_id, day, id
+            ''', params)
+            while rows := cursor.fetchmany(chunk_size):
+                last_ids[1] = max(last_ids[1], max(row[0] for row in rows))
+                writer.writerows(
+                    (user_id, user_name, 'sono', day_to_date(day), format_clock(start), format_clock(end),
+                     duration, '', '', quality)
+                    for _, user_id, user_name, day, start, end, duration, quality in rows
+                )
+        raw.flush()
+        os.fsync(raw.fileno())
+    return tuple(last_ids)
+
+
+class ImportReport:
+    """Contagem de linhas importadas e os primeiros erros de validação."""
+
+    def __init__(self):
+        self.study = 0
+        self.sleep = 0
+        self.invalid = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"linha {line}: {message}")
+
+
+def _open_csv(path):
+    # Aceita o CSV puro ou compactado, como produzido por /exportar
+    with open(path, 'rb') as file:
+        compressed = file.read(2) == b'\x1f\x8b'
+    opener = gzip.open if compressed else open
+    # utf-8-sig descarta o BOM que planilhas costumam gravar
+    return opener(path, 'rt', encoding='utf-8-sig', newline='')
+
+
+def _parse_row(row, user_id, user_name, qualities):
+    """
+    Valida uma linha do CSV e a converte no formato de `save_*_schedules`.
+
+    Returns:
+        tuple: ('estudo' | 'sono', linha para o banco)
+
+    Raises:
+        ValueError: Com a descrição do problema encontrado na linha
+    """
+    kind = (row.get('tipo') or '').strip().lower()
+    if kind not in ('estudo', 'sono'):
+        raise ValueError("tipo deve ser 'estudo' ou 'sono'")
+
+    start_time = (row.get('inicio') or '').strip()
+    end_time = (row.get('termino') or '').strip()
+    if not CLOCK_PATTERN.match(start_time):
+        raise ValueError("horário de início inválido (use HH:MM)")
+    if not CLOCK_PATTERN.match(end_time):
+        raise ValueError("horário de término inválido (use HH:MM)")
+    try:
+        period = period_minutes((row.get('data') or '').strip(), start_time, end_time)
+    except ValueError:
+        raise ValueError("data inválida (use AAAA-MM-DD)") from None
+
+    if kind == 'estudo':
+        discipline = (row.get('disciplina') or '').strip()
+        if not discipline:
+            raise ValueError("disciplina em branco")
+        try:
+            performance = int(row.get('performance') or '')
+        except ValueError:
+            raise ValueError("performance deve ser um número de 0 a 100") from None
+        if not 0 <= performance <= 100:
+            raise ValueError("performance deve ser um número de 0 a 100")
+        return kind, (user_id, user_name, *period, discipline, performance)
+
+    quality = qualities.get((row.get('qualidade') or '').strip().lower())
+    if quality is None:
+        raise ValueError("qualidade do sono desconhecida")
+    return kind, (user_id, user_name, *period, quality)
+
+
+def read_history(path, user_id, user_name, qualities, report, chunk_size=CHUNK_SIZE):
+    """
+    Lê e valida um CSV de histórico, produzindo lotes prontos para gravação.
+
+    Linhas inválidas são contadas em `report` e ignoradas; as demais são
+    agrupadas em lotes de até `chunk_size` linhas.
+
+    Args:
+        qualities (dict): Texto aceito na coluna `qualidade` (em minúsculas)
+            -> qualidade gravada no banco
+
+    Yields:
+        tuple: (linhas de estudo, linhas de sono) de um lote
+
+    Raises:
+        ValueError: Se o cabeçalho não tiver as colunas obrigatórias
+    """
+    with _open_csv(path) as file:
+        reader = csv.DictReader(file)
+        missing = REQUIRED_COLUMNS - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"colunas obrigatórias ausentes: {', '.join(sorted(missing))}")
+
+        study, sleep = [], []
+        for row in reader:
+            try:
+                kind, parsed = _parse_row(row, user_id, user_name, qualities)
+            except ValueError as error:
+                report.error(reader.line_num, error)
+                continue
+            (study if kind == 'estudo' else sleep).append(parsed)
+            if len(study) + len(sleep) >= chunk_size:
+                yield study, sleep
+                study, sleep = [], []
+        if study or sleep:
+            yield study, sleep
+
+
+def check_history(path, user_id, user_name, qualities, report):
+    """
+    Percorre o CSV inteiro sem gravar nada, registrando em `report` as
+    linhas inválidas.
+
+    A importação chama esta função antes da primeira gravação, de forma que
+    um erro de leitura no meio do arquivo não deixe parte dele importada.
+
+    Raises:
+        ValueError, UnicodeDecodeError, OSError, csv.Error: Se o arquivo não
+            puder ser lido
+    """
+    for _ in read_history(path, user_id, user_name, qualities, report):
+        pass
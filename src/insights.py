@@ -0,0 +1,185 @@
+"""
+Análise da relação entre o sono e a performance nos estudos (/insights).
+
+Os períodos do usuário são lidos em uma única consulta e convertidos em
+arrays NumPy, uma coluna por campo. Cada sessão de estudo é ligada ao sono
+que terminou mais recentemente antes do seu início (busca binária com
+searchsorted), e as médias por faixa são calculadas com bincount, sem laços
+em Python por registro.
+
+Os meses arquivados (database.archive_periods) guardam apenas totais por
+disciplina e por qualidade do sono, sem o horário de cada sessão. Eles
+entram na contagem de sessões, na performance média e nas médias por
+disciplina; as análises que dependem de cada sessão (sono da noite
+anterior e horário de estudo) cobrem só os períodos não arquivados.
+"""
+import numpy as np
+
+from periods import MINUTES_PER_DAY
+
+# Sono considerado "a noite anterior" se terminou até 24h antes do estudo
+MAX_SLEEP_GAP = MINUTES_PER_DAY
+
+# Faixas de duração do sono, em horas (limites inferiores a partir do 2º)
+SLEEP_HOURS_BINS = (6, 7, 8, 9)
+SLEEP_HOURS_LABELS = ('menos de 6h', '6h a 7h', '7h a 8h', '8h a 9h', '9h ou mais')
+
+# Períodos do dia pelo horário de início do estudo
+DAYTIME_BINS = (6, 12, 18)
+DAYTIME_LABELS = ('Madrugada (0h-6h)', 'Manhã (6h-12h)', 'Tarde (12h-18h)', 'Noite (18h-24h)')
+
+
+def load_columns(conn, user_id):
+    """
+    Lê os períodos de estudo e sono do usuário em uma consulta só, e os
+    totais por disciplina dos meses arquivados em outra.
+
+    Returns:
+        dict: Arrays `study_start`, `performance` e `discipline` (códigos,
+        com os nomes em `disciplines`), `sleep_end`, `sleep_duration` e
+        `quality` (texto), com o sono ordenado pelo término, e
+        `archived_discipline`, `archived_sessions` e `archived_performance`
+        (soma), um item por disciplina com meses arquivados
+    """
+    rows = conn.execute('''
+        SELECT 0, p.start_minute, p.end_minute, p.duration, p.performance, d.name
+        FROM study_periods p
+        LEFT JOIN disciplines d ON d.user_id = p.user_id AND d.id = p.discipline_id
+        WHERE p.user_id = ?
+        UNION ALL
+        SELECT 1, start_minute, end_minute, duration, NULL, quality
+        FROM sleep_periods WHERE user_id = ?
+    ''', (user_id, user_id)).fetchall()
+    archived = conn.execute('''
+        SELECT d.name, SUM(s.sessions), SUM(s.performance_sum)
+        FROM monthly_stats s
+        JOIN disciplines d ON d.user_id = s.user_id AND d.id = s.discipline_id
+        WHERE s.user_id = ? GROUP BY d.name
+    ''', (user_id,)).fetchall()
+
+    if rows:
+        kinds, starts, ends, durations, performances, labels = zip(*rows)
+    else:
+        kinds = starts = ends = durations = performances = labels = ()
+    kinds = np.array(kinds, dtype=np.int8)
+    study, sleep = kinds == 0, kinds == 1
+    labels = np.array(labels, dtype=object)
+    archived_names, archived_sessions, archived_performance = zip(*archived) if archived else ((), (), ())
+    # Os mesmos códigos para as disciplinas dos períodos e dos meses arquivados
+    disciplines, discipline_codes = np.unique(
+        np.concatenate([labels[study].astype(str), np.array(archived_names, dtype=str)]),
+        return_inverse=True
+    )
+    study_count = int(study.sum())
+
+    ends = np.array(ends, dtype=np.int64)
+    sleep_order = np.argsort(ends[sleep], kind='stable')
+    return {
+        'study_start': np.array(starts, dtype=np.int64)[study],
+        'performance': np.array(performances, dtype=object)[study].astype(np.float64),
+        'discipline': discipline_codes[:study_count],
+        'disciplines': disciplines,
+        'archived_discipline': discipline_codes[study_count:],
+        'archived_sessions': np.array(archived_sessions, dtype=np.int64),
+        'archived_performance': np.array(archived_performance, dtype=np.float64),
+        # Sono ordenado pelo término, para a busca binária
+        'sleep_end': ends[sleep][sleep_order],
+        'sleep_duration': np.array(durations, dtype=np.int64)[sleep][sleep_order],
+        'quality': labels[sleep][sleep_order].astype(str),
+    }
+
+
+def _grouped(codes, values, labels, totals=None):
+    """
+    Retorna [(rótulo, quantidade, média)] dos grupos não vazios.
+
+    `totals`, se dado, é (códigos, quantidades, somas) de grupos já
+    agregados, somados aos valores avulsos.
+    """
+    counts = np.bincount(codes, minlength=len(labels))
+    sums = np.bincount(codes, weights=values, minlength=len(labels))
+    if totals is not None:
+        total_codes, total_counts, total_sums = totals
+        counts = counts + np.bincount(total_codes, weights=total_counts, minlength=len(labels)).astype(np.int64)
+        sums = sums + np.bincount(total_codes, weights=total_sums, minlength=len(labels))
+    return [
+        (label, int(count), float(total / count))
+        for label, count, total in zip(labels, counts, sums) if count
+    ]
+
+
+def _correlation(x, y):
+    """Correlação de Pearson, ou None com menos de 3 pontos ou sem variação."""
+    if len(x) < 3 or np.ptp(x) == 0 or np.ptp(y) == 0:
+        return None
+    return float(np.corrcoef(x, y)[0, 1])
+
+
+def compute_insights(columns, qualities):
+    """
+    Calcula as correlações e médias de performance do usuário.
+
+    Args:
+        columns (dict): Como retornado por `load_columns`
+        qualities (list): Qualidades do sono da pior para a melhor
+
+    Returns:
+        dict: Sessões analisadas e as médias por faixa, ou None se o
+        usuário não tiver sessões de estudo. `first_day` é o dia da
+        primeira sessão não arquivada (None se não houver nenhuma), a
+        partir do qual valem as análises por sessão
+    """
+    study_start = columns['study_start']
+    performance = columns['performance']
+    archived_sessions = columns['archived_sessions']
+    sessions = len(study_start) + int(archived_sessions.sum())
+    if not sessions:
+        return None
+
+    hour = (study_start % MINUTES_PER_DAY) // 60
+    by_daytime = _grouped(np.digitize(hour, DAYTIME_BINS), performance, DAYTIME_LABELS)
+    by_discipline = sorted(
+        _grouped(
+            columns['discipline'], performance, columns['disciplines'],
+            (columns['archived_discipline'], archived_sessions, columns['archived_performance'])
+        ),
+        key=lambda group: group[1], reverse=True
+    )
+
+    # Último sono terminado antes do início de cada sessão
+    sleep_end = columns['sleep_end']
+    index = np.searchsorted(sleep_end, study_start, side='right') - 1
+    matched = index >= 0
+    matched[matched] = study_start[matched] - sleep_end[index[matched]] <= MAX_SLEEP_GAP
+    index, matched_performance = index[matched], performance[matched]
+
+    sleep_hours = columns['sleep_duration'][index] / 60
+
+    # Posição da qualidade em `qualities` (-1 se desconhecida); o laço em
+    # Python percorre só os textos distintos
+    ranks = {quality: rank for rank, quality in enumerate(qualities)}
+    names, inverse = np.unique(columns['quality'], return_inverse=True)
+    quality_rank = np.array([ranks.get(name, -1) for name in names], dtype=np.int64)[inverse]
+    session_quality = quality_rank[index]
+    known = session_quality >= 0
+
+    return {
+        'sessions': sessions,
+        'archived': sessions - len(study_start),
+        'first_day': int(study_start.min() // MINUTES_PER_DAY) if len(study_start) else None,
+        'matched': int(matched.sum()),
+        'average': float((performance.sum() + columns['archived_performance'].sum()) / sessions),
+        'duration_correlation': _correlation(sleep_hours, matched_performance),
+        'quality_correlation': _correlation(session_quality[known], matched_performance[known]),
+        'by_sleep_hours': _grouped(
+            np.digitize(sleep_hours, SLEEP_HOURS_BINS), matched_performance, SLEEP_HOURS_LABELS
+        ),
+        'by_quality': _grouped(session_quality[known], matched_performance[known], qualities),
+        'by_daytime': by_daytime,
+        'by_discipline': by_discipline,
+    }
+
+
+def user_insights(conn, user_id, qualities):
+    """Lê os períodos e calcula os insights do usuário (para `Database.read`)."""
+    return compute_insights(load_columns(conn, user_id), qualities)
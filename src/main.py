@@ -1,10 +1,19 @@
 import os
 import re
+import csv
+import time
+import glob
+import tempfile
+import asyncio
+import argparse
+import signal
+import multiprocessing
 import logging
-import sqlite3
 from enum import Enum
 from dotenv import load_dotenv
 from telegram import Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ChatType
+from telegram.error import Forbidden, TelegramError
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -12,14 +21,158 @@ from telegram.ext import (
     MessageHandler,
     filters,
     ContextTypes,
-    CallbackQueryHandler
+    CallbackQueryHandler,
+    TypeHandler
 )
 from datetime import datetime, timedelta
 import calendar
+from functools import partial
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+
+from database import (
+    Database,
+    init_database,
+    save_study_schedules,
+    save_sleep_schedules,
+    get_study_page,
+    get_sleep_page,
+    get_previous_disciplines,
+    get_discipline_name,
+    get_study_summary,
+    get_sleep_summary,
+    backfill_daily_stats,
+    get_user_version,
+    get_chart_data,
+    get_chart_file_id,
+    save_chart_file_id,
+    refresh_leaderboards,
+    reset_leaderboards,
+    get_leaderboard,
+    get_leaderboard_entry,
+    count_leaderboard_ahead,
+    get_totals,
+    save_group_members,
+    remove_group_member,
+    set_report_subscription,
+    get_report_subscription,
+    start_report_run,
+    get_open_report_run,
+    count_pending_reports,
+    get_report_batch,
+    mark_report_deliveries,
+    finish_report_run,
+    ARCHIVE_BATCH,
+    get_archive_batch,
+    archive_periods,
+    get_archived_until,
+    incremental_vacuum,
+    enable_incremental_vacuum,
+    get_active_timers,
+    save_active_timers,
+    delete_active_timers,
+    finish_timers
+)
+from batch_writer import BatchWriter
+from cache import ReadModelCache
+from charts import render_progress_chart
+from backup import create_snapshot, list_snapshots, rotate_snapshots, restore_snapshot
+from history_csv import export_history, export_archived, check_history, read_history, ImportReport
+from insights import user_insights
+from periods import (
+    CLOCK, CLOCK_PATTERN, ENTRY_DATE, MINUTES_PER_DAY, today, day_to_date, format_clock, period_minutes,
+    week_of, week_start, month_start, entry_date, latest_start_date, local_minutes
+)
+from update_processor import PerUserUpdateProcessor
+from persistence import SQLitePersistence
+from timers import TimerRegistry, TimerSession
+from rate_limiter import FloodRateLimiter, BULK
+from profiler import SamplingProfiler, handler_codes
+from sharding import ShardSet, shard_of, shard_path, rebalance
+from metrics import (
+    instrument_handlers,
+    start_metrics_server,
+    WRITE_QUEUE_DEPTH,
+    WRITE_ROWS,
+    WRITE_FLUSHES,
+    WRITE_FLUSH_ERRORS,
+    CACHE_LOOKUPS,
+    CACHE_USERS,
+    SEND_QUEUE_DEPTH,
+    SEND_RETRY_AFTER,
+    SEND_COALESCED_EDITS,
+    ACTIVE_CONVERSATIONS,
+    ACTIVE_USERS,
+    BACKUP_LAST_SUCCESS,
+    BACKUP_DURATION,
+    BACKUP_FAILURES,
+    ACTIVE_TIMERS,
+    TIMER_REMINDER_QUEUE,
+    TIMER_REMINDERS
+)
 
 ### VARIÁVEIS DE AMBIENTE ###
 load_dotenv()
 TOKEN = os.getenv('TOKEN_TELEGRAM_BOT')
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'database.db')
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '500'))
+WRITE_BATCH_DELAY_MS = float(os.getenv('WRITE_BATCH_DELAY_MS', '5'))
+READ_CACHE_USERS = int(os.getenv('READ_CACHE_USERS', '10000'))
+CHARTS_DIR = os.getenv('CHARTS_DIR', 'charts')
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', '2'))
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '256'))
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', '10'))
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+# Limites de envio (mensagens por segundo; grupos em mensagens por minuto)
+RATE_LIMIT_GLOBAL = float(os.getenv('RATE_LIMIT_GLOBAL', '30'))
+RATE_LIMIT_PER_CHAT = float(os.getenv('RATE_LIMIT_PER_CHAT', '1'))
+RATE_LIMIT_PER_GROUP_MINUTE = float(os.getenv('RATE_LIMIT_PER_GROUP_MINUTE', '20'))
+RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', '3'))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv('RATE_LIMIT_MAX_RETRIES', '3'))
+# Processos de trabalho, cada um com o seu arquivo SQLite (1 = processo único)
+SHARDS = int(os.getenv('SHARDS', '1'))
+# Intervalo de atualização dos leaderboards de /ranking
+LEADERBOARD_REFRESH_SECONDS = int(os.getenv('LEADERBOARD_REFRESH_SECONDS', '60'))
+RANKING_SIZE = 10
+# Relatório semanal: dia (0 = domingo, como no JobQueue), horário (UTC) e
+# janela em que os envios são espalhados
+WEEKLY_REPORT_DAY = int(os.getenv('WEEKLY_REPORT_DAY', '1'))
+WEEKLY_REPORT_TIME = os.getenv('WEEKLY_REPORT_TIME', '09:00')
+WEEKLY_REPORT_WINDOW_MINUTES = int(os.getenv('WEEKLY_REPORT_WINDOW_MINUTES', '120'))
+WEEKLY_REPORT_BATCH_SIZE = int(os.getenv('WEEKLY_REPORT_BATCH_SIZE', '200'))
+# Arquivamento: períodos com mais de ARCHIVE_AFTER_DAYS dias viram resumos
+# mensais (0 desativa), todo dia no horário ARCHIVE_TIME (UTC)
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '0'))
+ARCHIVE_TIME = os.getenv('ARCHIVE_TIME', '03:30')
+# Diretório dos arquivos frios (CSV gzip) com os períodos arquivados; vazio não exporta
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', '')
+# Páginas devolvidas ao sistema por passo do incremental_vacuum
+VACUUM_STEP_PAGES = int(os.getenv('VACUUM_STEP_PAGES', '256'))
+# Cópias de segurança online a cada BACKUP_INTERVAL_HOURS em BACKUP_DIR
+# (vazio desativa), mantendo as BACKUP_KEEP mais recentes
+BACKUP_DIR = os.getenv('BACKUP_DIR', '')
+BACKUP_INTERVAL_HOURS = float(os.getenv('BACKUP_INTERVAL_HOURS', '24'))
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '7'))
+# Páginas copiadas por passo e pausa entre os passos, que deixa a thread de
+# escrita trabalhar durante a cópia
+BACKUP_STEP_PAGES = int(os.getenv('BACKUP_STEP_PAGES', '256'))
+BACKUP_STEP_PAUSE_MS = float(os.getenv('BACKUP_STEP_PAUSE_MS', '10'))
+# /resumo semana e mes leem só os rollups diários: nada mais recente que
+# isso é arquivado
+ARCHIVE_MIN_DAYS = 31
+# Usuários autorizados a usar /perf (ids separados por vírgula)
+ADMIN_USER_IDS = [int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()]
+PERF_SAMPLE_INTERVAL_MS = float(os.getenv('PERF_SAMPLE_INTERVAL_MS', '5'))
+PERF_MAX_SECONDS = int(os.getenv('PERF_MAX_SECONDS', '300'))
+# Endpoint /metrics (METRICS_PORT=0 desativa)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+# Modo webhook: ativado quando WEBHOOK_URL (URL pública do bot) está definida
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
 
 # Configuração de logging
 logging.basicConfig(
@@ -36,102 +189,184 @@ class SleepQuality(Enum):
     GOOD = "Bom"
     VERY_GOOD = "Muito Bom"
 
+# Qualidades do sono da pior para a melhor, usadas em /insights
+SLEEP_QUALITY_ORDER = [quality.value for quality in SleepQuality]
+
+# Registros em uma única mensagem: /estudo Cálculo 14:00-15:30 ontem 80% e
+# /sono 23:30-07:00 bom (data opcional). Compiladas uma vez, na importação.
+_ENTRY_PERIOD = rf'(?P<start>{CLOCK})\s*-\s*(?P<end>{CLOCK})(?:\s+(?P<date>{ENTRY_DATE}))?'
+STUDY_ENTRY_PATTERN = re.compile(
+    rf'^(?P<discipline>.+?)\s+{_ENTRY_PERIOD}\s+(?P<performance>\d{{1,3}})\s*%?$', re.IGNORECASE
+)
+SLEEP_ENTRY_PATTERN = re.compile(
+    rf'^{_ENTRY_PERIOD}\s+(?P<quality>'
+    + '|'.join(re.escape(quality.value).replace(r'\ ', r'\s+') for quality in SleepQuality)
+    + r')$',
+    re.IGNORECASE
+)
+# Qualidade digitada (minúsculas, espaços simples) -> valor gravado
+SLEEP_QUALITY_NAMES = {quality.value.lower(): quality.value for quality in SleepQuality}
+
+STUDY_ENTRY_USAGE = (
+    "Use: /estudo <disciplina> <início>-<término> [data] <performance>%\n"
+    "Exemplo: /estudo Cálculo 14:00-15:30 ontem 80%"
+)
+SLEEP_ENTRY_USAGE = (
+    "Use: /sono <início>-<término> [data] <qualidade>\n"
+    "Exemplo: /sono 23:30-07:00 bom\n"
+    f"Qualidades: {', '.join(SLEEP_QUALITY_ORDER)}"
+)
+ENTRY_DATE_HELP = (
+    "A data (início do período) pode ser hoje, ontem, anteontem, DD/MM ou DD/MM/AAAA; "
+    "sem data, vale o período mais recente que já terminou."
+)
+
+# Cronômetros: /iniciar_estudo Cálculo 25min (lembrete Pomodoro opcional),
+# /parar 80% e /parar_sono bom (sem o argumento, o bot pergunta)
+TIMER_START_PATTERN = re.compile(r'^(?P<discipline>.+?)(?:\s+(?P<reminder>\d{1,3})\s*min)?$', re.IGNORECASE)
+TIMER_PERFORMANCE_PATTERN = re.compile(r'^(?P<performance>\d{1,3})\s*%?$')
+POMODORO_MIN_MINUTES = 5
+POMODORO_MAX_MINUTES = 180
+# Cronômetros mais longos foram esquecidos ligados e não são registrados
+TIMER_MAX_MINUTES = MINUTES_PER_DAY
+TIMER_PERFORMANCES = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
+
+TIMER_START_USAGE = (
+    "Use: /iniciar_estudo <disciplina> [<minutos>min]\n"
+    "Exemplo: /iniciar_estudo Cálculo 25min (lembrete a cada 25 minutos)"
+)
+TIMER_STOP_USAGE = {
+    'estudo': "Use: /parar [performance]%\nExemplo: /parar 80%",
+    'sono': f"Use: /parar_sono [qualidade]\nQualidades: {', '.join(SLEEP_QUALITY_ORDER)}",
+}
+
 # Definindo estados para a conversa
 DISCIPLINE, START_TIME, END_TIME, SELECT_DATE, CONFIRM_DATE, STUDY_PERFORMANCE = range(6)
 
-# Configuração do banco de dados SQLite
-def init_database():
-    """Inicializa o banco de dados SQLite e cria a tabela de horários."""
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS study_periods (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            user_name TEXT,
-            date TEXT,
-            start_time TEXT,
-            end_time TEXT,
-            duration_hours INTEGER,
-            duration_minutes INTEGER,
-            discipline TEXT,
-            performance INTEGER,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sleep_periods (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            user_name TEXT,
-            date TEXT,
-            start_time TEXT,
-            end_time TEXT,
-            duration_hours INTEGER,
-            duration_minutes INTEGER,
-            quality TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def save_study_schedule(user_id, user_name, date, start_time, end_time, hours, minutes, discipline, performance):
-    """Salva o horário no banco de dados SQLite."""
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO study_periods 
-        (user_id, user_name, date, start_time, end_time, duration_hours, duration_minutes, discipline, performance) 
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, user_name, date, start_time, end_time, hours, minutes, discipline, performance))
-    conn.commit()
-    conn.close()
-    
-def save_sleep_schedule(user_id, user_name, date, start_time, end_time, hours, minutes, quality):
-    """Salva o horário de sono no banco de dados SQLite."""
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO sleep_periods 
-        (user_id, user_name, date, start_time, end_time, duration_hours, duration_minutes, quality) 
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, user_name, date, start_time, end_time, hours, minutes, quality))
-    conn.commit()
-    conn.close()
-    
+# Nomes dos estados numéricos, usados como rótulo nas métricas
+STATE_NAMES = {
+    DISCIPLINE: 'DISCIPLINE',
+    START_TIME: 'START_TIME',
+    END_TIME: 'END_TIME',
+    SELECT_DATE: 'SELECT_DATE',
+    CONFIRM_DATE: 'CONFIRM_DATE',
+    STUDY_PERFORMANCE: 'STUDY_PERFORMANCE',
+}
+
+def format_duration(minutes):
+    """Formata uma quantidade de minutos como 'X horas e Y minutos'."""
+    hours, minutes = divmod(int(minutes), 60)
+    return f"{hours} horas e {minutes} minutos"
+
+def format_archived_month(schedule, unit):
+    """Formata um mês arquivado (0, primeiro dia do mês, None, None, minutos, sessões)."""
+    return (
+        f"Mês: {day_to_date(schedule[1])[:7]} (arquivado)\n"
+        f"{unit}: {schedule[5]}\n"
+        f"Duração total: {format_duration(schedule[4])}\n\n"
+    )
+
+def format_sleep_schedule(schedule):
+    """Formata um registro de sono (id, day, início, término, duração, qualidade)."""
+    if schedule[2] is None:
+        return format_archived_month(schedule, "Noites")
+    return (
+        f"Data: {day_to_date(schedule[1])}\n"
+        f"Início: {format_clock(schedule[2])}\n"
+        f"Término: {format_clock(schedule[3])}\n"
+        f"Duração: {format_duration(schedule[4])}\n"
+        f"Qualidade: {schedule[5]}\n\n"
+    )
+
+def format_study_schedule(schedule):
+    """Formata um registro de estudo (id, day, início, término, duração)."""
+    if schedule[2] is None:
+        return format_archived_month(schedule, "Sessões")
+    return (
+        f"Data: {day_to_date(schedule[1])}\n"
+        f"Início: {format_clock(schedule[2])}\n"
+        f"Término: {format_clock(schedule[3])}\n"
+        f"Duração: {format_duration(schedule[4])}\n\n"
+    )
+
+# Listagens paginadas: tipo -> (consulta da página, cabeçalho, formatação)
+LISTINGS = {
+    'estudo': (get_study_page, "Seus horários registrados:\n\n", format_study_schedule),
+    'sono': (get_sleep_page, "Seus horários de sono registrados:\n\n", format_sleep_schedule),
+}
+
+def generate_page_keyboard(kind, schedules, has_prev, has_next):
+    """
+    Gera os botões de navegação da listagem.
+
+    O callback carrega o cursor keyset (day, id) da borda da página:
+    o primeiro registro para voltar e o último para avançar.
+    """
+    row = []
+    if has_prev:
+        first = schedules[0]
+        row.append(InlineKeyboardButton(
+            "« Anterior", callback_data=f"page_{kind}_prev_{first[1]}_{first[0]}"
+        ))
+    if has_next:
+        last = schedules[-1]
+        row.append(InlineKeyboardButton(
+            "Próxima »", callback_data=f"page_{kind}_next_{last[1]}_{last[0]}"
+        ))
+    return InlineKeyboardMarkup([row]) if row else None
+
+async def render_listing_page(bot_data, kind, user_id, cursor=None, direction='next'):
+    """
+    Monta o texto e o teclado de uma página da listagem, usando o cache de
+    leitura quando a página já foi renderizada.
+
+    Returns:
+        tuple: (texto, teclado), ou (None, None) se a página estiver vazia
+    """
+    cache = bot_data['cache']
+    key = (kind, cursor, direction)
+    page = cache.get_page(user_id, key)
+    if page is not None:
+        return page
+
+    get_page, header, format_schedule = LISTINGS[kind]
+    schedules, has_prev, has_next = await bot_data['db'].read(get_page, user_id, cursor, direction)
+    if not schedules:
+        page = (None, None)
+    else:
+        text = header + "".join(format_schedule(schedule) for schedule in schedules)
+        page = (text, generate_page_keyboard(kind, schedules, has_prev, has_next))
+
+    cache.set_page(user_id, key, page)
+    return page
+
 async def listar_horas_sono(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Lista todos os horários de sono registrados para o usuário atual."""
+    """Lista, página a página, os horários de sono registrados para o usuário atual."""
     user = update.effective_user
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT date, start_time, end_time, duration_hours, duration_minutes, quality 
-        FROM sleep_periods 
-        WHERE user_id = ? 
-        ORDER BY date DESC
-    ''', (user.id,))
-    
-    schedules = cursor.fetchall()
-    conn.close()
+    text, reply_markup = await render_listing_page(context.bot_data, 'sono', user.id)
     
-    if not schedules:
+    if text is None:
         await update.message.reply_text("Você ainda não possui horários de sono registrados.")
         return
     
-    response = "Seus horários de sono registrados:\n\n"
-    for schedule in schedules:
-        response += (
-            f"Data: {schedule[0]}\n"
-            f"Início: {schedule[1]}\n"
-            f"Término: {schedule[2]}\n"
-            f"Duração: {schedule[3]} horas e {schedule[4]} minutos\n"
-            f"Qualidade: {schedule[5]}\n\n"
-        )
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def navegar_listagem(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Troca a página exibida de uma listagem, editando a mesma mensagem."""
+    query = update.callback_query
+    await query.answer()
     
-    await update.message.reply_text(response)
+    # page_<tipo>_<direção>_<dia>_<id>
+    _, kind, direction, day, row_id = query.data.split('_')
+    text, reply_markup = await render_listing_page(
+        context.bot_data, kind, update.effective_user.id, (int(day), int(row_id)), direction
+    )
+    
+    if text is None:
+        await query.edit_message_text("Não há mais registros para exibir.")
+        return
+    
+    await query.edit_message_text(text, reply_markup=reply_markup)
 
 def generate_performance_keyboard():
     """Gera um teclado inline com porcentagens de performance."""
@@ -175,7 +410,7 @@ async def start_sleep_tracking(update: Update, context):
 
 async def get_sleep_start_time(update: Update, context):
     start_time = update.message.text
-    if not re.match(r'^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$', start_time):
+    if not CLOCK_PATTERN.match(start_time):
         await update.message.reply_text(
             "Formato de horário inválido. Por favor, use o formato HH:MM:"
         )
@@ -191,7 +426,7 @@ async def get_sleep_start_time(update: Update, context):
 
 async def get_sleep_end_time(update: Update, context):
     end_time = update.message.text
-    if not re.match(r'^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$', end_time):
+    if not CLOCK_PATTERN.match(end_time):
         await update.message.reply_text(
             "Formato de horário inválido. Por favor, use o formato HH:MM:"
         )
@@ -223,13 +458,8 @@ async def select_sleep_date(update: Update, context):
     start_time = context.user_data.get('sleep_start_time')
     end_time = context.user_data.get('sleep_end_time')
     
-    start_datetime = datetime.strptime(f"{selected_date} {start_time}", '%Y-%m-%d %H:%M')
-    end_datetime = datetime.strptime(f"{selected_date} {end_time}", '%Y-%m-%d %H:%M')
-    
-    time_difference = end_datetime - start_datetime
-    
-    hours, remainder = divmod(time_difference.seconds, 3600)
-    minutes, _ = divmod(remainder, 60)
+    # Sono que atravessa a meia-noite termina no dia seguinte
+    _, _, _, duration = period_minutes(selected_date, start_time, end_time)
     
     # Adicionar teclado inline para qualidade do sono
     keyboard = [
@@ -252,7 +482,7 @@ async def select_sleep_date(update: Update, context):
         f"Data: {selected_date}\n"
         f"Início: {start_time}\n"
         f"Término: {end_time}\n"
-        f"Duração: {hours} horas e {minutes} minutos\n\n"
+        f"Duração: {format_duration(duration)}\n\n"
         "Como foi a qualidade do seu sono?",
         reply_markup=reply_markup
     )
@@ -265,10 +495,23 @@ async def set_commands(application: Application):
         BotCommand("start", "Início do bot"),
         BotCommand("help", "Mostra ajuda"),
         BotCommand("adicionar_estudo", "Registra horário de estudo"),
+        BotCommand("estudo", "Registra um estudo em uma mensagem"),
+        BotCommand("iniciar_estudo", "Inicia um cronômetro de estudo"),
+        BotCommand("parar", "Encerra o cronômetro de estudo"),
         BotCommand("cancelar", "Cancela a operação atual"),
         BotCommand("listar_horas_estudo", "Lista horários de estudo registrados"),
         BotCommand("adicionar_sono", "Registra horário de sono"),
-        BotCommand("listar_horas_sono", "Lista horários de sono registrados")
+        BotCommand("sono", "Registra um sono em uma mensagem"),
+        BotCommand("iniciar_sono", "Inicia um cronômetro de sono"),
+        BotCommand("parar_sono", "Encerra o cronômetro de sono"),
+        BotCommand("listar_horas_sono", "Lista horários de sono registrados"),
+        BotCommand("resumo", "Resumo da semana, do mês ou de tudo"),
+        BotCommand("grafico", "Gráfico de progresso de estudo e sono"),
+        BotCommand("insights", "Relação entre sono e performance"),
+        BotCommand("ranking", "Ranking de horas estudadas da semana"),
+        BotCommand("relatorio_semanal", "Ativa ou desativa o resumo semanal"),
+        BotCommand("exportar", "Exporta seu histórico em CSV"),
+        BotCommand("importar", "Importa histórico de um arquivo CSV")
     ]
     
     # Define os comandos para todos os chats
@@ -287,24 +530,15 @@ async def select_sleep_quality(update: Update, context):
     start_time = context.user_data.get('sleep_start_time')
     end_time = context.user_data.get('sleep_end_time')
     
-    start_datetime = datetime.strptime(f"{selected_date} {start_time}", '%Y-%m-%d %H:%M')
-    end_datetime = datetime.strptime(f"{selected_date} {end_time}", '%Y-%m-%d %H:%M')
-    
-    time_difference = end_datetime - start_datetime
+    day, start_minute, end_minute, duration = period_minutes(selected_date, start_time, end_time)
     
-    hours, remainder = divmod(time_difference.seconds, 3600)
-    minutes, _ = divmod(remainder, 60)
-    
-    save_sleep_schedule(user_id, user_name, selected_date, start_time, end_time, hours, minutes, quality)
+    # Aguarda a gravação do lote antes de confirmar ao usuário
+    await context.bot_data['writer'].submit(
+        save_sleep_schedules, (user_id, user_name, day, start_minute, end_minute, duration, quality)
+    )
     
     await query.edit_message_text(
-        f"Sono registrado:\n"
-        f"Usuário: {user_name}\n"
-        f"Data: {selected_date}\n"
-        f"Início: {start_time}\n"
-        f"Término: {end_time}\n"
-        f"Duração: {hours} horas e {minutes} minutos\n"
-        f"Qualidade: {quality}"
+        format_sleep_record(user_name, selected_date, start_time, end_time, duration, quality)
     )
     
     # Limpar dados do contexto
@@ -329,45 +563,687 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/start - Iniciar o bot\n"
         "/help - Mostra esta mensagem de ajuda\n"
         "/adicionar_estudo - Adiciona um novo horário de estudo\n"
+        "/estudo <disciplina> <início>-<término> [data] <performance>% - Registra um estudo em uma mensagem\n"
+        "/iniciar_estudo <disciplina> [<minutos>min] - Inicia um cronômetro de estudo, com lembretes opcionais\n"
+        "/parar [performance%] - Encerra o cronômetro de estudo e registra o período\n"
         "/listar_horas_estudo - Lista horários de estudo registrados\n"
         "/adicionar_sono - Registra horário de sono\n"
+        "/sono <início>-<término> [data] <qualidade> - Registra um sono em uma mensagem\n"
+        "/iniciar_sono - Inicia um cronômetro de sono\n"
+        "/parar_sono [qualidade] - Encerra o cronômetro de sono e registra o período\n"
         "/listar_horas_sono - Lista horários de sono registrados\n"
+        "/resumo [semana|mes|tudo] - Resumo de estudo e sono\n"
+        "/grafico [semana|mes|tudo] - Gráfico de progresso de estudo e sono\n"
+        "/insights - Relação entre o seu sono e a sua performance\n"
+        "/ranking [global] - Ranking de horas estudadas da semana\n"
+        "/relatorio_semanal [ativar|desativar] - Resumo semanal automático\n"
+        "/exportar [gz] - Exporta seu histórico em CSV\n"
+        "/importar - Importa histórico de um arquivo CSV\n"
         "/cancelar - Cancela a operação atual"
     )
     await update.message.reply_text(help_text)
 
 async def listar_horas_estudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Lista todos os horários registrados para o usuário atual."""
+    """Lista, página a página, os horários registrados para o usuário atual."""
     user = update.effective_user
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    
-    # Busca horários do usuário atual, ordenados pela data mais recente
-    cursor.execute('''
-        SELECT date, start_time, end_time, duration_hours, duration_minutes 
-        FROM study_periods 
-        WHERE user_id = ? 
-        ORDER BY date DESC
-    ''', (user.id,))
     
-    schedules = cursor.fetchall()
-    conn.close()
+    # Primeira página: horários mais recentes do usuário atual
+    text, reply_markup = await render_listing_page(context.bot_data, 'estudo', user.id)
     
-    if not schedules:
+    if text is None:
         await update.message.reply_text("Você ainda não possui horários registrados.")
         return
     
-    # Formatar resposta
-    response = "Seus horários registrados:\n\n"
-    for schedule in schedules:
-        response += (
-            f"Data: {schedule[0]}\n"
-            f"Início: {schedule[1]}\n"
-            f"Término: {schedule[2]}\n"
-            f"Duração: {schedule[3]} horas e {schedule[4]} minutos\n\n"
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+# Períodos aceitos por /resumo: nome -> (título, dias considerados)
+SUMMARY_PERIODS = {
+    'semana': ("da semana", 7),
+    'mes': ("do mês", 30),
+    'tudo': ("de todo o histórico", None),
+}
+
+def parse_period(args):
+    """
+    Interpreta o período pedido em /resumo e /grafico.
+
+    Returns:
+        tuple: (período, título, dia inicial ou None), ou None se inválido
+    """
+    period = args[0].lower() if args else 'semana'
+    if period not in SUMMARY_PERIODS:
+        return None
+
+    title, days = SUMMARY_PERIODS[period]
+    since = None
+    if days is not None:
+        since = today() - (days - 1)
+    return period, title, since
+
+async def resumo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Mostra o resumo de estudo e sono da semana, do mês ou de todo o histórico."""
+    user = update.effective_user
+    parsed = parse_period(context.args)
+    if parsed is None:
+        await update.message.reply_text("Uso: /resumo [semana|mes|tudo]")
+        return
+    period, title, since = parsed
+
+    # Lê apenas os rollups diários, nunca o histórico completo
+    db = context.bot_data['db']
+    study = await db.read(get_study_summary, user.id, since)
+    sleep = await db.read(get_sleep_summary, user.id, since)
+
+    if not study and not sleep:
+        await update.message.reply_text("Você ainda não possui registros neste período.")
+        return
+
+    lines = [f"Resumo {title}:", ""]
+    if study:
+        lines.append("Estudo:")
+        for discipline, sessions, minutes, performance_sum in study:
+            lines.append(
+                f"- {discipline}: {format_duration(minutes)} em {sessions} sessões, "
+                f"performance média {performance_sum / sessions:.0f}%"
+            )
+        lines.append(f"Total: {format_duration(sum(row[2] for row in study))}")
+        lines.append("")
+    if sleep:
+        lines.append("Sono:")
+        for quality, nights, minutes in sleep:
+            lines.append(f"- {quality}: {format_duration(minutes)} em {nights} noites")
+        nights = sum(row[1] for row in sleep)
+        lines.append(f"Média por noite: {format_duration(sum(row[2] for row in sleep) / nights)}")
+
+    await update.message.reply_text("\n".join(lines))
+
+async def grafico(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Envia o gráfico de progresso de estudo e sono do período pedido.
+
+    O PNG é renderizado em um pool de processos e guardado em disco com o
+    primeiro dia da janela e a versão atual dos dados do usuário no nome.
+    Enquanto nenhum dos dois muda, pedidos repetidos reenviam o file_id do
+    Telegram sem renderizar nem fazer upload de novo.
+    """
+    user = update.effective_user
+    parsed = parse_period(context.args)
+    if parsed is None:
+        await update.message.reply_text("Uso: /grafico [semana|mes|tudo]")
+        return
+    period, title, since = parsed
+    caption = f"Seu progresso {title}"
+
+    db = context.bot_data['db']
+    # Sem registros novos, a semana ou o mês ainda mudam com o passar dos dias
+    first_day = since or 0
+    version = await db.read(get_user_version, user.id)
+    file_id = await db.read(get_chart_file_id, user.id, period, first_day, version)
+    if file_id is not None:
+        await update.message.reply_photo(file_id, caption=caption)
+        return
+
+    path = os.path.join(CHARTS_DIR, f"{user.id}_{period}_{first_day}_{version}.png")
+    if not os.path.exists(path):
+        study, sleep = await db.read(get_chart_data, user.id, since)
+        if not study and not sleep:
+            await update.message.reply_text("Você ainda não possui registros neste período.")
+            return
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            context.bot_data['chart_pool'], render_progress_chart, path, caption, study, sleep
         )
-    
-    await update.message.reply_text(response)
+        # Remove os PNGs de janelas e versões anteriores deste período
+        for old_path in glob.glob(os.path.join(CHARTS_DIR, f"{user.id}_{period}_*.png")):
+            if old_path != path:
+                os.remove(old_path)
+
+    with open(path, 'rb') as photo:
+        message = await update.message.reply_photo(photo, caption=caption)
+    await db.write(save_chart_file_id, user.id, period, first_day, version, message.photo[-1].file_id)
+
+# Limite de download de arquivos da Bot API
+IMPORT_MAX_BYTES = 20 * 1024 * 1024
+
+# Qualidades aceitas na importação, pelo texto exibido ou pelo nome
+IMPORT_QUALITIES = {
+    **{quality.value.lower(): quality.value for quality in SleepQuality},
+    **{quality.name.lower(): quality.value for quality in SleepQuality},
+}
+
+def describe_correlation(value):
+    """Descreve uma correlação de Pearson em palavras."""
+    if value is None:
+        return "dados insuficientes"
+    strength = abs(value)
+    if strength < 0.1:
+        label = "nenhuma relação"
+    elif strength < 0.3:
+        label = "relação fraca"
+    elif strength < 0.5:
+        label = "relação moderada"
+    else:
+        label = "relação forte"
+    if strength >= 0.1:
+        label += " positiva" if value > 0 else " negativa"
+    return f"{value:+.2f} ({label})"
+
+def format_insights(result, top_disciplines=10):
+    """Formata o resultado de `insights.compute_insights` para /insights."""
+    lines = [
+        f"Análise de {result['sessions']} sessões de estudo "
+        f"({result['matched']} com o sono da noite anterior registrado).",
+        f"Performance média: {result['average']:.0f}%",
+    ]
+    if result['archived']:
+        # Os meses arquivados não guardam o horário de cada sessão
+        if result['first_day'] is not None:
+            coverage = f"as análises de sono e horário cobrem as sessões desde {day_to_date(result['first_day'])}"
+        else:
+            coverage = "não há sessões fora dos meses arquivados para as análises de sono e horário"
+        lines.append(
+            f"{result['archived']} sessões estão em meses arquivados e entram só na média "
+            f"geral e por disciplina; {coverage}."
+        )
+    lines += [
+        "",
+        f"Duração do sono x performance: {describe_correlation(result['duration_correlation'])}",
+        f"Qualidade do sono x performance: {describe_correlation(result['quality_correlation'])}",
+    ]
+    sections = [
+        ("Performance por duração do sono:", result['by_sleep_hours']),
+        ("Performance por qualidade do sono:", result['by_quality']),
+        ("Performance por horário de estudo:", result['by_daytime']),
+        ("Performance por disciplina:", result['by_discipline'][:top_disciplines]),
+    ]
+    for title, groups in sections:
+        if groups:
+            lines.append("")
+            lines.append(title)
+            lines.extend(f"- {label}: {average:.0f}% ({count} sessões)" for label, count, average in groups)
+    return "\n".join(lines)
+
+async def insights(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Relaciona cada sessão de estudo com o sono da noite anterior e mostra as
+    médias de performance por faixa. O texto fica em cache até o usuário
+    gravar um novo registro (mudança na versão dos seus dados).
+    """
+    user = update.effective_user
+    db = context.bot_data['db']
+    cache = context.bot_data['cache']
+
+    version = await db.read(get_user_version, user.id)
+    text = cache.get_insights(user.id, version)
+    if text is None:
+        result = await db.read(user_insights, user.id, SLEEP_QUALITY_ORDER)
+        if result is None:
+            await update.message.reply_text("Você ainda não possui registros de estudo para analisar.")
+            return
+        text = format_insights(result)
+        cache.set_insights(user.id, version, text)
+
+    await update.message.reply_text(text)
+
+async def track_group_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Registra quem interage com o bot em cada grupo, para o ranking do grupo.
+    Roda antes dos demais handlers e não interfere neles.
+    """
+    chat = update.effective_chat
+    user = update.effective_user
+    if chat is None or user is None or chat.type not in (ChatType.GROUP, ChatType.SUPERGROUP):
+        return
+
+    known = context.bot_data['group_members']
+    message = update.effective_message
+    left = message.left_chat_member if message is not None else None
+    if left is not None:
+        known.discard((chat.id, left.id))
+        await context.bot_data['db'].write(remove_group_member, chat.id, left.id)
+    elif not user.is_bot and (chat.id, user.id) not in known:
+        known.add((chat.id, user.id))
+        await context.bot_data['writer'].submit(save_group_members, (chat.id, user.id))
+
+async def ranking(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Ranking da semana atual por minutos estudados, lido do leaderboard
+    atualizado em segundo plano. Em grupos mostra só os membros do grupo;
+    /ranking global mostra todos os usuários.
+    """
+    user = update.effective_user
+    chat = update.effective_chat
+    in_group = chat.type in (ChatType.GROUP, ChatType.SUPERGROUP)
+    scope_group = in_group and not (context.args and context.args[0].lower() == 'global')
+
+    week = week_of(today())
+    scope = chat.id if scope_group else None
+    shards = context.bot_data['shards']
+    # O topo geral está entre os topos de cada shard
+    tops = await shards.gather(get_leaderboard, week, scope, RANKING_SIZE)
+    top = sorted(chain.from_iterable(tops), key=lambda row: (-row[3], row[0]))[:RANKING_SIZE]
+
+    # Posição do usuário, se ele não está no topo
+    own = None
+    if top and all(row[0] != user.id for row in top):
+        entry = await context.bot_data['db'].read(get_leaderboard_entry, week, user.id, scope)
+        if entry is not None:
+            ahead = await shards.gather(count_leaderboard_ahead, week, entry[3], user.id, scope)
+            own = (sum(ahead) + 1, entry)
+
+    if not top:
+        await update.message.reply_text("Ninguém registrou estudos nesta semana ainda.")
+        return
+
+    first_day = week_start(week)
+    lines = [
+        f"Ranking {'do grupo' if scope_group else 'global'} da semana "
+        f"({day_to_date(first_day)} a {day_to_date(first_day + 6)}):",
+        "",
+    ]
+    for position, (_, name, sessions, minutes, performance_sum) in enumerate(top, 1):
+        lines.append(
+            f"{position}. {name}: {format_duration(minutes)}, "
+            f"performance média {performance_sum / sessions:.0f}%"
+        )
+    if own is not None:
+        position, (_, _, sessions, minutes, performance_sum) = own
+        lines.append("")
+        lines.append(
+            f"Você: {position}º lugar, {format_duration(minutes)}, "
+            f"performance média {performance_sum / sessions:.0f}%"
+        )
+    await update.message.reply_text("\n".join(lines))
+
+async def estatisticas(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Totais de usuários, estudo e sono de todos os shards (somente ADMIN_USER_IDS)."""
+    totals = await context.bot_data['shards'].gather(get_totals)
+    lines = []
+    if len(totals) > 1:
+        for shard, (users, sessions, minutes, nights, _) in enumerate(totals):
+            lines.append(
+                f"Shard {shard}: {users} usuários, {sessions} sessões "
+                f"({format_duration(minutes)}), {nights} noites"
+            )
+        lines.append("")
+    users, sessions, minutes, nights, sleep_minutes = (sum(column) for column in zip(*totals))
+    lines.append(f"Usuários: {users}")
+    lines.append(f"Sessões de estudo: {sessions} ({format_duration(minutes)})")
+    lines.append(f"Noites de sono: {nights} ({format_duration(sleep_minutes)})")
+    await update.message.reply_text("\n".join(lines))
+
+async def refresh_leaderboards_job(context: ContextTypes.DEFAULT_TYPE):
+    """Soma aos leaderboards os estudos gravados desde a última execução."""
+    db = context.bot_data['db']
+    # Lotes em transações separadas, para não segurar a thread de escrita
+    while await db.write(refresh_leaderboards):
+        pass
+
+async def archive_old_periods(db, after_days, cache=None):
+    """
+    Arquiva os períodos com mais de `after_days` dias em resumos mensais e
+    devolve ao sistema, aos poucos, as páginas liberadas no arquivo.
+
+    Cada lote de usuários e cada passo do vacuum é uma transação separada na
+    thread de escrita, intercalada com as gravações do bot. A exportação
+    para o arquivo frio roda antes, em uma thread leitora, para não segurar
+    a thread de escrita durante o gzip e o fsync.
+
+    Returns:
+        tuple: (usuários arquivados, períodos apagados)
+    """
+    # Só meses inteiros, para que nenhum mês fique em dois rollups
+    before = month_start(today() - max(after_days, ARCHIVE_MIN_DAYS))
+    cold_path = None
+    if ARCHIVE_DIR:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        # Um arquivo por banco, já que cada shard arquiva por conta própria
+        name = os.path.splitext(os.path.basename(db.path))[0]
+        cold_path = os.path.join(ARCHIVE_DIR, f"{name}-{day_to_date(today())}.csv.gz")
+
+    users = removed = 0
+    after_user_id = 0
+    while batch := await db.read(get_archive_batch, before, after_user_id, ARCHIVE_BATCH):
+        after_user_id = batch[-1]
+        exported = None
+        if cold_path is not None:
+            exported = await db.read(export_archived, cold_path, batch, before)
+        user_ids, periods = await db.write(archive_periods, before, batch, exported)
+        users += len(user_ids)
+        removed += periods
+        if cache is not None:
+            for user_id in user_ids:
+                cache.invalidate_pages(user_id, 'estudo')
+                cache.invalidate_pages(user_id, 'sono')
+
+    while await db.write(incremental_vacuum, VACUUM_STEP_PAGES):
+        pass
+    logger.info(
+        "Arquivamento até %s: %d períodos de %d usuários", day_to_date(before), removed, users
+    )
+    return users, removed
+
+async def archive_job(context: ContextTypes.DEFAULT_TYPE):
+    """Arquivamento diário dos períodos antigos (ARCHIVE_AFTER_DAYS)."""
+    bot_data = context.bot_data
+    await archive_old_periods(bot_data['db'], ARCHIVE_AFTER_DAYS, bot_data['cache'])
+
+def run_backup(db_path, directory):
+    """Copia o banco para `directory` e apaga as cópias além de BACKUP_KEEP (bloqueante)."""
+    started = time.perf_counter()
+    try:
+        path = create_snapshot(db_path, directory, BACKUP_STEP_PAGES, BACKUP_STEP_PAUSE_MS / 1000)
+    except Exception:
+        BACKUP_FAILURES.inc()
+        raise
+    duration = time.perf_counter() - started
+    BACKUP_DURATION.set(duration)
+    BACKUP_LAST_SUCCESS.set(time.time())
+    removed = rotate_snapshots(directory, db_path, BACKUP_KEEP)
+    logger.info("Cópia de segurança %s em %.1fs (%d antigas apagadas)", path, duration, len(removed))
+    return path
+
+async def backup_job(context: ContextTypes.DEFAULT_TYPE):
+    """Cópia de segurança periódica do banco (BACKUP_DIR), fora do event loop."""
+    await asyncio.to_thread(run_backup, context.bot_data['db'].path, BACKUP_DIR)
+
+async def relatorio_semanal(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ativa ou desativa o relatório semanal (/relatorio_semanal ativar|desativar)."""
+    user = update.effective_user
+    db = context.bot_data['db']
+    action = context.args[0].lower() if context.args else ''
+
+    if action in ('ativar', 'desativar'):
+        enabled = action == 'ativar'
+        await db.write(set_report_subscription, user.id, update.effective_chat.id, enabled)
+        if enabled:
+            await update.message.reply_text("Pronto! Você vai receber o resumo da sua semana toda semana.")
+        else:
+            await update.message.reply_text("Você não vai mais receber o resumo semanal.")
+        return
+
+    enabled = await db.read(get_report_subscription, user.id)
+    await update.message.reply_text(
+        f"O resumo semanal está {'ativado' if enabled else 'desativado'}.\n"
+        "Use /relatorio_semanal ativar ou /relatorio_semanal desativar."
+    )
+
+def format_weekly_report(first_day, study, sleep):
+    """Formata o relatório semanal a partir dos rollups da semana."""
+    lines = [f"Seu resumo da semana ({day_to_date(first_day)} a {day_to_date(first_day + 6)}):", ""]
+    if study:
+        sessions = sum(row[1] for row in study)
+        lines.append("Estudo:")
+        for discipline, _, minutes, _ in study:
+            lines.append(f"- {discipline}: {format_duration(minutes)}")
+        lines.append(f"Total: {format_duration(sum(row[2] for row in study))} em {sessions} sessões")
+        lines.append(f"Performance média: {sum(row[3] for row in study) / sessions:.0f}%")
+    else:
+        lines.append("Nenhum estudo registrado.")
+    lines.append("")
+    if sleep:
+        nights = sum(row[1] for row in sleep)
+        lines.append(f"Sono médio por noite: {format_duration(sum(row[2] for row in sleep) / nights)}")
+        # Linhas em ordem decrescente de noites
+        lines.append(f"Qualidade mais frequente: {sleep[0][0]}")
+    else:
+        lines.append("Nenhum sono registrado.")
+    lines.append("")
+    lines.append("Para parar de receber: /relatorio_semanal desativar")
+    return "\n".join(lines)
+
+async def deliver_weekly_report(bot, db, week, user_id, chat_id, study, sleep):
+    """
+    Envia o relatório de um usuário com prioridade BULK na fila de envio.
+
+    Returns:
+        str: Situação final da entrega
+    """
+    if chat_id is None:
+        # Assinatura desativada depois do início da execução
+        return 'skipped'
+    if not study and not sleep:
+        return 'empty'
+    try:
+        await bot.send_message(
+            chat_id, format_weekly_report(week_start(week), study, sleep), rate_limit_args=BULK
+        )
+    except Forbidden:
+        # Usuário bloqueou o bot: não adianta tentar nas próximas semanas
+        await db.write(set_report_subscription, user_id, chat_id, False)
+        return 'blocked'
+    except TelegramError as error:
+        logger.warning("Falha ao enviar o relatório semanal para %s: %s", user_id, error)
+        return 'failed'
+    return 'sent'
+
+async def send_weekly_reports(bot, bot_data):
+    """
+    Envia as entregas pendentes das execuções abertas do relatório semanal.
+
+    Os envios são espalhados até o prazo da execução: depois de cada envio,
+    espera o tempo restante dividido pelas entregas restantes. A situação de
+    cada entrega é gravada logo após o envio, então uma execução
+    interrompida é retomada de onde parou.
+    """
+    try:
+        await _send_open_report_runs(bot, bot_data['db'], bot_data['writer'])
+    except Exception:
+        # As entregas pendentes continuam no banco para a próxima tentativa
+        logger.exception("Falha no envio do relatório semanal")
+
+async def _send_open_report_runs(bot, db, writer):
+    while (run := await db.read(get_open_report_run)) is not None:
+        week, deadline = run
+        remaining = await db.read(count_pending_reports, week)
+        logger.info(
+            "Relatório semanal da semana %s: %d entregas pendentes", day_to_date(week_start(week)), remaining
+        )
+        after_user_id = 0
+        while batch := await db.read(get_report_batch, week, after_user_id, WEEKLY_REPORT_BATCH_SIZE):
+            for user_id, chat_id, study, sleep in batch:
+                after_user_id = user_id
+                status = await deliver_weekly_report(bot, db, week, user_id, chat_id, study, sleep)
+                await writer.submit(mark_report_deliveries, (status, week, user_id))
+                remaining -= 1
+                if status == 'sent' and remaining > 0:
+                    await asyncio.sleep(max(0.0, deadline - time.time()) / remaining)
+        await db.write(finish_report_run, week)
+        logger.info("Relatório semanal da semana %s concluído", day_to_date(week_start(week)))
+
+def ensure_weekly_report_sender(application: Application):
+    """
+    Inicia a tarefa de envio do relatório semanal, se ainda não estiver
+    rodando. A tarefa fica fora do controle da Application para não
+    atrasar o desligamento; as entregas pendentes ficam no banco.
+    """
+    task = application.bot_data.get('weekly_report_task')
+    if task is None or task.done():
+        application.bot_data['weekly_report_task'] = asyncio.create_task(
+            send_weekly_reports(application.bot, application.bot_data)
+        )
+
+async def weekly_report_job(context: ContextTypes.DEFAULT_TYPE):
+    """Abre a execução do relatório da semana anterior e inicia os envios."""
+    week = week_of(today()) - 1
+    deadline = time.time() + WEEKLY_REPORT_WINDOW_MINUTES * 60
+    created = await context.bot_data['db'].write(start_report_run, week, deadline)
+    logger.info("Relatório semanal: %d entregas criadas", created)
+    ensure_weekly_report_sender(context.application)
+
+async def exportar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Envia o histórico de estudo e sono do usuário como CSV (/exportar gz
+    para compactar). O arquivo é gerado em lotes em um arquivo temporário.
+    """
+    user = update.effective_user
+    compress = bool(context.args) and context.args[0].lower() in ('gz', 'gzip')
+    filename = f"lux_historico_{user.id}.csv" + (".gz" if compress else "")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, filename)
+        db = context.bot_data['db']
+        exported = await db.read(export_history, user.id, path, compress)
+        # Meses arquivados só existem como resumos mensais, sem os períodos
+        archived_until = await db.read(get_archived_until, user.id)
+        archived_note = ""
+        if archived_until is not None:
+            archived_note = (
+                f"Os meses até {day_to_date(archived_until)[:7]} estão arquivados como "
+                "resumos mensais e não entram no arquivo."
+            )
+        if not exported:
+            await update.message.reply_text(
+                archived_note or "Você ainda não possui registros para exportar."
+            )
+            return
+
+        caption = f"{exported} registros exportados."
+        if archived_note:
+            caption += f"\n{archived_note}"
+        with open(path, 'rb') as document:
+            await update.message.reply_document(document, filename=filename, caption=caption)
+
+async def importar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "Envie o arquivo CSV com o histórico (o mesmo formato de /exportar, "
+        "compactado ou não). Colunas: tipo, data, inicio, termino, disciplina, "
+        "performance e qualidade.\n"
+        "Use /cancelar para desistir."
+    )
+    return 'IMPORT_FILE'
+
+async def receive_import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Importa o CSV enviado em lotes: cada lote validado é gravado em uma
+    transação com executemany, pelas mesmas funções das conversas.
+
+    O arquivo é lido por inteiro antes da primeira gravação; se ele não
+    puder ser lido, nada é importado e o usuário pode reenviá-lo corrigido.
+    """
+    user = update.effective_user
+    document = update.message.document
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await update.message.reply_text("Arquivo muito grande. O limite é de 20 MB.")
+        return 'IMPORT_FILE'
+
+    db = context.bot_data['db']
+    cache = context.bot_data['cache']
+    report = ImportReport()
+    loop = asyncio.get_running_loop()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'import.csv')
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+
+        try:
+            # Validação do arquivo inteiro fora do event loop
+            await loop.run_in_executor(
+                None, check_history, path, user.id, user.first_name, IMPORT_QUALITIES, report
+            )
+        except (ValueError, UnicodeDecodeError, OSError, csv.Error) as error:
+            await update.message.reply_text(
+                f"Não foi possível ler o arquivo: {error}\n"
+                "Nenhum registro foi importado."
+            )
+            return 'IMPORT_FILE'
+
+        # As linhas inválidas já foram contadas em `report` na validação
+        chunks = read_history(path, user.id, user.first_name, IMPORT_QUALITIES, ImportReport())
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, next, chunks, None)
+                if chunk is None:
+                    break
+                study, sleep = chunk
+                if study:
+                    await db.write(save_study_schedules, study)
+                    update_read_model(cache, save_study_schedules, study)
+                    report.study += len(study)
+                if sleep:
+                    await db.write(save_sleep_schedules, sleep)
+                    update_read_model(cache, save_sleep_schedules, sleep)
+                    report.sleep += len(sleep)
+        finally:
+            chunks.close()
+
+    lines = [
+        "Importação concluída:",
+        f"- {report.study} registros de estudo",
+        f"- {report.sleep} registros de sono",
+    ]
+    if report.invalid:
+        lines.append(f"- {report.invalid} linhas ignoradas por erro:")
+        lines.extend(f"  {error}" for error in report.errors)
+    await update.message.reply_text("\n".join(lines))
+    return ConversationHandler.END
+
+async def perf(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Profiler por amostragem do processo (somente ADMIN_USER_IDS).
+    /perf start [segundos] inicia a amostragem e /perf stop a encerra antes
+    do prazo; ao final são enviadas as pilhas e as funções mais quentes.
+    """
+    usage = "Uso: /perf start [segundos] ou /perf stop"
+    action = context.args[0].lower() if context.args else ''
+    session = context.bot_data.get('perf_session')
+
+    if action == 'stop':
+        if session is None:
+            await update.message.reply_text("Nenhuma amostragem em andamento.")
+        else:
+            session['stop'].set()
+        return
+
+    if action != 'start':
+        await update.message.reply_text(usage)
+        return
+    if session is not None:
+        await update.message.reply_text("Já existe uma amostragem em andamento. Use /perf stop para encerrá-la.")
+        return
+    try:
+        seconds = int(context.args[1]) if len(context.args) > 1 else 60
+    except ValueError:
+        await update.message.reply_text(usage)
+        return
+    seconds = max(1, min(seconds, PERF_MAX_SECONDS))
+
+    codes = {}
+    for handlers in context.application.handlers.values():
+        handler_codes(handlers, codes)
+    profiler = SamplingProfiler(codes, PERF_SAMPLE_INTERVAL_MS / 1000)
+    session = {'profiler': profiler, 'stop': asyncio.Event()}
+    profiler.start()
+    # Tarefa fora do controle da Application para não atrasar o desligamento
+    session['task'] = asyncio.create_task(
+        finish_perf(context.bot, context.bot_data, update.effective_chat.id, session, seconds)
+    )
+    context.bot_data['perf_session'] = session
+    await update.message.reply_text(f"Amostragem iniciada por {seconds}s. Use /perf stop para encerrar antes.")
+
+async def finish_perf(bot, bot_data, chat_id, session, seconds):
+    """Aguarda o fim da janela de /perf e envia o resultado ao administrador."""
+    profiler = session['profiler']
+    try:
+        await asyncio.wait_for(session['stop'].wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        profiler.stop()
+        bot_data.pop('perf_session', None)
+
+    try:
+        if profiler.samples:
+            filename = f"lux_perf_{datetime.now():%Y%m%d_%H%M%S}.folded"
+            await bot.send_document(
+                chat_id, profiler.collapsed().encode('utf-8'), filename=filename,
+                caption="Pilhas no formato collapsed (flamegraph.pl, speedscope)."
+            )
+        await bot.send_message(chat_id, profiler.report())
+    except Exception:
+        logger.exception("Falha ao enviar o resultado de /perf")
 
 async def start(update: Update, context):
     # Salvar informações do usuário
@@ -376,16 +1252,17 @@ async def start(update: Update, context):
     context.user_data['user_name'] = user.first_name
 
     # Recuperar disciplinas anteriores
-    previous_disciplines = get_previous_disciplines(user.id)
+    previous_disciplines = await load_previous_disciplines(context.bot_data, user.id)
 
     if previous_disciplines:
         # Criar teclado inline com disciplinas anteriores
         keyboard = []
         row = []
-        for discipline in previous_disciplines:
+        for discipline_id, discipline in previous_disciplines:
+            # O id cabe nos 64 bytes do callback_data com qualquer nome
             button = InlineKeyboardButton(
                 discipline, 
-                callback_data=f"discipline_{discipline}"
+                callback_data=f"discipline_{discipline_id}"
             )
             row.append(button)
             
@@ -415,33 +1292,47 @@ async def start(update: Update, context):
     )
     return DISCIPLINE
 
-def get_previous_disciplines(user_id):
+async def load_previous_disciplines(bot_data, user_id):
     """
-    Recupera as disciplinas previamente estudadas pelo usuário.
-    
-    Args:
-        user_id (int): ID do usuário
-    
+    Recupera as disciplinas mais estudadas pelo usuário, passando pelo cache.
+
     Returns:
-        list: Lista de disciplinas únicas estudadas anteriormente
+        list: Pares (id da disciplina, nome)
     """
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    
-    # Busca disciplinas únicas do usuário, ordenadas por frequência
-    cursor.execute('''
-        SELECT DISTINCT discipline, COUNT(*) as frequency 
-        FROM study_periods 
-        WHERE user_id = ? 
-        GROUP BY discipline 
-        ORDER BY frequency DESC 
-        LIMIT 5
-    ''', (user_id,))
-    
-    disciplines = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    
-    return disciplines
+    cache = bot_data['cache']
+    disciplines = cache.get_disciplines(user_id)
+    if disciplines is None:
+        disciplines = await bot_data['db'].read(get_previous_disciplines, user_id)
+        cache.set_disciplines(user_id, disciplines)
+    return [(discipline_id, name) for discipline_id, name, _ in disciplines]
+
+async def resolve_discipline(bot_data, user_id, value):
+    """
+    Nome da disciplina escolhida no teclado de /adicionar_estudo, pelo id
+    no callback_data. Teclados enviados antes dos ids trazem o próprio nome.
+    """
+    if not value.isdigit():
+        return value
+    discipline_id = int(value)
+    for cached_id, name in await load_previous_disciplines(bot_data, user_id):
+        if cached_id == discipline_id:
+            return name
+    return await bot_data['db'].read(get_discipline_name, user_id, discipline_id)
+
+def update_read_model(cache, write_fn, rows):
+    """Mantém o cache de leitura coerente com os lotes gravados no banco."""
+    for row in rows:
+        if write_fn is finish_timers:
+            # Cronômetro encerrado: (tipo, período)
+            kind, row = row
+        else:
+            kind = {save_study_schedules: 'estudo', save_sleep_schedules: 'sono'}.get(write_fn)
+        user_id = row[0]
+        if kind == 'estudo':
+            cache.invalidate_pages(user_id, 'estudo')
+            cache.record_discipline(user_id, row[6])
+        elif kind == 'sono':
+            cache.invalidate_pages(user_id, 'sono')
 
 async def handle_discipline_selection(update: Update, context):
     query = update.callback_query
@@ -452,8 +1343,13 @@ async def handle_discipline_selection(update: Update, context):
         await query.edit_message_text("Digite o nome da disciplina:")
         return DISCIPLINE
     
-    # Selecionar disciplina do teclado inline
-    discipline_selected = query.data.split('_')[1]
+    # Selecionar disciplina do teclado inline (discipline_<id>)
+    discipline_selected = await resolve_discipline(
+        context.bot_data, update.effective_user.id, query.data.partition('_')[2]
+    )
+    if discipline_selected is None:
+        await query.edit_message_text("Disciplina não encontrada. Digite o nome da disciplina:")
+        return DISCIPLINE
     context.user_data['discipline'] = discipline_selected
     
     await query.edit_message_text(
@@ -486,7 +1382,7 @@ async def get_custom_discipline(update: Update, context):
 async def get_start_time(update: Update, context):
     # Validar o formato do horário
     start_time = update.message.text
-    if not re.match(r'^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$', start_time):
+    if not CLOCK_PATTERN.match(start_time):
         await update.message.reply_text(
             "Formato de horário inválido. Por favor, use o formato HH:MM:"
         )
@@ -504,7 +1400,7 @@ async def get_start_time(update: Update, context):
 async def get_end_time(update: Update, context):
     # Validar o formato do horário
     end_time = update.message.text
-    if not re.match(r'^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$', end_time):
+    if not CLOCK_PATTERN.match(end_time):
         await update.message.reply_text(
             "Formato de horário inválido. Por favor, use o formato HH:MM:"
         )
@@ -626,35 +1522,25 @@ async def select_study_performance(update: Update, context):
     end_time = context.user_data.get('end_time')
     selected_date = context.user_data.get('selected_date')
     
-    # Converter horários para objetos datetime
-    start_datetime = datetime.strptime(f"{selected_date} {start_time}", '%Y-%m-%d %H:%M')
-    end_datetime = datetime.strptime(f"{selected_date} {end_time}", '%Y-%m-%d %H:%M')
-        
-    # Calcular a diferença
-    time_difference = end_datetime - start_datetime
-    
-    # Converter a diferença para horas e minutos
-    hours, remainder = divmod(time_difference.seconds, 3600)
-    minutes, _ = divmod(remainder, 60)
+    # Converter para o formato do banco; se o término for anterior ao
+    # início, o estudo atravessou a meia-noite
+    day, start_minute, end_minute, duration = period_minutes(selected_date, start_time, end_time)
     
     # Recuperar informações do usuário
     user_id = context.user_data.get('user_id')
     user_name = context.user_data.get('user_name')
     
     # Salvar no banco de dados SQLite
-    save_study_schedule(user_id, user_name, selected_date, start_time, end_time, hours, minutes, discipline, performance)
-    
-    await query.edit_message_text(
-        f"Horário de estudo registrado:\n"
-        f"Usuário: {user_name}\n"
-        f"Disciplina estudada: {discipline} \n"
-        f"Data: {selected_date}\n"
-        f"Início: {start_time}\n"
-        f"Término: {end_time}\n"
-        f"Duração: {hours} horas e {minutes} minutos\n"
-        f"Performance: {performance}%"
+    # Aguarda a gravação do lote antes de confirmar ao usuário
+    await context.bot_data['writer'].submit(
+        save_study_schedules,
+        (user_id, user_name, day, start_minute, end_minute, duration, discipline, performance)
     )
     
+    await query.edit_message_text(format_study_record(
+        user_name, discipline, selected_date, start_time, end_time, duration, performance
+    ))
+    
     # Limpar os dados do contexto
     del context.user_data['discipline']
     del context.user_data['start_time']
@@ -669,18 +1555,697 @@ async def cancel(update: Update, context):
     await update.message.reply_text("Operação cancelada.")
     return ConversationHandler.END
 
+def format_study_record(user_name, discipline, date_text, start_time, end_time, duration, performance):
+    """Confirmação de um estudo gravado, pela conversa ou por /estudo."""
+    return (
+        f"Horário de estudo registrado:\n"
+        f"Usuário: {user_name}\n"
+        f"Disciplina estudada: {discipline} \n"
+        f"Data: {date_text}\n"
+        f"Início: {start_time}\n"
+        f"Término: {end_time}\n"
+        f"Duração: {format_duration(duration)}\n"
+        f"Performance: {performance}%"
+    )
+
+def format_sleep_record(user_name, date_text, start_time, end_time, duration, quality):
+    """Confirmação de um sono gravado, pela conversa ou por /sono."""
+    return (
+        f"Sono registrado:\n"
+        f"Usuário: {user_name}\n"
+        f"Data: {date_text}\n"
+        f"Início: {start_time}\n"
+        f"Término: {end_time}\n"
+        f"Duração: {format_duration(duration)}\n"
+        f"Qualidade: {quality}"
+    )
+
+def command_arguments(text):
+    """Texto da mensagem depois do comando, com os espaços internos preservados."""
+    parts = (text or '').split(None, 1)
+    return parts[1].strip() if len(parts) > 1 else ''
+
+def resolve_entry_date(match):
+    """Data (YYYY-MM-DD) de um registro rápido, ou None se ela não existe."""
+    if match['date'] is None:
+        return latest_start_date(match['start'], match['end'])
+    try:
+        return entry_date(match['date'])
+    except ValueError:
+        return None
+
+async def estudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Registra um estudo em uma só mensagem, sem a conversa de /adicionar_estudo."""
+    match = STUDY_ENTRY_PATTERN.match(command_arguments(update.message.text))
+    if match is None:
+        await update.message.reply_text(f"{STUDY_ENTRY_USAGE}\n{ENTRY_DATE_HELP}")
+        return
+    performance = int(match['performance'])
+    if performance > 100:
+        await update.message.reply_text("A performance deve estar entre 0% e 100%.")
+        return
+    selected_date = resolve_entry_date(match)
+    if selected_date is None:
+        await update.message.reply_text(f"Data inválida: {match['date']}\n{ENTRY_DATE_HELP}")
+        return
+
+    user = update.effective_user
+    discipline = match['discipline']
+    start_time, end_time = match['start'], match['end']
+    day, start_minute, end_minute, duration = period_minutes(selected_date, start_time, end_time)
+    # Aguarda a gravação do lote antes de confirmar ao usuário
+    await context.bot_data['writer'].submit(
+        save_study_schedules,
+        (user.id, user.first_name, day, start_minute, end_minute, duration, discipline, performance)
+    )
+    await update.message.reply_text(format_study_record(
+        user.first_name, discipline, selected_date, start_time, end_time, duration, performance
+    ))
+
+async def sono(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Registra um sono em uma só mensagem, sem a conversa de /adicionar_sono."""
+    match = SLEEP_ENTRY_PATTERN.match(command_arguments(update.message.text))
+    if match is None:
+        await update.message.reply_text(f"{SLEEP_ENTRY_USAGE}\n{ENTRY_DATE_HELP}")
+        return
+    selected_date = resolve_entry_date(match)
+    if selected_date is None:
+        await update.message.reply_text(f"Data inválida: {match['date']}\n{ENTRY_DATE_HELP}")
+        return
+
+    user = update.effective_user
+    quality = SLEEP_QUALITY_NAMES[' '.join(match['quality'].split()).lower()]
+    start_time, end_time = match['start'], match['end']
+    day, start_minute, end_minute, duration = period_minutes(selected_date, start_time, end_time)
+    await context.bot_data['writer'].submit(
+        save_sleep_schedules, (user.id, user.first_name, day, start_minute, end_minute, duration, quality)
+    )
+    await update.message.reply_text(
+        format_sleep_record(user.first_name, selected_date, start_time, end_time, duration, quality)
+    )
+
+def describe_timer(session, now):
+    """Situação de um cronômetro: início e tempo corrido."""
+    what = f"Estudo de {session.discipline}" if session.kind == 'estudo' else "Sono"
+    text = (
+        f"{what} iniciado às {format_clock(local_minutes(session.started_at))}: "
+        f"{format_duration(session.elapsed_minutes(now))}"
+    )
+    return f"{text} (parado)." if session.stopped_at else f"{text}."
+
+def generate_timer_keyboard(kind):
+    """Teclado do /parar: performance ou qualidade do sono, continuar ou descartar."""
+    if kind == 'estudo':
+        options = [(f"{perc}%", perc) for perc in TIMER_PERFORMANCES]
+        per_row = 3
+    else:
+        options = [(quality.value, quality.name) for quality in SleepQuality]
+        per_row = 2
+    buttons = [InlineKeyboardButton(label, callback_data=f"timer_{kind}_{value}") for label, value in options]
+    keyboard = [buttons[index:index + per_row] for index in range(0, len(buttons), per_row)]
+    keyboard.append([
+        InlineKeyboardButton("Continuar", callback_data=f"timer_{kind}_continuar"),
+        InlineKeyboardButton("Descartar", callback_data=f"timer_{kind}_descartar")
+    ])
+    return keyboard
+
+def parse_timer_outcome(kind, text):
+    """Performance (estudo) ou qualidade (sono) digitada no /parar, ou None se inválida."""
+    if kind == 'estudo':
+        match = TIMER_PERFORMANCE_PATTERN.match(text)
+        if match is None or int(match['performance']) > 100:
+            return None
+        return int(match['performance'])
+    return SLEEP_QUALITY_NAMES.get(' '.join(text.split()).lower())
+
+async def start_timer(update: Update, context, session):
+    """Grava e registra um cronômetro novo, a menos que já haja um do mesmo tipo."""
+    timers = context.bot_data['timers']
+    running = timers.get(session.user_id, session.kind)
+    if running is not None:
+        stop_command = '/parar' if session.kind == 'estudo' else '/parar_sono'
+        await update.message.reply_text(
+            f"{describe_timer(running, time.time())}\nUse {stop_command} para encerrá-lo."
+        )
+        return False
+    await context.bot_data['writer'].submit(save_active_timers, session.row())
+    timers.add(session, session.started_at)
+    arm_timer_reminders(context.job_queue, context.bot_data)
+    return True
+
+async def discard_timer(bot_data, session):
+    """Apaga um cronômetro sem registrar o período."""
+    await bot_data['writer'].submit(delete_active_timers, (session.user_id, session.kind))
+    bot_data['timers'].remove(session)
+
+async def finish_timer(bot_data, session, outcome):
+    """
+    Registra o período de um cronômetro, do início até o /parar (ou agora),
+    e o retira do registro.
+
+    Args:
+        outcome: Performance (estudo) ou qualidade (sono)
+
+    Returns:
+        str: Confirmação para o usuário
+    """
+    start_minute = local_minutes(session.started_at)
+    end_minute = local_minutes(session.stopped_at or time.time())
+    duration = end_minute - start_minute
+    if duration <= 0:
+        await discard_timer(bot_data, session)
+        return "O cronômetro durou menos de um minuto e foi descartado."
+    if duration > TIMER_MAX_MINUTES:
+        await discard_timer(bot_data, session)
+        return (
+            f"O cronômetro passou de {TIMER_MAX_MINUTES // 60} horas e foi descartado. "
+            "Registre o período com /estudo ou /sono."
+        )
+
+    day = start_minute // MINUTES_PER_DAY
+    period = (session.user_id, session.user_name, day, start_minute, end_minute, duration)
+    row = (*period, session.discipline, outcome) if session.kind == 'estudo' else (*period, outcome)
+    # O período e a remoção do cronômetro são gravados na mesma transação
+    await bot_data['writer'].submit(finish_timers, (session.kind, row))
+    bot_data['timers'].remove(session)
+
+    date_text, start_time, end_time = day_to_date(day), format_clock(start_minute), format_clock(end_minute)
+    if session.kind == 'estudo':
+        return format_study_record(
+            session.user_name, session.discipline, date_text, start_time, end_time, duration, outcome
+        )
+    return format_sleep_record(session.user_name, date_text, start_time, end_time, duration, outcome)
+
+async def stop_timer(update: Update, context, kind):
+    """
+    Encerra o cronômetro com a performance ou a qualidade informada no
+    comando. Sem ela, para o cronômetro e pergunta pelo teclado.
+    """
+    timers = context.bot_data['timers']
+    session = timers.get(update.effective_user.id, kind)
+    if session is None:
+        await update.message.reply_text(
+            f"Nenhum cronômetro de {kind} em andamento. Use /iniciar_{kind} para começar."
+        )
+        return
+
+    arguments = command_arguments(update.message.text)
+    if arguments:
+        outcome = parse_timer_outcome(kind, arguments)
+        if outcome is None:
+            await update.message.reply_text(TIMER_STOP_USAGE[kind])
+            return
+        await update.message.reply_text(await finish_timer(context.bot_data, session, outcome))
+        return
+
+    if session.stopped_at is None:
+        timers.pause(session, int(time.time()))
+        await context.bot_data['writer'].submit(save_active_timers, session.row())
+    question = "Qual foi a sua performance?" if kind == 'estudo' else "Como foi a qualidade do seu sono?"
+    await update.message.reply_text(
+        f"{describe_timer(session, time.time())}\n{question}",
+        reply_markup=InlineKeyboardMarkup(generate_timer_keyboard(kind))
+    )
+
+async def iniciar_estudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inicia um cronômetro de estudo, encerrado com /parar."""
+    match = TIMER_START_PATTERN.match(command_arguments(update.message.text))
+    if match is None:
+        await update.message.reply_text(TIMER_START_USAGE)
+        return
+    reminder = int(match['reminder']) if match['reminder'] else None
+    if reminder is not None and not POMODORO_MIN_MINUTES <= reminder <= POMODORO_MAX_MINUTES:
+        await update.message.reply_text(
+            f"O intervalo dos lembretes deve estar entre {POMODORO_MIN_MINUTES} e "
+            f"{POMODORO_MAX_MINUTES} minutos."
+        )
+        return
+
+    user = update.effective_user
+    session = TimerSession(
+        user.id, 'estudo', update.effective_chat.id, user.first_name, int(time.time()),
+        discipline=match['discipline'], reminder_minutes=reminder
+    )
+    if not await start_timer(update, context, session):
+        return
+    reminders = f"Lembrete a cada {reminder} minutos.\n" if reminder else ""
+    await update.message.reply_text(
+        f"Cronômetro de estudo iniciado às {format_clock(local_minutes(session.started_at))}.\n"
+        f"Disciplina: {session.discipline}\n"
+        f"{reminders}"
+        "Use /parar para encerrar."
+    )
+
+async def parar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Encerra o cronômetro de estudo e registra o período."""
+    await stop_timer(update, context, 'estudo')
+
+async def iniciar_sono(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inicia um cronômetro de sono, encerrado com /parar_sono."""
+    user = update.effective_user
+    session = TimerSession(user.id, 'sono', update.effective_chat.id, user.first_name, int(time.time()))
+    if not await start_timer(update, context, session):
+        return
+    await update.message.reply_text(
+        f"Cronômetro de sono iniciado às {format_clock(local_minutes(session.started_at))}. Bom descanso!\n"
+        "Use /parar_sono ao acordar."
+    )
+
+async def parar_sono(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Encerra o cronômetro de sono e registra o período."""
+    await stop_timer(update, context, 'sono')
+
+async def responder_cronometro(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Teclado do /parar: timer_<tipo>_<performance|qualidade|continuar|descartar>."""
+    query = update.callback_query
+    await query.answer()
+
+    _, kind, value = query.data.split('_', 2)
+    timers = context.bot_data['timers']
+    session = timers.get(update.effective_user.id, kind)
+    if session is None:
+        await query.edit_message_text("Este cronômetro já foi encerrado.")
+        return
+
+    if value == 'continuar':
+        timers.resume(session, time.time())
+        await context.bot_data['writer'].submit(save_active_timers, session.row())
+        arm_timer_reminders(context.job_queue, context.bot_data)
+        await query.edit_message_text(f"Cronômetro retomado. {describe_timer(session, time.time())}")
+    elif value == 'descartar':
+        await discard_timer(context.bot_data, session)
+        await query.edit_message_text("Cronômetro descartado.")
+    else:
+        outcome = int(value) if kind == 'estudo' else SleepQuality[value].value
+        await query.edit_message_text(await finish_timer(context.bot_data, session, outcome))
+
+def arm_timer_reminders(job_queue, bot_data):
+    """
+    Agenda o job único dos lembretes Pomodoro para o lembrete mais próximo,
+    se ele vence antes do job já agendado.
+    """
+    if job_queue is None:
+        return
+    due = bot_data['timers'].next_reminder()
+    armed = bot_data.get('timer_reminder_job')
+    if due is None or (armed is not None and armed[0] <= due):
+        return
+    if armed is not None:
+        armed[1].schedule_removal()
+    job = job_queue.run_once(timer_reminder_job, max(0.0, due - time.time()), name='timer_reminders')
+    bot_data['timer_reminder_job'] = (due, job)
+
+async def timer_reminder_job(context: ContextTypes.DEFAULT_TYPE):
+    """Envia os lembretes vencidos e agenda o job para o próximo."""
+    bot_data = context.bot_data
+    bot_data['timer_reminder_job'] = None
+    now = time.time()
+    sessions = bot_data['timers'].pop_due(now)
+    arm_timer_reminders(context.job_queue, bot_data)
+    await asyncio.gather(*(send_timer_reminder(context.bot, session, now) for session in sessions))
+
+async def send_timer_reminder(bot, session, now):
+    """Envia um lembrete Pomodoro com prioridade BULK na fila de envio."""
+    try:
+        await bot.send_message(
+            session.chat_id,
+            f"Pomodoro: {format_duration(session.elapsed_minutes(now))} de {session.discipline}. "
+            "Que tal uma pausa curta?\nUse /parar para encerrar o estudo.",
+            rate_limit_args=BULK
+        )
+    except TelegramError as error:
+        logger.warning("Falha ao enviar o lembrete do cronômetro para %s: %s", session.user_id, error)
+
+def create_services(db, write_batch_delay=WRITE_BATCH_DELAY_MS / 1000):
+    """
+    Cria os serviços usados pelos handlers, guardados em `bot_data`.
+
+    Também usada pelos benchmarks para rodar os handlers fora da aplicação.
+    """
+    writer = BatchWriter(db, max_batch=WRITE_BATCH_SIZE, max_delay=write_batch_delay)
+    cache = ReadModelCache(max_users=READ_CACHE_USERS)
+    writer.add_listener(partial(update_read_model, cache))
+    # Processos com 'spawn' para não herdar as threads do banco via fork
+    os.makedirs(CHARTS_DIR, exist_ok=True)
+    chart_pool = ProcessPoolExecutor(
+        max_workers=CHART_WORKERS, mp_context=multiprocessing.get_context('spawn')
+    )
+    return {
+        'db': db,
+        'writer': writer,
+        'cache': cache,
+        'chart_pool': chart_pool,
+        # Sem sharding, as leituras "de todos os shards" vão só ao próprio banco
+        'shards': ShardSet(db),
+        # (chat_id, user_id) já gravados em group_members
+        'group_members': set(),
+        # Cronômetros em andamento, recarregados em start_services
+        'timers': TimerRegistry(),
+    }
+
+async def start_services(bot_data):
+    """Inicia as tarefas de fundo dos serviços e recarrega os cronômetros."""
+    bot_data['writer'].start()
+    bot_data['timers'].load(await bot_data['db'].read(get_active_timers), time.time())
+
+async def stop_services(bot_data):
+    """Grava as escritas pendentes e libera os recursos dos serviços."""
+    writer = bot_data['writer']
+    await writer.stop()
+    logger.info("Fila de escrita encerrada: %s", writer.stats())
+    logger.info("Cache de leitura: %s", bot_data['cache'].stats())
+    bot_data['chart_pool'].shutdown(wait=True)
+    bot_data['shards'].close()
+    bot_data['db'].close()
+
+def bind_metrics(application: Application):
+    """Liga as métricas lidas na coleta aos contadores dos serviços da aplicação."""
+    writer = application.bot_data['writer']
+    cache = application.bot_data['cache']
+    limiter = application.bot.rate_limiter
+    persistence = application.persistence
+
+    WRITE_QUEUE_DEPTH.callback = lambda: writer.queue_depth
+    WRITE_ROWS.callback = lambda: writer.rows_written
+    WRITE_FLUSHES.callback = lambda: writer.flushes
+    WRITE_FLUSH_ERRORS.callback = lambda: writer.flush_errors
+    CACHE_LOOKUPS.callback = lambda: {('hit',): cache.hits, ('miss',): cache.misses}
+    CACHE_USERS.callback = lambda: cache.stats()['users']
+    SEND_QUEUE_DEPTH.callback = lambda: {
+        (priority,): depth for priority, depth in limiter.stats()['queue_depth'].items()
+    }
+    SEND_RETRY_AFTER.callback = lambda: limiter.retry_after
+    SEND_COALESCED_EDITS.callback = lambda: limiter.coalesced_edits
+    ACTIVE_CONVERSATIONS.callback = lambda: {
+        (name, STATE_NAMES.get(state, state)): count
+        for (name, state), count in persistence.conversation_counts().items()
+    }
+    ACTIVE_USERS.callback = lambda: application.update_processor.active_keys
+    timers = application.bot_data['timers']
+    ACTIVE_TIMERS.callback = lambda: {(kind,): count for kind, count in timers.counts().items()}
+    TIMER_REMINDER_QUEUE.callback = lambda: timers.queued_reminders
+    TIMER_REMINDERS.callback = lambda: timers.reminders_sent
+
+async def post_init(application: Application):
+    """Inicia os serviços, o endpoint de métricas e configura os comandos do bot."""
+    await start_services(application.bot_data)
+    if application.job_queue is not None:
+        application.job_queue.run_repeating(
+            refresh_leaderboards_job, interval=LEADERBOARD_REFRESH_SECONDS, first=0, name='leaderboards'
+        )
+        application.job_queue.run_daily(
+            weekly_report_job,
+            datetime.strptime(WEEKLY_REPORT_TIME, '%H:%M').time(),
+            days=(WEEKLY_REPORT_DAY,),
+            name='weekly_report'
+        )
+        if ARCHIVE_AFTER_DAYS:
+            application.job_queue.run_daily(
+                archive_job, datetime.strptime(ARCHIVE_TIME, '%H:%M').time(), name='archive'
+            )
+        if BACKUP_DIR:
+            interval = BACKUP_INTERVAL_HOURS * 3600
+            # Conta o intervalo a partir da última cópia, para que reinícios
+            # do bot não gerem uma cópia a cada vez
+            snapshots = list_snapshots(BACKUP_DIR, application.bot_data['db'].path)
+            first = max(0, os.path.getmtime(snapshots[-1]) + interval - time.time()) if snapshots else 0
+            application.job_queue.run_repeating(backup_job, interval=interval, first=first, name='backup')
+        # Lembretes dos cronômetros recarregados do banco
+        arm_timer_reminders(application.job_queue, application.bot_data)
+    else:
+        logger.warning(
+            "JobQueue indisponível (instale python-telegram-bot[job-queue]): "
+            "/ranking e o relatório semanal não serão atualizados, as cópias de segurança "
+            "não serão criadas e os cronômetros não enviarão lembretes"
+        )
+    # Retoma uma execução do relatório semanal interrompida
+    ensure_weekly_report_sender(application)
+    shard = application.bot_data['shards'].index
+    if METRICS_PORT:
+        # Com sharding, cada processo de trabalho usa a porta seguinte
+        application.bot_data['metrics_server'] = await start_metrics_server(METRICS_PORT + shard, METRICS_HOST)
+    if shard == 0:
+        await set_commands(application)
+
+async def post_shutdown(application: Application):
+    """Encerra os serviços ao desligar o bot."""
+    perf_session = application.bot_data.get('perf_session')
+    if perf_session is not None:
+        perf_session['task'].cancel()
+    weekly_report_task = application.bot_data.pop('weekly_report_task', None)
+    if weekly_report_task is not None:
+        weekly_report_task.cancel()
+        try:
+            await weekly_report_task
+        except asyncio.CancelledError:
+            pass
+    metrics_server = application.bot_data.pop('metrics_server', None)
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    await stop_services(application.bot_data)
+    if application.bot.rate_limiter is not None:
+        logger.info("Fila de envio: %s", application.bot.rate_limiter.stats())
+
+def backfill_stats():
+    """Reconstrói os rollups diários e os leaderboards a partir de todo o histórico."""
+    db = Database(DATABASE_PATH)
+    db.write_sync(init_database)
+    study_rows, sleep_rows = db.write_sync(backfill_daily_stats)
+    db.write_sync(reset_leaderboards)
+    while db.write_sync(refresh_leaderboards):
+        pass
+    db.close()
+    logger.info("Rollups reconstruídos: %d de estudo e %d de sono", study_rows, sleep_rows)
+
+def archive_now(after_days, vacuum=False):
+    """Arquiva os períodos antigos de todos os shards fora do bot (comando `archive`)."""
+    for shard in range(SHARDS):
+        db = Database(shard_path(DATABASE_PATH, shard, SHARDS), readers=1)
+        db.write_sync(init_database)
+        if vacuum and db.write_sync(enable_incremental_vacuum):
+            logger.info("%s convertido para auto_vacuum=INCREMENTAL", db.path)
+        if after_days:
+            asyncio.run(archive_old_periods(db, after_days))
+        db.close()
+
+def backup_now(directory):
+    """Copia os bancos de todos os shards para `directory` (comando `backup`)."""
+    for shard in range(SHARDS):
+        run_backup(shard_path(DATABASE_PATH, shard, SHARDS), directory)
+
 def main():
+    parser = argparse.ArgumentParser(description="LUX - Learning Unleashed eXcellence")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('backfill-stats', help="Reconstrói os rollups diários e os leaderboards")
+    rebalance_parser = subparsers.add_parser(
+        'rebalance-shards', help="Redistribui os usuários ao mudar o número de shards (com o bot parado)"
+    )
+    rebalance_parser.add_argument('--from', dest='old_shards', type=int, required=True)
+    rebalance_parser.add_argument('--to', dest='new_shards', type=int, default=SHARDS)
+    archive_parser = subparsers.add_parser(
+        'archive', help="Arquiva os períodos antigos em resumos mensais (com o bot parado)"
+    )
+    archive_parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                                help="Idade mínima dos períodos arquivados (padrão: ARCHIVE_AFTER_DAYS)")
+    archive_parser.add_argument('--vacuum', action='store_true',
+                                help="Antes, converte o banco para auto_vacuum=INCREMENTAL (VACUUM completo)")
+    backup_parser = subparsers.add_parser(
+        'backup', help="Cria uma cópia de segurança dos bancos (pode rodar com o bot no ar)"
+    )
+    backup_parser.add_argument('--dir', default=BACKUP_DIR or 'backups',
+                               help="Diretório das cópias (padrão: BACKUP_DIR ou backups)")
+    restore_parser = subparsers.add_parser(
+        'restore', help="Confere uma cópia de segurança e a coloca no lugar do banco (com o bot parado)"
+    )
+    restore_parser.add_argument('snapshot', help="Arquivo da cópia (com o .sha256 ao lado)")
+    restore_parser.add_argument('--db', default=DATABASE_PATH if SHARDS <= 1 else None,
+                                help="Banco substituído (padrão: DATABASE_PATH; obrigatório com SHARDS > 1)")
+    args = parser.parse_args()
+
+    if args.command == 'backfill-stats':
+        backfill_stats()
+        return
+    if args.command == 'rebalance-shards':
+        moved = rebalance(DATABASE_PATH, args.old_shards, args.new_shards)
+        logger.info("Rebalanceamento concluído: %d usuários movidos", sum(moved.values()))
+        return
+    if args.command == 'archive':
+        archive_now(args.days, args.vacuum)
+        return
+    if args.command == 'backup':
+        backup_now(args.dir)
+        return
+    if args.command == 'restore':
+        if args.db is None:
+            parser.error("com SHARDS > 1, indique o banco do shard com --db")
+        try:
+            replaced = restore_snapshot(args.snapshot, args.db)
+        except (OSError, ValueError) as e:
+            parser.exit(1, f"Restauração cancelada: {e}\n")
+        logger.info("%s restaurado a partir de %s", args.db, args.snapshot)
+        if replaced:
+            logger.info("Banco anterior mantido em %s", replaced)
+        return
+
+    if SHARDS > 1:
+        run_sharded(SHARDS)
+    else:
+        run_application(build_application())
+
+def run_application(application: Application):
+    """Roda a aplicação por polling ou, com WEBHOOK_URL, por webhook."""
+    if WEBHOOK_URL:
+        # Servidor HTTP local; o TLS fica a cargo do proxy reverso
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+async def route_update(queues, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Encaminha o update ao processo de trabalho dono do usuário."""
+    user = update.effective_user
+    message = update.effective_message
+    if message is not None and message.left_chat_member is not None:
+        # A saída do grupo é apagada no shard de quem saiu, não de quem removeu
+        user = message.left_chat_member
+    shard = shard_of(user.id, len(queues)) if user is not None else 0
+    queues[shard].put(update.to_dict())
+
+def build_dispatcher(queues, token=TOKEN, api_url=TELEGRAM_API_URL):
+    """
+    Monta a aplicação do processo despachante: só recebe os updates (por
+    polling ou webhook) e os repassa às filas dos processos de trabalho.
+    """
+    builder = Application.builder().token(token)
+    if api_url:
+        builder.base_url(f"{api_url.rstrip('/')}/bot")
+        builder.base_file_url(f"{api_url.rstrip('/')}/file/bot")
+    application = builder.build()
+    application.add_handler(TypeHandler(Update, partial(route_update, queues)))
+    return application
+
+def run_shard_worker(shard, shards, updates):
+    """Processo de trabalho: a aplicação completa sobre o shard, alimentada pela fila."""
+    # O desligamento é comandado pelo despachante, pela fila
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    application = build_application(shard=shard, shards=shards)
+    asyncio.run(serve_shard(application, updates))
+
+async def serve_shard(application: Application, updates):
+    loop = asyncio.get_running_loop()
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    try:
+        # None indica o fim
+        while (data := await loop.run_in_executor(None, updates.get)) is not None:
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+def run_sharded(shards):
+    """
+    Roda o bot em `shards` processos de trabalho, um por arquivo SQLite,
+    com este processo como despachante dos updates.
+    """
+    # Todos os shards existem antes dos processos, para as leituras entre shards
+    for shard in range(shards):
+        db = Database(shard_path(DATABASE_PATH, shard, shards), readers=1)
+        db.write_sync(init_database)
+        db.close()
+
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue() for _ in range(shards)]
+    workers = [
+        context.Process(target=run_shard_worker, args=(shard, shards, queues[shard]), name=f'lux-shard-{shard}')
+        for shard in range(shards)
+    ]
+    for worker in workers:
+        worker.start()
+    logger.info("%d processos de trabalho iniciados", shards)
+    try:
+        run_application(build_dispatcher(queues))
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+
+def build_application(token=TOKEN, db_path=DATABASE_PATH, api_url=TELEGRAM_API_URL, shard=0, shards=1):
+    """
+    Monta a aplicação com o banco, os serviços auxiliares e todos os handlers.
+
+    Args:
+        token (str): Token do bot
+        db_path (str): Caminho do arquivo SQLite (com sharding, o nome base
+            dos arquivos de shard)
+        api_url (str): URL alternativa da Bot API (por exemplo, um servidor
+            local de testes), ou None para a API oficial do Telegram
+        shard (int): Shard deste processo de trabalho
+        shards (int): Quantidade de shards (1 = sem sharding)
+    """
     # Inicializar o banco de dados
-    init_database()
+    paths = [shard_path(db_path, index, shards) for index in range(shards)]
+    db = Database(paths[shard])
+    db.write_sync(init_database)
     
     # Configurar o aplicativo
-    application = Application.builder().token(TOKEN).build()
+    builder = Application.builder().token(token)
+    # Conversas e user_data sobrevivem a reinícios
+    builder.persistence(SQLitePersistence(db, update_interval=PERSISTENCE_INTERVAL))
+    # Updates de usuários diferentes em paralelo, os de um mesmo usuário em ordem
+    builder.concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+    # Todos os envios passam pelos limites de flood do Telegram
+    # O limite global do Telegram é dividido entre os processos de trabalho
+    builder.rate_limiter(FloodRateLimiter(
+        global_rate=RATE_LIMIT_GLOBAL / shards,
+        chat_rate=RATE_LIMIT_PER_CHAT,
+        group_rate=RATE_LIMIT_PER_GROUP_MINUTE / 60,
+        burst=RATE_LIMIT_BURST,
+        max_retries=RATE_LIMIT_MAX_RETRIES
+    ))
+    if api_url:
+        builder.base_url(f"{api_url.rstrip('/')}/bot")
+        builder.base_file_url(f"{api_url.rstrip('/')}/file/bot")
+    application = builder.build()
+    application.bot_data.update(create_services(db))
+    if shards > 1:
+        application.bot_data['shards'] = ShardSet(db, paths, shard)
 
     # Adicionar handlers de comandos gerais
     application.add_handler(CommandHandler('start', bot_start))
     application.add_handler(CommandHandler('help', help_command))
     application.add_handler(CommandHandler('listar_horas_estudo', listar_horas_estudo))
     application.add_handler(CommandHandler('listar_horas_sono', listar_horas_sono))
+    application.add_handler(CommandHandler('resumo', resumo))
+    application.add_handler(CommandHandler('grafico', grafico))
+    application.add_handler(CommandHandler('estudo', estudo))
+    application.add_handler(CommandHandler('sono', sono))
+    application.add_handler(CommandHandler('iniciar_estudo', iniciar_estudo))
+    application.add_handler(CommandHandler('parar', parar))
+    application.add_handler(CommandHandler('iniciar_sono', iniciar_sono))
+    application.add_handler(CommandHandler('parar_sono', parar_sono))
+    application.add_handler(CallbackQueryHandler(responder_cronometro, pattern=r'^timer_'))
+    application.add_handler(CallbackQueryHandler(navegar_listagem, pattern=r'^page_'))
+    application.add_handler(TypeHandler(Update, track_group_member), group=-1)
+    application.add_handler(CommandHandler('insights', insights))
+    application.add_handler(CommandHandler('ranking', ranking))
+    application.add_handler(CommandHandler('relatorio_semanal', relatorio_semanal))
+    application.add_handler(CommandHandler('exportar', exportar))
+    application.add_handler(CommandHandler('perf', perf, filters=filters.User(user_id=ADMIN_USER_IDS)))
+    application.add_handler(
+        CommandHandler('estatisticas', estatisticas, filters=filters.User(user_id=ADMIN_USER_IDS))
+    )
 
     # Criar o conversation handler
     # Modificar o study_conv_handler para incluir os novos estados
@@ -702,7 +2267,9 @@ def main():
             SELECT_DATE: [CallbackQueryHandler(select_date)],
             STUDY_PERFORMANCE: [CallbackQueryHandler(select_study_performance)]
         },
-        fallbacks=[CommandHandler('cancelar', cancel)]
+        fallbacks=[CommandHandler('cancelar', cancel)],
+        name='adicionar_estudo',
+        persistent=True
     )
     # Adicione o novo conversation handler para sono
     sleep_conv_handler = ConversationHandler(
@@ -713,18 +2280,37 @@ def main():
             'SLEEP_SELECT_DATE': [CallbackQueryHandler(select_sleep_date)],
             'SLEEP_QUALITY': [CallbackQueryHandler(select_sleep_quality)]
         },
-        fallbacks=[CommandHandler('cancelar', cancel)]
+        fallbacks=[CommandHandler('cancelar', cancel)],
+        name='adicionar_sono',
+        persistent=True
+    )
+
+    # Importação de histórico: aguarda o arquivo CSV depois de /importar
+    import_conv_handler = ConversationHandler(
+        entry_points=[CommandHandler('importar', importar)],
+        states={
+            'IMPORT_FILE': [MessageHandler(filters.Document.ALL, receive_import_file)]
+        },
+        fallbacks=[CommandHandler('cancelar', cancel)],
+        name='importar',
+        persistent=True
     )
 
     # Adicionar o conversation handler à aplicação
     application.add_handler(study_conv_handler)
     application.add_handler(sleep_conv_handler)
+    application.add_handler(import_conv_handler)
+
+    # Latência e erros por handler, e métricas dos serviços
+    for handlers in application.handlers.values():
+        instrument_handlers(handlers)
+    bind_metrics(application)
 
     # Configurar os comandos do menu
-    application.post_init = set_commands
+    application.post_init = post_init
+    application.post_shutdown = post_shutdown
 
-    # Iniciar o bot
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    return application
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,319 @@
+"""
+Métricas do bot no formato de exposição de texto do Prometheus.
+
+Contadores, gauges e histogramas simples, registrados em REGISTRY e servidos
+em /metrics por um servidor HTTP mínimo que roda no próprio event loop. Cada
+observação custa uma busca em dicionário e algumas somas sob uma trava, de
+forma que a coleta pode ficar sempre ligada.
+"""
+import time
+import asyncio
+import logging
+import threading
+from bisect import bisect_left
+from functools import wraps
+
+from telegram.ext import ConversationHandler
+
+logger = logging.getLogger(__name__)
+
+# Limites dos histogramas de latência, em segundos
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+LAG_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 300)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values):
+        """Retorna a série com os valores de rótulo dados, criando-a no primeiro uso."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        """Retorna as linhas (sufixo, rótulos, valor) de todas as séries."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for suffix, labels, value in self._samples():
+            lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class _Value:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _SimpleMetric(_Metric):
+    """
+    Métrica de um valor por série. Com `callback`, os valores são lidos na
+    hora da coleta, de contadores que o próprio serviço já mantém: a função
+    retorna um número ou um dicionário {valores dos rótulos: número}.
+    """
+
+    suffix = ''
+
+    def __init__(self, name, documentation, labelnames=(), callback=None, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.callback = callback
+
+    def _new_child(self):
+        return _Value()
+
+    def _samples(self):
+        if self.callback is None:
+            series = {values: child.value for values, child in list(self._children.items())}
+        else:
+            try:
+                series = self.callback()
+            except Exception:
+                logger.exception("Falha ao coletar a métrica %s", self.name)
+                return
+            if not isinstance(series, dict):
+                series = {(): series}
+        for values, value in series.items():
+            yield self.suffix, _format_labels(self.labelnames, values), value
+
+
+class Counter(_SimpleMetric):
+    """Contador que só cresce (por exemplo, erros)."""
+
+    type_name = 'counter'
+    suffix = '_total'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_SimpleMetric):
+    """Valor que sobe e desce (por exemplo, profundidade de uma fila)."""
+
+    type_name = 'gauge'
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(_Metric):
+    """Distribuição de valores (latências) em faixas cumulativas."""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts = list(child.counts)
+                total, count = child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield '_bucket', _format_labels(self.labelnames, values, f'le="{_format_value(float(bound))}"'), cumulative
+            yield '_sum', _format_labels(self.labelnames, values), total
+            yield '_count', _format_labels(self.labelnames, values), count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Métrica duplicada: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """Gera o texto de exposição de todas as métricas registradas."""
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = Histogram(
+    'lux_handler_latency_seconds', 'Tempo de execução dos handlers.', ['handler']
+)
+HANDLER_ERRORS = Counter(
+    'lux_handler_errors', 'Exceções levantadas pelos handlers.', ['handler', 'exception']
+)
+DB_QUERY_LATENCY = Histogram(
+    'lux_db_query_seconds', 'Tempo de execução das funções de banco, por função.',
+    ['operation', 'function'], buckets=QUERY_BUCKETS
+)
+UPDATE_LAG = Histogram(
+    'lux_update_lag_seconds',
+    'Tempo entre o envio da mensagem pelo usuário e o início do processamento (resolução de 1s).',
+    buckets=LAG_BUCKETS
+)
+UPDATE_ORDERING_WAIT = Histogram(
+    'lux_update_ordering_wait_seconds',
+    'Espera de um update pelos updates anteriores do mesmo usuário.'
+)
+
+SEND_THROTTLE_DELAY = Histogram(
+    'lux_send_throttle_delay_seconds', 'Espera imposta aos envios pelos limites de flood.', ['priority']
+)
+
+# Valores lidos dos serviços na coleta (callbacks ligados por main.bind_metrics)
+WRITE_QUEUE_DEPTH = Gauge('lux_write_queue_depth', 'Linhas aguardando gravação na fila de escrita.')
+WRITE_ROWS = Counter('lux_write_rows', 'Linhas gravadas pela fila de escrita.')
+WRITE_FLUSHES = Counter('lux_write_flushes', 'Lotes gravados pela fila de escrita.')
+WRITE_FLUSH_ERRORS = Counter('lux_write_flush_errors', 'Lotes da fila de escrita que falharam.')
+CACHE_LOOKUPS = Counter('lux_cache_lookups', 'Consultas ao cache de leitura.', ['result'])
+CACHE_USERS = Gauge('lux_cache_users', 'Usuários no cache de leitura.')
+SEND_QUEUE_DEPTH = Gauge('lux_send_queue_depth', 'Envios aguardando na fila de envio.', ['priority'])
+SEND_RETRY_AFTER = Counter('lux_send_retry_after', 'Envios recusados pelo Telegram com RetryAfter.')
+SEND_COALESCED_EDITS = Counter('lux_send_coalesced_edits', 'Edições agrupadas a uma edição pendente.')
+ACTIVE_CONVERSATIONS = Gauge(
+    'lux_active_conversations', 'Conversas em andamento, por ConversationHandler e estado.',
+    ['conversation', 'state']
+)
+ACTIVE_USERS = Gauge('lux_active_update_users', 'Usuários com updates aguardando ou em processamento.')
+ACTIVE_TIMERS = Gauge('lux_active_timers', 'Cronômetros em andamento, por tipo.', ['kind'])
+TIMER_REMINDER_QUEUE = Gauge('lux_timer_reminder_queue', 'Entradas no heap de lembretes dos cronômetros.')
+TIMER_REMINDERS = Counter('lux_timer_reminders', 'Lembretes Pomodoro enviados.')
+
+BACKUP_LAST_SUCCESS = Gauge(
+    'lux_backup_last_success_timestamp_seconds', 'Horário (Unix) da última cópia de segurança concluída.'
+)
+BACKUP_DURATION = Gauge('lux_backup_duration_seconds', 'Duração da última cópia de segurança.')
+BACKUP_FAILURES = Counter('lux_backup_failures', 'Cópias de segurança que falharam.')
+
+
+def timed(name, fn):
+    """Envolve um callback de handler para medir a latência e contar os erros."""
+    latency = HANDLER_LATENCY.labels(name)
+
+    @wraps(fn)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await fn(update, context)
+        except Exception as error:
+            HANDLER_ERRORS.labels(name, type(error).__name__).inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+def instrument_handlers(handlers):
+    """
+    Instrumenta os callbacks de uma lista de handlers, incluindo os pontos de
+    entrada, estados e fallbacks de cada ConversationHandler. O rótulo de
+    cada série é o nome da função do callback.
+    """
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        elif not hasattr(handler.callback, '__wrapped__'):
+            handler.callback = timed(handler.callback.__name__, handler.callback)
+
+
+async def _serve(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # Descarta os cabeçalhos da requisição
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, content_type = '200 OK', 'text/plain; version=0.0.4; charset=utf-8'
+            body = REGISTRY.render().encode('utf-8')
+        else:
+            status, content_type, body = '404 Not Found', 'text/plain; charset=utf-8', b'Not Found\n'
+        writer.write(
+            f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(port, host='127.0.0.1'):
+    """Inicia o servidor HTTP de /metrics no event loop atual."""
+    server = await asyncio.start_server(_serve, host, port)
+    logger.info("Métricas em http://%s:%d/metrics", host, port)
+    return server
@@ -0,0 +1,463 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _add_user_date_indexes(conn):
+    # Listagens: WHERE user_id = ? ORDER BY date DESC (o id desempata)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_study_periods_user_date
+        ON study_periods (user_id, date, id)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sleep_periods_user_date
+        ON sleep_periods (user_id, date, id)
+    ''')
+    # Disciplinas anteriores: o GROUP BY discipline é resolvido só pelo índice
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_study_periods_user_discipline
+        ON study_periods (user_id, discipline)
+    ''')
+
+
+def _create_daily_stats(conn):
+    # Rollups diários mantidos a cada inserção (ver database.save_*_schedules)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            discipline TEXT NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            minutes INTEGER NOT NULL DEFAULT 0,
+            performance_sum INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, date, discipline)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_sleep_stats (
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            quality TEXT NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            minutes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, date, quality)
+        ) WITHOUT ROWID
+    ''')
+    # Preenche os rollups com o histórico já existente
+    conn.execute('''
+        INSERT INTO daily_stats (user_id, date, discipline, sessions, minutes, performance_sum)
+        SELECT user_id, date, discipline, COUNT(*),
+               SUM(duration_hours * 60 + duration_minutes), SUM(performance)
+        FROM study_periods
+        GROUP BY user_id, date, discipline
+    ''')
+    conn.execute('''
+        INSERT INTO daily_sleep_stats (user_id, date, quality, sessions, minutes)
+        SELECT user_id, date, quality, COUNT(*),
+               SUM(duration_hours * 60 + duration_minutes)
+        FROM sleep_periods
+        GROUP BY user_id, date, quality
+    ''')
+
+
+def _create_chart_cache(conn):
+    # Versão dos dados de cada usuário, incrementada a cada inserção
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # file_id do Telegram dos gráficos já enviados
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chart_files (
+            user_id INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            first_day INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            file_id TEXT NOT NULL,
+            PRIMARY KEY (user_id, period)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _create_persistence_tables(conn):
+    # Estado das conversas em andamento e user_data, por usuário
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS conversations (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (name, key)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_data (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL
+        )
+    ''')
+
+
+# Minutos desde a meia-noite de um horário 'H:MM' ou 'HH:MM' (legado, TEXT)
+def _clock_sql(column):
+    return (
+        f"(CAST(substr({column}, 1, instr({column}, ':') - 1) AS INTEGER) * 60"
+        f" + CAST(substr({column}, instr({column}, ':') + 1) AS INTEGER))"
+    )
+
+
+def _compact_periods(conn):
+    # Períodos em inteiros: dia desde 1970-01-01, início e término em minutos
+    # desde a época e uma única coluna de duração. Períodos cujo término é
+    # anterior ao início atravessam a meia-noite e terminam no dia seguinte.
+    day = "CAST(julianday(date) - 2440587.5 AS INTEGER)"
+    start = f"({day} * 1440 + {_clock_sql('start_time')})"
+    end = (
+        f"({day} * 1440 + {_clock_sql('end_time')}"
+        f" + CASE WHEN {_clock_sql('end_time')} < {_clock_sql('start_time')} THEN 1440 ELSE 0 END)"
+    )
+    conn.execute('''
+        CREATE TABLE study_periods_compact (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            user_name TEXT,
+            day INTEGER,
+            start_minute INTEGER,
+            end_minute INTEGER,
+            duration INTEGER,
+            discipline TEXT,
+            performance INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute(f'''
+        INSERT INTO study_periods_compact
+        (id, user_id, user_name, day, start_minute, end_minute, duration, discipline, performance, created_at)
+        SELECT id, user_id, user_name, {day}, {start}, {end}, {end} - {start}, discipline, performance, created_at
+        FROM study_periods
+    ''')
+    conn.execute('''
+        CREATE TABLE sleep_periods_compact (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            user_name TEXT,
+            day INTEGER,
+            start_minute INTEGER,
+            end_minute INTEGER,
+            duration INTEGER,
+            quality TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute(f'''
+        INSERT INTO sleep_periods_compact
+        (id, user_id, user_name, day, start_minute, end_minute, duration, quality, created_at)
+        SELECT id, user_id, user_name, {day}, {start}, {end}, {end} - {start}, quality, created_at
+        FROM sleep_periods
+    ''')
+    conn.execute('DROP TABLE study_periods')
+    conn.execute('DROP TABLE sleep_periods')
+    conn.execute('ALTER TABLE study_periods_compact RENAME TO study_periods')
+    conn.execute('ALTER TABLE sleep_periods_compact RENAME TO sleep_periods')
+    conn.execute('''
+        CREATE INDEX idx_study_periods_user_day ON study_periods (user_id, day, id)
+    ''')
+    conn.execute('''
+        CREATE INDEX idx_sleep_periods_user_day ON sleep_periods (user_id, day, id)
+    ''')
+    conn.execute('''
+        CREATE INDEX idx_study_periods_user_discipline ON study_periods (user_id, discipline)
+    ''')
+
+    # Rollups diários também indexados pelo número do dia, recalculados
+    # a partir das durações corrigidas
+    conn.execute('DROP TABLE daily_stats')
+    conn.execute('DROP TABLE daily_sleep_stats')
+    conn.execute('''
+        CREATE TABLE daily_stats (
+            user_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            discipline TEXT NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            minutes INTEGER NOT NULL DEFAULT 0,
+            performance_sum INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, discipline)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE daily_sleep_stats (
+            user_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            quality TEXT NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            minutes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, quality)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT INTO daily_stats (user_id, day, discipline, sessions, minutes, performance_sum)
+        SELECT user_id, day, discipline, COUNT(*), SUM(duration), SUM(performance)
+        FROM study_periods
+        GROUP BY user_id, day, discipline
+    ''')
+    conn.execute('''
+        INSERT INTO daily_sleep_stats (user_id, day, quality, sessions, minutes)
+        SELECT user_id, day, quality, COUNT(*), SUM(duration)
+        FROM sleep_periods
+        GROUP BY user_id, day, quality
+    ''')
+
+
+def _create_leaderboards(conn):
+    # Horas estudadas por usuário e semana, atualizadas em segundo plano a
+    # partir dos estudos com id acima da marca d'água (database.refresh_leaderboards)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard_weekly (
+            week INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            user_name TEXT,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            minutes INTEGER NOT NULL DEFAULT 0,
+            performance_sum INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (week, user_id)
+        ) WITHOUT ROWID
+    ''')
+    # Ranking da semana: WHERE week = ? ORDER BY minutes DESC, user_id
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_leaderboard_weekly_week_minutes
+        ON leaderboard_weekly (week, minutes DESC)
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard_state (
+            name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO leaderboard_state (name, last_id) VALUES ('weekly', 0)")
+    # Usuários vistos em cada grupo, para o ranking do grupo
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS group_members (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _create_weekly_reports(conn):
+    # Usuários que pediram o relatório semanal
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS report_subscriptions (
+            user_id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Uma execução por semana, com o prazo para terminar os envios
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS report_runs (
+            week INTEGER PRIMARY KEY,
+            deadline REAL NOT NULL,
+            started_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            finished_at TEXT
+        )
+    ''')
+    # Situação do envio de cada usuário na execução: o que permite retomar
+    # uma execução interrompida sem repetir nem pular ninguém
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS report_deliveries (
+            week INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (week, user_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_report_deliveries_pending
+        ON report_deliveries (week, user_id) WHERE status = 'pending'
+    ''')
+
+
+def _create_monthly_stats(conn):
+    # Resumos mensais dos períodos arquivados (database.archive_periods).
+    # `month` é o número do primeiro dia do mês, como em periods.month_start
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_stats (
+            user_id INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            discipline TEXT NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            minutes INTEGER NOT NULL DEFAULT 0,
+            performance_sum INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, month, discipline)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_sleep_stats (
+            user_id INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            quality TEXT NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            minutes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, month, quality)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _normalize_disciplines(conn):
+    # Dicionário de disciplinas por usuário. Os ids são sequenciais dentro de
+    # cada usuário, de forma que as linhas são copiadas entre shards sem
+    # renumeração; períodos e rollups passam a guardar só o id
+    conn.execute('''
+        CREATE TABLE disciplines (
+            user_id INTEGER NOT NULL,
+            id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (user_id, id),
+            UNIQUE (user_id, name)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT INTO disciplines (user_id, id, name)
+        SELECT user_id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY name), name FROM (
+            SELECT user_id, COALESCE(discipline, '') AS name FROM study_periods
+            UNION
+            SELECT user_id, discipline FROM daily_stats
+            UNION
+            SELECT user_id, discipline FROM monthly_stats
+        )
+        WHERE user_id IS NOT NULL
+    ''')
+
+    # A recriação perderia o contador do AUTOINCREMENT, que pode estar acima
+    # do maior id restante (períodos arquivados); as marcas d'água dos
+    # leaderboards e do arquivamento dependem de ids nunca reutilizados
+    sequence = conn.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'study_periods'"
+    ).fetchone()
+    conn.execute('''
+        CREATE TABLE study_periods_normalized (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            user_name TEXT,
+            day INTEGER,
+            start_minute INTEGER,
+            end_minute INTEGER,
+            duration INTEGER,
+            discipline_id INTEGER,
+            performance INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO study_periods_normalized
+        (id, user_id, user_name, day, start_minute, end_minute, duration, discipline_id, performance, created_at)
+        SELECT p.id, p.user_id, p.user_name, p.day, p.start_minute, p.end_minute, p.duration, d.id,
+               p.performance, p.created_at
+        FROM study_periods p
+        LEFT JOIN disciplines d ON d.user_id = p.user_id AND d.name = COALESCE(p.discipline, '')
+    ''')
+    conn.execute('DROP TABLE study_periods')
+    conn.execute('ALTER TABLE study_periods_normalized RENAME TO study_periods')
+    if sequence is not None:
+        conn.execute(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'study_periods'", sequence
+        )
+    conn.execute('CREATE INDEX idx_study_periods_user_day ON study_periods (user_id, day, id)')
+    conn.execute(
+        'CREATE INDEX idx_study_periods_user_discipline ON study_periods (user_id, discipline_id)'
+    )
+
+    for table, period in (('daily_stats', 'day'), ('monthly_stats', 'month')):
+        conn.execute(f'''
+            CREATE TABLE {table}_normalized (
+                user_id INTEGER NOT NULL,
+                {period} INTEGER NOT NULL,
+                discipline_id INTEGER NOT NULL,
+                sessions INTEGER NOT NULL DEFAULT 0,
+                minutes INTEGER NOT NULL DEFAULT 0,
+                performance_sum INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, {period}, discipline_id)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute(f'''
+            INSERT INTO {table}_normalized
+            (user_id, {period}, discipline_id, sessions, minutes, performance_sum)
+            SELECT s.user_id, s.{period}, d.id, s.sessions, s.minutes, s.performance_sum
+            FROM {table} s
+            JOIN disciplines d ON d.user_id = s.user_id AND d.name = s.discipline
+        ''')
+        conn.execute(f'DROP TABLE {table}')
+        conn.execute(f'ALTER TABLE {table}_normalized RENAME TO {table}')
+
+
+def _create_active_timers(conn):
+    # Cronômetros em andamento (timers.TimerRegistry). Horários em
+    # timestamps Unix; stopped_at é preenchido pelo /parar enquanto o bot
+    # aguarda a performance ou a qualidade
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS active_timers (
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            user_name TEXT,
+            started_at INTEGER NOT NULL,
+            stopped_at INTEGER,
+            discipline TEXT,
+            reminder_minutes INTEGER,
+            PRIMARY KEY (user_id, kind)
+        ) WITHOUT ROWID
+    ''')
+
+
+# Lista ordenada de migrações: (versão, descrição, função)
+# Novas migrações devem ser sempre adicionadas ao final, com a próxima versão.
+MIGRATIONS = [
+    (1, 'índices por (user_id, date) e (user_id, discipline)', _add_user_date_indexes),
+    (2, 'rollups diários de estudo e sono', _create_daily_stats),
+    (3, 'versões de dados por usuário e cache de gráficos', _create_chart_cache),
+    (4, 'persistência de conversas e user_data', _create_persistence_tables),
+    (5, 'períodos e rollups em formato numérico compacto', _compact_periods),
+    (6, 'leaderboards semanais e membros de grupos', _create_leaderboards),
+    (7, 'assinaturas e entregas do relatório semanal', _create_weekly_reports),
+    (8, 'resumos mensais dos períodos arquivados', _create_monthly_stats),
+    (9, 'dicionário de disciplinas por usuário', _normalize_disciplines),
+    (10, 'cronômetros de estudo e sono em andamento', _create_active_timers),
+]
+
+
+def get_schema_version(conn):
+    """Retorna a versão do esquema gravada no banco (PRAGMA user_version)."""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Aplica, em ordem, as migrações ainda não aplicadas ao banco.
+
+    Cada migração roda em sua própria transação junto com a atualização do
+    `user_version`, de forma que um banco nunca fica em uma versão parcial.
+
+    Returns:
+        int: Versão do esquema após as migrações
+    """
+    if conn.in_transaction:
+        conn.commit()
+
+    current = get_schema_version(conn)
+    for version, description, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info("Aplicando migração %d: %s", version, description)
+        conn.execute('BEGIN')
+        try:
+            apply(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        current = version
+    return current
@@ -0,0 +1,140 @@
+"""
+Conversões entre o formato exibido ao usuário (datas YYYY-MM-DD e horários
+HH:MM) e o formato numérico gravado no banco.
+
+No banco, um dia é o número de dias desde 1970-01-01 e um instante é o
+número de minutos desde 1970-01-01 00:00. Os horários são os informados pelo
+usuário, sem conversão de fuso.
+"""
+import re
+import calendar
+from datetime import date, datetime, timedelta
+
+MINUTES_PER_DAY = 24 * 60
+EPOCH = date(1970, 1, 1)
+
+# Horário HH:MM (a hora pode ter um dígito), para compor outras expressões
+CLOCK = r'(?:[0-1]?[0-9]|2[0-3]):[0-5][0-9]'
+# Horário aceito nas conversas e na importação
+CLOCK_PATTERN = re.compile(f'^{CLOCK}$')
+# Data dos registros rápidos (/estudo, /sono)
+ENTRY_DATE = r'hoje|ontem|anteontem|\d{1,2}/\d{1,2}(?:/\d{4})?|\d{4}-\d{2}-\d{2}'
+RELATIVE_DAYS = {'hoje': 0, 'ontem': 1, 'anteontem': 2}
+
+
+def to_day(date_text):
+    """Converte uma data YYYY-MM-DD no número do dia."""
+    return (datetime.strptime(date_text, '%Y-%m-%d').date() - EPOCH).days
+
+
+def today():
+    """Retorna o número do dia de hoje."""
+    return (date.today() - EPOCH).days
+
+
+def day_to_date(day):
+    """Converte o número do dia na data YYYY-MM-DD."""
+    return (EPOCH + timedelta(days=day)).isoformat()
+
+
+def week_of(day):
+    """Retorna o número da semana (de segunda a domingo) do dia."""
+    # 1970-01-01 foi uma quinta-feira
+    return (day + 3) // 7
+
+
+def week_start(week):
+    """Retorna o número do dia da segunda-feira da semana."""
+    return week * 7 - 3
+
+
+def month_start(day):
+    """Retorna o número do dia do primeiro dia do mês do dia."""
+    first = (EPOCH + timedelta(days=day)).replace(day=1)
+    return (first - EPOCH).days
+
+
+def month_length(month):
+    """Retorna a quantidade de dias do mês que começa no dia `month`."""
+    first = EPOCH + timedelta(days=month)
+    return calendar.monthrange(first.year, first.month)[1]
+
+
+def clock_minutes(clock_text):
+    """Converte um horário HH:MM em minutos desde a meia-noite."""
+    hours, minutes = clock_text.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def format_clock(epoch_minutes):
+    """Formata um instante (minutos desde a época) como HH:MM."""
+    hours, minutes = divmod(epoch_minutes % MINUTES_PER_DAY, 60)
+    return f"{hours:02d}:{minutes:02d}"
+
+
+def period_minutes(date_text, start_text, end_text):
+    """
+    Calcula o período informado pelo usuário no formato do banco.
+
+    O período começa na data escolhida; se o término for anterior ao início
+    (por exemplo, sono das 23:00 às 07:00), ele termina no dia seguinte.
+
+    Returns:
+        tuple: (dia, início, término, duração em minutos)
+    """
+    day = to_day(date_text)
+    start = day * MINUTES_PER_DAY + clock_minutes(start_text)
+    end = day * MINUTES_PER_DAY + clock_minutes(end_text)
+    if end < start:
+        end += MINUTES_PER_DAY
+    return day, start, end, end - start
+
+
+def local_minutes(timestamp):
+    """Converte um timestamp Unix no instante (minutos desde a época) do horário local."""
+    moment = datetime.fromtimestamp(timestamp)
+    return (moment.date() - EPOCH).days * MINUTES_PER_DAY + moment.hour * 60 + moment.minute
+
+
+def entry_date(date_text, reference=None):
+    """
+    Converte a data de um registro rápido (ENTRY_DATE) em YYYY-MM-DD.
+
+    Uma data DD/MM sem ano é a sua última ocorrência até `reference`
+    (padrão: hoje), de forma que 31/12 informado em janeiro é do ano passado.
+
+    Raises:
+        ValueError: Se a data não existe
+    """
+    reference = reference or date.today()
+    text = date_text.lower()
+    if text in RELATIVE_DAYS:
+        return (reference - timedelta(days=RELATIVE_DAYS[text])).isoformat()
+    if '-' in text:
+        return datetime.strptime(text, '%Y-%m-%d').date().isoformat()
+    day, month, *year = (int(part) for part in text.split('/'))
+    if year:
+        return date(year[0], month, day).isoformat()
+    # Volta ano a ano até a data existir e não ser posterior a `reference`
+    # (29/02 só existe nos anos bissextos)
+    for year in range(reference.year, reference.year - 8, -1):
+        try:
+            value = date(year, month, day)
+        except ValueError:
+            continue
+        if value <= reference:
+            return value.isoformat()
+    raise ValueError(f"data inexistente: {date_text}")
+
+
+def latest_start_date(start_text, end_text, now=None):
+    """
+    Data de início do período HH:MM-HH:MM mais recente que já terminou até
+    `now` (padrão: agora): hoje ou, se ainda não terminou hoje, ontem.
+    """
+    now = now or datetime.now()
+    current = now.date()
+    _, _, end, _ = period_minutes(current.isoformat(), start_text, end_text)
+    if end > (current - EPOCH).days * MINUTES_PER_DAY + now.hour * 60 + now.minute:
+        current -= timedelta(days=1)
+    return current.isoformat()
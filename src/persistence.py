@@ -0,0 +1,139 @@
+import asyncio
+import logging
+from collections import Counter
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database import get_conversations, get_user_data, save_persistence
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Persistência dos estados de conversa e do user_data em tabelas SQLite.
+
+    A aplicação só entrega a esta classe os usuários e conversas que mudaram
+    desde a última rodada. As alterações de uma rodada são acumuladas e
+    gravadas juntas em uma única transação, em vez de regravar tudo a cada
+    flush.
+
+    Os estados das conversas em andamento também ficam em memória, para as
+    métricas (`conversation_counts`); eles refletem a última rodada de
+    persistência, não o instante exato.
+
+    O user_data é carregado sob demanda, no primeiro update de cada usuário
+    (via `refresh_user_data`), de forma que reiniciar o bot não carrega na
+    memória os dados de usuários inativos. Os estados de conversa são
+    carregados na inicialização, pois só existem para conversas em andamento.
+    """
+
+    def __init__(self, db, update_interval=10):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.db = db
+        self._loaded_users = set()
+        self._pending_users = {}
+        self._pending_conversations = {}
+        self._write_task = None
+        self._conversation_states = {}
+
+    async def get_user_data(self):
+        # Carregado sob demanda em refresh_user_data
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        conversations = await self.db.read(get_conversations, name)
+        for key, state in conversations.items():
+            self._conversation_states[(name, key)] = state
+        return conversations
+
+    def conversation_counts(self):
+        """Retorna {(nome da conversa, estado): quantidade de conversas}."""
+        return Counter((name, state) for (name, _), state in self._conversation_states.items())
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded_users:
+            return
+        self._loaded_users.add(user_id)
+        stored = await self.db.read(get_user_data, user_id)
+        # Dados gravados no meio tempo não devem ser sobrescritos
+        for key, value in stored.items():
+            user_data.setdefault(key, value)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def update_user_data(self, user_id, data):
+        self._pending_users[user_id] = data
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id):
+        self._pending_users[user_id] = None
+        self._schedule_write()
+
+    async def update_conversation(self, name, key, new_state):
+        self._pending_conversations[(name, key)] = new_state
+        if new_state is None:
+            self._conversation_states.pop((name, key), None)
+        else:
+            self._conversation_states[(name, key)] = new_state
+        self._schedule_write()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    def _schedule_write(self):
+        # Todas as atualizações de uma rodada chegam juntas (asyncio.gather);
+        # uma única tarefa as grava depois que todas foram registradas.
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        await asyncio.sleep(0)
+        self._write_task = None
+        users, self._pending_users = self._pending_users, {}
+        conversations, self._pending_conversations = self._pending_conversations, {}
+        if not users and not conversations:
+            return
+        try:
+            await self.db.write(save_persistence, users, conversations)
+        except Exception:
+            logger.exception("Falha ao gravar a persistência; nova tentativa na próxima rodada")
+            # Devolve as alterações à fila sem sobrescrever as mais recentes
+            for user_id, data in users.items():
+                self._pending_users.setdefault(user_id, data)
+            for key, state in conversations.items():
+                self._pending_conversations.setdefault(key, state)
+            return
+        logger.debug(
+            "Persistência gravada: %d usuários e %d conversas", len(users), len(conversations)
+        )
+
+    async def flush(self):
+        if self._write_task is not None:
+            await self._write_task
+        await self._write_pending()
@@ -0,0 +1,162 @@
+"""
+Profiler por amostragem do processo do bot, acionado pelo comando /perf.
+
+Uma thread separada lê periodicamente as pilhas de todas as threads
+(sys._current_frames) e conta cada pilha no formato "collapsed stacks"
+(uma linha por pilha, quadros separados por ';' e a contagem no final),
+aceito por flamegraph.pl, speedscope e similares. O custo recai na thread
+de amostragem: as demais threads não são instrumentadas.
+
+Amostras da thread do event loop cuja pilha passa por um callback de
+handler são atribuídas a esse handler; as das threads de banco, à thread.
+"""
+import os
+import sys
+import time
+import inspect
+import threading
+from collections import Counter
+
+from telegram.ext import ConversationHandler
+
+# Quadros do topo da pilha que indicam uma thread parada esperando trabalho
+IDLE_FRAMES = {
+    ('selectors.py', 'select'),
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('thread.py', '_worker'),
+    ('queue.py', 'get'),
+}
+
+# Limite de profundidade das pilhas gravadas
+MAX_DEPTH = 128
+
+
+def handler_codes(handlers, codes=None):
+    """
+    Mapeia o código de cada callback de handler (sem os wrappers de métricas)
+    ao nome do callback, incluindo os estados dos ConversationHandlers.
+    """
+    codes = {} if codes is None else codes
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            handler_codes(handler.entry_points, codes)
+            for state_handlers in handler.states.values():
+                handler_codes(state_handlers, codes)
+            handler_codes(handler.fallbacks, codes)
+        else:
+            callback = inspect.unwrap(handler.callback)
+            code = getattr(callback, '__code__', None)
+            if code is not None:
+                codes[code] = callback.__name__
+    return codes
+
+
+def _frame_label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """
+    Amostra as pilhas de todas as threads a cada `interval` segundos.
+
+    Args:
+        handlers (dict): Código do callback -> nome do handler, como
+            retornado por `handler_codes`
+    """
+
+    def __init__(self, handlers, interval=0.005):
+        self.handlers = handlers
+        self.interval = interval
+        self.stacks = Counter()
+        self.own = Counter()
+        self.total = Counter()
+        self.samples = 0
+        self.idle = 0
+        self.started = None
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='lux-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Interrompe a amostragem e aguarda a thread terminar."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.elapsed = time.monotonic() - self.started
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own_ident:
+                    self._sample(names.get(ident, str(ident)), frame)
+
+    def _sample(self, thread_name, frame):
+        top = frame.f_code
+        if (os.path.basename(top.co_filename), top.co_name) in IDLE_FRAMES:
+            self.idle += 1
+            return
+
+        codes = []
+        while frame is not None and len(codes) < MAX_DEPTH:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+
+        owner = thread_name
+        for code in codes:
+            handler = self.handlers.get(code)
+            if handler is not None:
+                owner = handler
+                break
+
+        labels = [_frame_label(code) for code in codes]
+        self.samples += 1
+        self.stacks[';'.join([thread_name, *labels])] += 1
+        self.own[(owner, labels[-1])] += 1
+        # Recursão conta uma vez só no tempo total da função
+        for label in set(labels):
+            self.total[(owner, label)] += 1
+
+    def collapsed(self):
+        """Retorna as pilhas no formato collapsed stacks."""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def report(self, top=15):
+        """Resumo em texto com as funções mais quentes e o handler de cada uma."""
+        lines = [
+            f"Amostras: {self.samples} ativas, {self.idle} ociosas "
+            f"em {self.elapsed:.1f}s (intervalo {self.interval * 1000:.0f}ms)"
+        ]
+        if not self.samples:
+            return lines[0]
+
+        by_handler = Counter()
+        for (owner, _), count in self.own.items():
+            by_handler[owner] += count
+        lines.append("")
+        lines.append("Por handler/thread:")
+        for owner, count in by_handler.most_common(top):
+            lines.append(f"{count / self.samples:6.1%}  {owner}")
+
+        lines.append("")
+        lines.append("Funções (própria / total):")
+        for (owner, label), count in self.own.most_common(top):
+            total = self.total[(owner, label)]
+            lines.append(
+                f"{count / self.samples:6.1%} {total / self.samples:6.1%}  {label}  [{owner}]"
+            )
+        return '\n'.join(lines)
@@ -0,0 +1,309 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from itertools import islice
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import SEND_THROTTLE_DELAY
+
+logger = logging.getLogger(__name__)
+
+# Prioridades de envio, passadas via `rate_limit_args` nos métodos do bot.
+# Respostas diretas ao usuário são INTERACTIVE (o padrão); relatórios e
+# envios em massa devem usar BULK.
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = ('interactive', 'bulk')
+
+# Quantos pedidos de cada fila são examinados por rodada do escalonador
+SCAN_LIMIT = 64
+# Intervalo, em segundos, entre as limpezas dos baldes ociosos dos chats
+PRUNE_INTERVAL = 60
+
+
+class TokenBucket:
+    """Balde de fichas: `rate` fichas por segundo, acumulando até `capacity`."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'paused_until')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now, reserve=0.0):
+        """Segundos até haver uma ficha disponível além de `reserve` (0 se já há)."""
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        missing = 1 + reserve - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, until):
+        """Bloqueia o balde até `until`, após um RetryAfter do Telegram."""
+        self.paused_until = max(self.paused_until, until)
+        self.tokens = 0
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+
+class _Request:
+    __slots__ = ('chat_id', 'priority', 'data', 'edit_key', 'granted', 'enqueued', 'followers')
+
+    def __init__(self, chat_id, priority, data, edit_key):
+        self.chat_id = chat_id
+        self.priority = priority
+        self.data = data
+        self.edit_key = edit_key
+        self.granted = None
+        self.enqueued = 0.0
+        self.followers = []
+
+
+class FloodRateLimiter(BaseRateLimiter):
+    """
+    Escalonador central dos envios do bot, respeitando os limites de flood
+    do Telegram.
+
+    Todo pedido com `chat_id` (sendMessage, editMessageText, sendPhoto...)
+    consome uma ficha do balde global e uma do balde do chat. Pedidos sem
+    ficha disponível esperam em filas por prioridade: um escalonador libera
+    primeiro os interativos e só libera os de BULK enquanto sobrar no balde
+    global a reserva `bulk_reserve`, de forma que relatórios em massa nunca
+    atrasam as respostas aos usuários.
+
+    Edições da mesma mensagem que ainda esperam na fila são agrupadas: a
+    edição pendente passa a enviar o conteúdo mais recente e todas recebem o
+    mesmo resultado. Em caso de RetryAfter, o chat é pausado pelo tempo
+    pedido (com um acréscimo exponencial a cada nova tentativa) e o pedido
+    volta à fila, até `max_retries` vezes.
+
+    Métodos sem `chat_id` (answerCallbackQuery, getMe, setMyCommands...) não
+    passam pelos baldes.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1, group_rate=20 / 60, burst=3,
+                 bulk_reserve=0.2, max_retries=3, backoff=0.5):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._bulk_reserve = global_rate * bulk_reserve
+        self._global = TokenBucket(global_rate, global_rate, time.monotonic())
+        self._chats = {}
+        self._last_prune = time.monotonic()
+        self._queues = (deque(), deque())
+        self._pending_edits = {}
+        self._wakeup = asyncio.Event()
+        self._scheduler = None
+
+        # Estatísticas
+        self.requests = 0
+        self.throttled = 0
+        self.throttle_delay_total = 0.0
+        self.max_throttle_delay = 0.0
+        self.last_throttle_delay = 0.0
+        self.retry_after = 0
+        self.coalesced_edits = 0
+        self.failed = 0
+
+    def stats(self):
+        """Retorna a profundidade das filas, os atrasos impostos e as novas tentativas."""
+        return {
+            'queue_depth': {name: len(queue) for name, queue in zip(PRIORITY_NAMES, self._queues)},
+            'requests': self.requests,
+            'throttled': self.throttled,
+            'last_throttle_delay': self.last_throttle_delay,
+            'max_throttle_delay': self.max_throttle_delay,
+            'avg_throttle_delay': self.throttle_delay_total / self.throttled if self.throttled else 0.0,
+            'retry_after': self.retry_after,
+            'coalesced_edits': self.coalesced_edits,
+            'failed': self.failed,
+            'chats': len(self._chats),
+        }
+
+    async def initialize(self):
+        if self._scheduler is None:
+            self._scheduler = asyncio.create_task(self._run())
+
+    async def shutdown(self):
+        if self._scheduler is not None:
+            self._scheduler.cancel()
+            try:
+                await self._scheduler
+            except asyncio.CancelledError:
+                pass
+            self._scheduler = None
+        # Pedidos ainda na fila não serão mais enviados
+        for queue in self._queues:
+            while queue:
+                request = queue.popleft()
+                if not request.granted.done():
+                    request.granted.set_exception(RuntimeError("Fila de envio encerrada"))
+
+    def _bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Grupos e canais (ids negativos ou @nome) têm um limite bem menor
+            rate = self.group_rate if str(chat_id).startswith(('-', '@')) else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.burst, now)
+        return bucket
+
+    def _prune(self, now):
+        # Baldes cheios equivalem a baldes novos; descartá-los limita a memória
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.idle(now)]:
+            del self._chats[chat_id]
+        self._last_prune = now
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+
+        edit_key = None
+        if endpoint == 'editMessageText' and data.get('message_id') is not None:
+            edit_key = (chat_id, data['message_id'])
+            pending = self._pending_edits.get(edit_key)
+            if pending is not None:
+                # A edição pendente passa a enviar o conteúdo mais recente
+                pending.data.clear()
+                pending.data.update(data)
+                self.coalesced_edits += 1
+                follower = asyncio.get_running_loop().create_future()
+                pending.followers.append(follower)
+                return await follower
+
+        self.requests += 1
+        priority = BULK if rate_limit_args == BULK else INTERACTIVE
+        request = _Request(chat_id, priority, data, edit_key)
+        if edit_key is not None:
+            self._pending_edits[edit_key] = request
+
+        try:
+            attempt = 0
+            while True:
+                await self._acquire(request)
+                try:
+                    result = await callback(*args, **kwargs)
+                except RetryAfter as error:
+                    self.retry_after += 1
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = error.retry_after + self.backoff * 2 ** attempt
+                    attempt += 1
+                    logger.warning(
+                        "RetryAfter no chat %s (%s): nova tentativa em %.1fs", chat_id, endpoint, delay
+                    )
+                    self._bucket(chat_id, time.monotonic()).pause(time.monotonic() + delay)
+                    continue
+                break
+        except BaseException as error:
+            self.failed += 1
+            self._release_edit(request)
+            for follower in request.followers:
+                if not follower.done():
+                    follower.set_exception(error)
+            raise
+
+        for follower in request.followers:
+            if not follower.done():
+                follower.set_result(result)
+        return result
+
+    def _release_edit(self, request):
+        if request.edit_key is not None and self._pending_edits.get(request.edit_key) is request:
+            del self._pending_edits[request.edit_key]
+
+    def _try_take(self, request, now):
+        """Consome as fichas do pedido se ambas estiverem disponíveis; senão retorna a espera."""
+        # Feita aqui, e não no escalonador, porque o caminho rápido de
+        # `_acquire` não o acorda
+        if now - self._last_prune > PRUNE_INTERVAL:
+            self._prune(now)
+        reserve = self._bulk_reserve if request.priority == BULK else 0.0
+        wait = max(
+            self._global.wait_time(now, reserve),
+            self._bucket(request.chat_id, now).wait_time(now),
+        )
+        if wait == 0:
+            self._global.take()
+            self._chats[request.chat_id].take()
+            # A partir daqui a edição não recebe mais conteúdo novo
+            self._release_edit(request)
+        return wait
+
+    async def _acquire(self, request):
+        now = time.monotonic()
+        # Caminho rápido: ninguém de prioridade igual ou maior esperando
+        if not any(self._queues[:request.priority + 1]) and self._try_take(request, now) == 0:
+            return
+
+        request.granted = asyncio.get_running_loop().create_future()
+        request.enqueued = now
+        self._queues[request.priority].append(request)
+        self._wakeup.set()
+        await request.granted
+
+        delay = time.monotonic() - request.enqueued
+        self.throttled += 1
+        self.throttle_delay_total += delay
+        self.last_throttle_delay = delay
+        self.max_throttle_delay = max(self.max_throttle_delay, delay)
+        SEND_THROTTLE_DELAY.labels(PRIORITY_NAMES[request.priority]).observe(delay)
+
+    def _grant(self, now):
+        """
+        Libera os pedidos que já podem ser enviados, em ordem de prioridade.
+
+        Returns:
+            float: Segundos até o próximo pedido poder ser liberado, ou None
+            se as filas estiverem vazias
+        """
+        next_wait = None
+        for queue in self._queues:
+            for request in list(islice(queue, SCAN_LIMIT)):
+                if request.granted.done():
+                    queue.remove(request)
+                    continue
+                wait = self._try_take(request, now)
+                if wait == 0:
+                    queue.remove(request)
+                    request.granted.set_result(None)
+                elif next_wait is None or wait < next_wait:
+                    next_wait = wait
+            if queue and next_wait is None:
+                next_wait = 0.0
+        return next_wait
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while True:
+                now = time.monotonic()
+                wait = self._grant(now)
+                if wait is None:
+                    break
+                # Dorme até a próxima ficha ou até chegar um pedido novo
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), max(wait, 0.001))
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
@@ -0,0 +1,197 @@
+"""
+Repartição dos usuários em shards, para o modo multiprocesso (SHARDS > 1).
+
+Cada usuário pertence a um shard, escolhido pelo CRC32 do seu id; cada
+shard é um arquivo SQLite próprio, escrito por um único processo de
+trabalho. Leituras que precisam de todos os usuários (ranking global,
+estatísticas) são feitas em todos os shards com `ShardSet.gather`, e
+`rebalance` move os usuários entre arquivos quando o número de shards muda.
+"""
+import os
+import json
+import sqlite3
+import asyncio
+import logging
+import zlib
+
+from database import Database, init_database, refresh_leaderboards, reset_leaderboards
+
+logger = logging.getLogger(__name__)
+
+# Tabelas com dados por usuário: (tabela, colunas copiadas). Os períodos
+# ganham novos ids no shard de destino.
+USER_TABLES = [
+    ('disciplines', 'user_id, id, name'),
+    ('study_periods', 'user_id, user_name, day, start_minute, end_minute, duration, discipline_id, performance, created_at'),
+    ('sleep_periods', 'user_id, user_name, day, start_minute, end_minute, duration, quality, created_at'),
+    ('daily_stats', 'user_id, day, discipline_id, sessions, minutes, performance_sum'),
+    ('daily_sleep_stats', 'user_id, day, quality, sessions, minutes'),
+    ('monthly_stats', 'user_id, month, discipline_id, sessions, minutes, performance_sum'),
+    ('monthly_sleep_stats', 'user_id, month, quality, sessions, minutes'),
+    ('user_versions', 'user_id, version'),
+    ('chart_files', 'user_id, period, first_day, version, file_id'),
+    ('user_data', 'user_id, data'),
+    ('group_members', 'chat_id, user_id'),
+    ('report_subscriptions', 'user_id, chat_id, created_at'),
+    ('report_deliveries', 'week, user_id, status, updated_at'),
+    ('active_timers', 'user_id, kind, chat_id, user_name, started_at, stopped_at, discipline, reminder_minutes'),
+]
+
+
+def shard_of(user_id, shards):
+    """Retorna o shard do usuário (estável entre processos e reinícios)."""
+    if shards <= 1:
+        return 0
+    return zlib.crc32(str(user_id).encode()) % shards
+
+
+def shard_path(path, shard, shards):
+    """
+    Caminho do arquivo do shard: database.db -> database.shard0.db. Com um
+    só shard, o próprio `path`.
+    """
+    if shards <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard}{ext}"
+
+
+class ShardSet:
+    """
+    Acesso de leitura a todos os shards a partir de um processo.
+
+    O shard do próprio processo usa o `Database` da aplicação; os demais são
+    abertos com poucas threads leitoras e nunca recebem escritas. Sem
+    sharding, o conjunto tem só o banco da aplicação.
+    """
+
+    def __init__(self, own_db, paths=(), index=0, readers=2):
+        self.index = index
+        self.databases = [
+            own_db if shard == index else Database(path, readers=readers)
+            for shard, path in enumerate(paths or [own_db.path])
+        ]
+
+    def __len__(self):
+        return len(self.databases)
+
+    async def gather(self, fn, *args):
+        """Executa `fn(conn, *args)` em todos os shards em paralelo, na ordem dos shards."""
+        return await asyncio.gather(*(db.read(fn, *args) for db in self.databases))
+
+    def close(self):
+        """Fecha os shards dos outros processos (o próprio é fechado pela aplicação)."""
+        for shard, db in enumerate(self.databases):
+            if shard != self.index:
+                db.close()
+
+
+def _conversation_user(key):
+    # Chaves das conversas por usuário: [chat_id, user_id] ou [user_id]
+    return json.loads(key)[-1]
+
+
+def _users(conn):
+    """Ids de todos os usuários com algum dado no banco."""
+    selects = ' UNION '.join(f'SELECT user_id FROM {table}' for table, _ in USER_TABLES)
+    users = {row[0] for row in conn.execute(selects)}
+    users.update(_conversation_user(key) for key, in conn.execute('SELECT key FROM conversations'))
+    return users
+
+
+def _move_users(source, target_path, user_ids):
+    """
+    Copia os dados dos usuários para o shard de destino e os apaga da
+    origem, na mesma transação.
+    """
+    source.execute('ATTACH DATABASE ? AS target', (target_path,))
+    try:
+        # Fora do modo WAL o SQLite confirma as duas bases atomicamente;
+        # o Database volta ao WAL ao reabrir os arquivos
+        source.execute('PRAGMA main.journal_mode=DELETE')
+        source.execute('PRAGMA target.journal_mode=DELETE')
+        source.execute('CREATE TEMP TABLE moving (user_id INTEGER PRIMARY KEY)')
+        source.executemany('INSERT INTO moving VALUES (?)', [(user_id,) for user_id in user_ids])
+        source.execute('BEGIN')
+        for table, columns in USER_TABLES:
+            source.execute(f'''
+                INSERT OR REPLACE INTO target.{table} ({columns})
+                SELECT {columns} FROM main.{table} WHERE user_id IN (SELECT user_id FROM moving)
+            ''')
+            source.execute(f'DELETE FROM main.{table} WHERE user_id IN (SELECT user_id FROM moving)')
+
+        conversations = [
+            (name, key, state) for name, key, state in source.execute('SELECT name, key, state FROM main.conversations')
+            if _conversation_user(key) in user_ids
+        ]
+        source.executemany(
+            'INSERT OR REPLACE INTO target.conversations (name, key, state) VALUES (?, ?, ?)', conversations
+        )
+        source.executemany(
+            'DELETE FROM main.conversations WHERE name = ? AND key = ?', [row[:2] for row in conversations]
+        )
+        # Execuções do relatório semanal com entregas pendentes que mudaram de shard
+        source.execute('''
+            INSERT OR IGNORE INTO target.report_runs (week, deadline, started_at)
+            SELECT week, deadline, started_at FROM main.report_runs
+        ''')
+        source.execute('''
+            UPDATE target.report_runs SET finished_at = NULL
+            WHERE week IN (SELECT week FROM target.report_deliveries WHERE status = 'pending')
+        ''')
+        source.execute('COMMIT')
+    except Exception:
+        if source.in_transaction:
+            source.execute('ROLLBACK')
+        raise
+    finally:
+        source.execute('DROP TABLE IF EXISTS temp.moving')
+        source.execute('DETACH DATABASE target')
+
+
+def rebalance(path, old_shards, new_shards):
+    """
+    Move os usuários entre os arquivos de shard ao trocar de `old_shards`
+    para `new_shards` shards. Deve rodar com o bot parado.
+
+    Os shards de mesmo índice usam o mesmo arquivo nos dois arranjos
+    (exceto com um só shard, que usa `path`), então só são copiados os
+    usuários cujo arquivo mudou. Os leaderboards são recalculados ao final,
+    pois os períodos movidos ganham novos ids no destino.
+
+    Returns:
+        dict: (arquivo de origem, arquivo de destino) -> usuários movidos
+    """
+    old_paths = [shard_path(path, shard, old_shards) for shard in range(old_shards)]
+    new_paths = [shard_path(path, shard, new_shards) for shard in range(new_shards)]
+    # Leva todos os arquivos ao esquema atual antes de copiar
+    for shard_file in dict.fromkeys(old_paths + new_paths):
+        db = Database(shard_file, readers=1)
+        db.write_sync(init_database)
+        db.close()
+
+    moved = {}
+    for source_path in old_paths:
+        source = sqlite3.connect(source_path, isolation_level=None)
+        try:
+            destinations = {}
+            for user_id in _users(source):
+                target_path = new_paths[shard_of(user_id, new_shards)]
+                if target_path != source_path:
+                    destinations.setdefault(target_path, set()).add(user_id)
+            for target_path, user_ids in sorted(destinations.items()):
+                _move_users(source, target_path, user_ids)
+                moved[(source_path, target_path)] = len(user_ids)
+                logger.info("%s -> %s: %d usuários movidos", source_path, target_path, len(user_ids))
+        finally:
+            source.close()
+
+    for shard_file in new_paths:
+        db = Database(shard_file, readers=1)
+        db.write_sync(reset_leaderboards)
+        while db.write_sync(refresh_leaderboards):
+            pass
+        db.close()
+    for shard_file in sorted(set(old_paths) - set(new_paths)):
+        logger.info("%s não pertence mais a nenhum shard e pode ser removido", shard_file)
+    return moved
@@ -0,0 +1,151 @@
+"""
+Cronômetros de estudo e sono em andamento (/iniciar_estudo, /iniciar_sono).
+
+As sessões ativas ficam em memória, em `TimerRegistry`; cada mudança de
+estado (início, pausa no /parar, retomada) é gravada na tabela
+active_timers pela fila de escrita, e o bot recarrega as sessões ao
+iniciar. Enquanto um cronômetro corre, nada é gravado nem agendado por ele.
+
+Os lembretes Pomodoro de todas as sessões ficam em um único heap, ordenado
+pelo horário do próximo lembrete. Um só job da JobQueue é agendado para o
+lembrete mais próximo (`next_reminder`), de forma que dezenas de milhares
+de cronômetros custam uma entrada no heap cada e o bot só acorda quando há
+lembrete a enviar. Entradas de sessões encerradas, pausadas ou reiniciadas
+não são procuradas no heap (o que custaria O(n)): elas são descartadas ao
+chegar ao topo.
+"""
+import heapq
+from itertools import count
+
+
+class TimerSession:
+    """Cronômetro de um usuário. Os horários são timestamps Unix, em segundos."""
+
+    __slots__ = (
+        'user_id', 'kind', 'chat_id', 'user_name', 'started_at', 'stopped_at',
+        'discipline', 'reminder_minutes', 'next_reminder'
+    )
+
+    def __init__(self, user_id, kind, chat_id, user_name, started_at, stopped_at=None,
+                 discipline=None, reminder_minutes=None):
+        self.user_id = user_id
+        self.kind = kind
+        self.chat_id = chat_id
+        self.user_name = user_name
+        self.started_at = started_at
+        # Preenchido pelo /parar enquanto o bot aguarda a performance ou a qualidade
+        self.stopped_at = stopped_at
+        self.discipline = discipline
+        self.reminder_minutes = reminder_minutes
+        # Horário do lembrete pendente no heap (None = nenhum)
+        self.next_reminder = None
+
+    def row(self):
+        """Linha de active_timers (database.save_active_timers)."""
+        return (
+            self.user_id, self.kind, self.chat_id, self.user_name, self.started_at,
+            self.stopped_at, self.discipline, self.reminder_minutes
+        )
+
+    def elapsed_minutes(self, now):
+        """Minutos corridos até `now`, ou até o /parar se o cronômetro está parado."""
+        return int(((self.stopped_at or now) - self.started_at) // 60)
+
+
+class TimerRegistry:
+    """
+    Sessões ativas, por (user_id, tipo), e o heap dos lembretes.
+
+    Usado somente a partir do event loop, então não precisa de travas.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        # (horário do lembrete, desempate, sessão)
+        self._reminders = []
+        self._sequence = count()
+        # Lembretes devolvidos por `pop_due`
+        self.reminders_sent = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def counts(self):
+        """Quantidade de sessões ativas por tipo."""
+        counts = {}
+        for kind in (session.kind for session in self._sessions.values()):
+            counts[kind] = counts.get(kind, 0) + 1
+        return counts
+
+    @property
+    def queued_reminders(self):
+        """Entradas no heap, incluindo as de sessões já encerradas."""
+        return len(self._reminders)
+
+    def get(self, user_id, kind):
+        return self._sessions.get((user_id, kind))
+
+    def load(self, rows, now):
+        """Recarrega as sessões gravadas em active_timers (database.get_active_timers)."""
+        for row in rows:
+            self.add(TimerSession(*row), now)
+
+    def add(self, session, now):
+        """Registra a sessão, substituindo a do mesmo usuário e tipo, e agenda os lembretes."""
+        self._sessions[session.user_id, session.kind] = session
+        self._schedule(session, now)
+
+    def remove(self, session):
+        """Retira a sessão; o seu lembrete pendente é descartado ao chegar ao topo do heap."""
+        if self._sessions.get((session.user_id, session.kind)) is session:
+            del self._sessions[session.user_id, session.kind]
+        session.next_reminder = None
+
+    def pause(self, session, now):
+        """Marca o /parar: o período termina em `now` e os lembretes param."""
+        session.stopped_at = now
+        session.next_reminder = None
+
+    def resume(self, session, now):
+        """Desfaz o /parar; o cronômetro segue contando desde o início."""
+        session.stopped_at = None
+        self._schedule(session, now)
+
+    def _schedule(self, session, now):
+        if not session.reminder_minutes or session.stopped_at is not None:
+            session.next_reminder = None
+            return
+        # Lembretes a cada `reminder_minutes` desde o início; os que
+        # passaram com o bot parado não são enviados
+        interval = session.reminder_minutes * 60
+        due = session.started_at + ((now - session.started_at) // interval + 1) * interval
+        session.next_reminder = due
+        heapq.heappush(self._reminders, (due, next(self._sequence), session))
+
+    def _discard_stale(self):
+        reminders = self._reminders
+        while reminders:
+            due, _, session = reminders[0]
+            if session.next_reminder == due and self.get(session.user_id, session.kind) is session:
+                return
+            heapq.heappop(reminders)
+
+    def next_reminder(self):
+        """Horário do lembrete válido mais próximo, ou None se não há nenhum."""
+        self._discard_stale()
+        return self._reminders[0][0] if self._reminders else None
+
+    def pop_due(self, now):
+        """
+        Retira os lembretes vencidos até `now` e agenda o próximo de cada sessão.
+
+        Returns:
+            list: Sessões a lembrar
+        """
+        due_sessions = []
+        while (due := self.next_reminder()) is not None and due <= now:
+            session = heapq.heappop(self._reminders)[2]
+            due_sessions.append(session)
+            self._schedule(session, now)
+        self.reminders_sent += len(due_sessions)
+        return due_sessions
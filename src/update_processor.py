@@ -0,0 +1,88 @@
+import sys
+import time
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import UPDATE_LAG, UPDATE_ORDERING_WAIT
+
+
+def ordering_key(update):
+    """
+    Retorna a chave que define a ordem de processamento de um update.
+
+    Updates de um mesmo usuário (ou, sem usuário, de um mesmo chat) são
+    processados um de cada vez e na ordem de chegada. Updates sem nenhum
+    dos dois não têm restrição de ordem.
+    """
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return ('user', update.effective_user.id)
+    if update.effective_chat is not None:
+        return ('chat', update.effective_chat.id)
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processa updates de usuários diferentes em paralelo, mantendo a ordem
+    dos updates de um mesmo usuário.
+
+    O `ConversationHandler` assume que os updates de uma conversa chegam um
+    de cada vez. Cada usuário tem uma trava FIFO, de modo que os seus updates
+    rodam um por vez e na ordem em que chegaram, enquanto os de outros
+    usuários seguem em paralelo, até `max_concurrent_updates` ao mesmo tempo.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        # O semáforo da classe base é tomado antes de `do_process_update`;
+        # com o limite real nele, updates parados na fila de um mesmo usuário
+        # ocupariam vagas e atrasariam os dos demais. Por isso ele recebe um
+        # limite que nunca é atingido e o limite real fica no semáforo
+        # próprio, tomado depois da trava do usuário.
+        super().__init__(sys.maxsize)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # chave -> [trava, quantidade de updates aguardando ou em andamento]
+        self._locks = {}
+
+    @property
+    def active_keys(self):
+        """Quantidade de usuários com updates aguardando ou em processamento."""
+        return len(self._locks)
+
+    async def do_process_update(self, update, coroutine):
+        """Aguarda a vez do usuário e só então ocupa uma das vagas."""
+        if isinstance(update, Update) and update.message is not None:
+            # A data da mensagem tem resolução de segundos
+            UPDATE_LAG.observe(max(0.0, time.time() - update.message.date.timestamp()))
+
+        key = ordering_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        started = time.perf_counter()
+        try:
+            async with entry[0]:
+                UPDATE_ORDERING_WAIT.observe(time.perf_counter() - started)
+                async with self._slots:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass